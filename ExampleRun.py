@@ -1,49 +1,59 @@
 def run():
-    import Model
-    # get settings for HouseModel
-    settings = Model.getSettings()
-
-    # Create an instance of the HouseModel with given (or modified) settings
-    HousePVModel = Model.HouseModel(settings)
+    import math
+
+    from model import Settings
+    from sweep import Scenario, grid, relative, run_sweep
+    from timeseries import load_store
+
+    # settings for the HouseModel, the costs are per month
+    settings = Settings(
+        Lifetime = 12*10,
+        Price_PV = 1000,
+        Price_battery= 300,
+        Cost_buy = 0.25,
+        Sell_price = 0.05,
+        Demand_total = 3500
+    )
+    PV_availability, Demand = load_store().inputs(start=0, stop=720)
+
+    # run_sweep() solves one instance of the HouseModel per scenario and yields its KPIs
+    # Note, that the solver needs to be a Pyomo solver installed on this machine
+    solver_name = "appsi_highs"
+    [kpi_base] = run_sweep(settings, PV_availability, Demand, [Scenario()], solver_name, processes=1)
+    print("Capacity for the PV module: " + str(kpi_base.Cap_PV) + " kW")
+
+    # A scenario samples around the base settings by scaling inputs
+    # The example below has 90% of the price originally set in the settings
+    cheaper_PV = Scenario(scaling={"Price_PV": 0.9})
 
-    # The function sample_model() solves an instance of the HouseModel class returning the solved model and the
-    # solvers termination status
-    # Note, that the solver in Model.py line 156 needs to be changed to run with other solvers
-    [Result, Status] = HousePVModel.sample_model()
+    # Additional constraints can be activated with restrictions
+    # The example below again has 90% of the original PV cost but is forced to keep the PV capacity of the original
+    cheaper_PV_same_size = Scenario(scaling={"Price_PV": 0.9}, restrictions={"PVFixed": kpi_base.Cap_PV})
 
-    # The results can be read manually using the pyomo.environ class
-    
-    print("Demand at hour 123 of simulation: " + str(pyo.value(Result.Demand[123])) + " kWh")
+    results = {kpi.index: kpi for kpi in run_sweep(settings, PV_availability, Demand, [cheaper_PV, cheaper_PV_same_size], solver_name)}
 
-    # read results via getKPI
-    kpi_base = Model.getKPI([Result, Status])
-    print("Capacity for the PV module: " + str(kpi_base["Cap_PV"]) + " kWh")
+    # relative() gives relative changes against the base instead of absolute values, nan if the base is 0
+    def percent(change):
+        return "n/a (the base is 0)" if math.isnan(change) else str(round(change * 100, 2)) + "%"
 
-    # The sample_model function can use a dictionary to sample around the base settings by scaling inputs
-    # The example below has 90% of the price originally set in the settings
-    [cheaper_PV_cost_res, Status2] = HousePVModel.sample_model({"CostPV": 0.9, "CostBat": 1, "CostBuy": 1, "Demand": 1})
+    relative_changes = relative(results[0], kpi_base)
+    print("Reducing the price for PV has increased its installed capacity by " + percent(relative_changes["Cap_PV"]) + ".")
+    print("Reducing the price for PV has also increased the size of the installed battery by " + percent(relative_changes["Cap_Bat"]) + ".")
 
-    # Given a dictionary containing KPI's the function getKPI() will give relative changes instead of absolute values
-    relative_changes = Model.getKPI([cheaper_PV_cost_res, Status2], kpi_base)
-    print("Reducing the price for PV has increased its installed capacity by " + str(
-        round(relative_changes["Cap_PV"] * 100, 2)) + "%.")
-    print("Reducing the price for PV has also increased the size of the installed battery by" + str(
-        round(relative_changes["Cap_Bat"] * 100, 2)) + "%.")
-
-    # Additional constraints can be activated when giving sample_model() a second argument
-    # The example below again has 90% of the original PV cost but is forced to keep the PV capacity of the original
-    [cheap_PV_same_size, Status3] = HousePVModel.sample_model({"CostPV": 0.9, "CostBat": 1, "CostBuy": 1, "Demand": 1},
-                                                               {"PVFixed": kpi_base["Cap_PV"]})
-    new_relative_changes = Model.getKPI([cheap_PV_same_size, Status3], kpi_base)
-    print("The PV capacity changes by " + str(round(new_relative_changes["Cap_PV"]*100, 2)) + "% if the price is lowered" +
+    new_relative_changes = relative(results[1], kpi_base)
+    print("The PV capacity changes by " + percent(new_relative_changes["Cap_PV"]) + " if the price is lowered" +
           " by 10% but the capacity of PV is kept fixed by a restriction.")
-    print("The battery capacity changes by " + str(round(new_relative_changes["Cap_Bat"]*100, 2)) + "% if the price is lowered" +
+    print("The battery capacity changes by " + percent(new_relative_changes["Cap_Bat"]) + " if the price is lowered" +
           " by 10% but the capacity of PV is kept fixed by a restriction.")
     print("Under the same changes to the price of PV and the restriction of keeping the capacity fixed" +
           " the following changes happened.")
-    print("The share of self produced energy changes by " + str(round(new_relative_changes["Own_Gen"]*100, 2)) + "%.")
-    print("The total expenditures change by " + str(round(new_relative_changes["TOTEX"]*100, 2)) + "%.")
-    print("The capital expenditures change by " + str(round(new_relative_changes["CAPEX"]*100, 2)) + "%.")
+    print("The share of self produced energy changes by " + percent(new_relative_changes["Own_Gen"]) + ".")
+    print("The total expenditures change by " + percent(new_relative_changes["TOTEX"]) + ".")
+    print("The capital expenditures change by " + percent(new_relative_changes["CAPEX"]) + ".")
+
+    # Larger sensitivity studies are distributed over all cores, the KPIs arrive as the scenarios finish
+    for kpi in run_sweep(settings, PV_availability, Demand, grid(Price_PV=[0.8, 0.9, 1.1], Cost_buy=[0.9, 1.1]), solver_name):
+        print(kpi.scenario.scaling, kpi.Cap_PV, kpi.Cap_Bat)
 
 if __name__ == '__main__':
     run()
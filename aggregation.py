@@ -0,0 +1,427 @@
+import time
+
+import numpy as np
+import pyomo.environ as pyo
+from pydantic import BaseModel, ConfigDict
+from scipy.cluster.vq import kmeans2
+
+from model import HouseModel, Settings
+from profiling import timed
+from sweep import KPI_NAMES
+
+HOURS_PER_DAY = 24
+
+class Aggregation(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    # representative days, shape (k, 24)
+    PV_availability: np.ndarray
+    Demand: np.ndarray
+    # number of original days represented by each representative day, shape (k,)
+    weights: np.ndarray
+    # representative day of every original day, shape (days,)
+    assignment: np.ndarray
+
+    @property
+    def k(self) -> int:
+        return len(self.weights)
+
+    def expand(self, values: np.ndarray) -> np.ndarray:
+        """Map an hourly series over the representative days back to the original hours."""
+        return np.asarray(values).reshape(self.k, HOURS_PER_DAY)[self.assignment].ravel()
+
+
+def cluster_days(PV_availability: list[float], Demand: list[float], k: int, representation: str = "medoid", seed: int = 0) -> Aggregation:
+    """Cluster the days of the time series into k representative days with k-means.
+
+    Both series are scaled to their maximum before clustering. With
+    representation="medoid" every representative day is the original day
+    closest to its cluster center, rescaled to keep the weighted sums of both
+    series, with "centroid" it is the cluster mean.
+    """
+    PV_availability = np.asarray(PV_availability, dtype=float)
+    Demand = np.asarray(Demand, dtype=float)
+    if len(Demand) != len(PV_availability):
+        raise ValueError("Length of the Demand and PV_availability should be equal")
+    if len(Demand) % HOURS_PER_DAY != 0:
+        raise ValueError(f"Length of the time series should be a multiple of {HOURS_PER_DAY}")
+    days = len(Demand) // HOURS_PER_DAY
+    if not 1 <= k <= days:
+        raise ValueError(f"k should be between 1 and the number of days ({days})")
+
+    PV_days = PV_availability.reshape(days, HOURS_PER_DAY)
+    Demand_days = Demand.reshape(days, HOURS_PER_DAY)
+    features = np.hstack([
+        PV_days / max(PV_availability.max(), 1e-12),
+        Demand_days / max(Demand.max(), 1e-12),
+    ])
+
+    centroids, assignment = kmeans2(features, k, minit="++", seed=seed)
+    # drop empty clusters and renumber
+    used, assignment = np.unique(assignment, return_inverse=True)
+    centroids = centroids[used]
+    weights = np.bincount(assignment).astype(float)
+
+    if representation == "medoid":
+        medoids = np.empty(len(used), dtype=int)
+        for c in range(len(used)):
+            members = np.flatnonzero(assignment == c)
+            distance = np.linalg.norm(features[members] - centroids[c], axis=1)
+            medoids[c] = members[np.argmin(distance)]
+        # rescale so that the weighted sums of the series match the original ones
+        PV_rep = PV_days[medoids] * PV_availability.sum() / max(np.dot(weights, PV_days[medoids]).sum(), 1e-12)
+        Demand_rep = Demand_days[medoids] * Demand.sum() / max(np.dot(weights, Demand_days[medoids]).sum(), 1e-12)
+    elif representation == "centroid":
+        PV_rep = np.vstack([PV_days[assignment == c].mean(axis=0) for c in range(len(used))])
+        Demand_rep = np.vstack([Demand_days[assignment == c].mean(axis=0) for c in range(len(used))])
+    else:
+        raise ValueError("representation should be 'medoid' or 'centroid'")
+
+    return Aggregation(PV_availability=PV_rep, Demand=Demand_rep, weights=weights, assignment=assignment)
+
+
+class AggregatedHouseModel(HouseModel):
+    """HouseModel over k weighted representative days.
+
+    The battery state of charge is split into an intra-day part relative to
+    the start of each representative day (energy_battery) and an inter-day part
+    at the start of every original day (energy_battery_inter), which are linked
+    through the sequence of the original days. The state of charge stays
+    within [0, capacity_battery] over the whole year because the daily
+    maximum and minimum of the intra-day part are bounded for every day.
+
+    The costs of the hours are multiplied by the weights of their days, so
+    the duals of the KKT layers scale with the weights. The values of
+    bigm.compute_big_M are derived for the hourly model and are not valid
+    here; the big-M layer needs an M that also bounds the weighted duals.
+    """
+    dual_rows = {
+        "limit_pv": ("limit_PV", 1),
+        "eq_battery": ("eq_battery", -1),
+        "limit_battery_intra_max": ("limit_battery_intra_max", 1),
+        "limit_battery_intra_min": ("limit_battery_intra_min", 1),
+        "eq_battery_inter": ("eq_battery_inter", -1),
+        "limit_battery_max": ("limit_battery_max", 1),
+        "limit_battery_min": ("limit_battery_min", 1),
+        "eq_energy": ("eq_demand", -1),
+    }
+
+    def __init__(self, settings: Settings, aggregation: Aggregation, mutable: bool = False):
+        super().__init__(settings, aggregation.PV_availability.ravel(), aggregation.Demand.ravel(), mutable)
+        self.aggregation = aggregation
+        self.C = range(aggregation.k) # representative days
+        self.D = range(len(aggregation.assignment)) # original days
+        # weight of every hour
+        self.weights = np.repeat(aggregation.weights, HOURS_PER_DAY)
+        # list of (name, sign-constrained variable, inequality) complementarity pairs
+        self.complementarity = []
+
+    def _day(self, t: int) -> int:
+        return t // HOURS_PER_DAY
+
+    def _last_hour(self, c: int) -> int:
+        return c * HOURS_PER_DAY + HOURS_PER_DAY - 1
+
+    def _members(self, c: int) -> np.ndarray:
+        return np.flatnonzero(self.aggregation.assignment == c)
+
+    @timed("add_primal")
+    def add_primal(self) -> None:
+        par = self.parameters
+        PV_availability = self.PV_availability
+        Demand = par["Demand"]
+        assignment = self.aggregation.assignment
+        weights = self.weights
+        model = self.model
+        T = self.T
+        C = self.C
+        D = self.D
+
+        # Step 2: Define the decision variables
+        model.energy_PV = pyo.Var(T, within=pyo.NonNegativeReals)
+        # state of charge relative to the start of the representative day
+        model.energy_battery = pyo.Var(T, within=pyo.Reals)
+        model.energy_battery_in = pyo.Var(T, within=pyo.NonNegativeReals)
+        model.energy_battery_out = pyo.Var(T, within=pyo.NonNegativeReals)
+        model.energy_buy = pyo.Var(T, within=pyo.NonNegativeReals)
+        model.capacity_PV = pyo.Var(within=pyo.NonNegativeReals)
+        model.capacity_battery = pyo.Var(within=pyo.NonNegativeReals)
+        model.energy_sell = pyo.Var(T, within=pyo.NonNegativeReals)
+        # state of charge at the start of every original day
+        model.energy_battery_inter = pyo.Var(D, within=pyo.NonNegativeReals)
+        # daily maximum and minimum of the intra-day state of charge
+        model.energy_battery_max = pyo.Var(C, within=pyo.NonNegativeReals)
+        model.energy_battery_min = pyo.Var(C, within=pyo.NonPositiveReals)
+
+        self.variables["primal"] = {
+            "energy_PV": model.energy_PV,
+            "energy_battery": model.energy_battery,
+            "energy_battery_in": model.energy_battery_in,
+            "energy_battery_out": model.energy_battery_out,
+            "energy_buy": model.energy_buy,
+            "capacity_PV": model.capacity_PV,
+            "capacity_battery": model.capacity_battery,
+            "energy_sell": model.energy_sell,
+            "energy_battery_inter": model.energy_battery_inter,
+            "energy_battery_max": model.energy_battery_max,
+            "energy_battery_min": model.energy_battery_min,
+        }
+
+        model.delta_demand = pyo.Var(T, initialize=0)
+        model.delta_demand.fix(0)
+
+        # Step 3: Define objective, the hourly terms are weighted by the days they represent
+        model.primal_obj = pyo.Objective(
+            expr=par["Cost_PV"] * model.capacity_PV
+            + par["Cost_buy"] * sum(weights[i] * model.energy_buy[i] for i in T)
+            + par["Cost_battery"] * model.capacity_battery
+            - par["Sell_price"] * sum(weights[i] * model.energy_sell[i] for i in T),
+            sense=pyo.minimize,
+        )
+        model.primal_obj.deactivate()
+
+        # Step 4: Constraints
+        def rule_con_limit_pv(model, i):
+            return model.energy_PV[i] <= model.capacity_PV * PV_availability[i]
+        model.con_limit_pv = pyo.Constraint(T, rule = rule_con_limit_pv)
+
+        def rule_con_eq_battery(model, i):
+            previous = model.energy_battery[i - 1] if i % HOURS_PER_DAY else 0
+            return model.energy_battery[i] == previous - model.energy_battery_out[i] + model.energy_battery_in[i]
+        model.con_eq_battery = pyo.Constraint(T, rule = rule_con_eq_battery)
+
+        def rule_con_limit_battery_intra_max(model, i):
+            return model.energy_battery[i] <= model.energy_battery_max[self._day(i)]
+        model.con_limit_battery_intra_max = pyo.Constraint(T, rule = rule_con_limit_battery_intra_max)
+
+        def rule_con_limit_battery_intra_min(model, i):
+            return - model.energy_battery[i] <= - model.energy_battery_min[self._day(i)]
+        model.con_limit_battery_intra_min = pyo.Constraint(T, rule = rule_con_limit_battery_intra_min)
+
+        def rule_con_eq_battery_inter(model, d):
+            return model.energy_battery_inter[D[(d + 1) % len(D)]] == model.energy_battery_inter[d] + model.energy_battery[self._last_hour(assignment[d])]
+        model.con_eq_battery_inter = pyo.Constraint(D, rule = rule_con_eq_battery_inter)
+
+        def rule_con_limit_battery_max(model, d):
+            return model.energy_battery_inter[d] + model.energy_battery_max[assignment[d]] <= model.capacity_battery
+        model.con_limit_battery_max = pyo.Constraint(D, rule = rule_con_limit_battery_max)
+
+        def rule_con_limit_battery_min(model, d):
+            return - model.energy_battery_inter[d] - model.energy_battery_min[assignment[d]] <= 0
+        model.con_limit_battery_min = pyo.Constraint(D, rule = rule_con_limit_battery_min)
+
+        def rule_con_eq_energy(model, i):
+            return par["Demand_total"]  * (Demand[i] + model.delta_demand[i]) == model.energy_buy[i] + model.energy_battery_out[i] - model.energy_battery_in[i] + model.energy_PV[i] - model.energy_sell[i]
+        model.con_eq_energy = pyo.Constraint(T, rule = rule_con_eq_energy)
+
+        self.constraints["primal"] = {
+            "limit_pv": model.con_limit_pv,
+            "eq_battery": model.con_eq_battery,
+            "limit_battery_intra_max": model.con_limit_battery_intra_max,
+            "limit_battery_intra_min": model.con_limit_battery_intra_min,
+            "eq_battery_inter": model.con_eq_battery_inter,
+            "limit_battery_max": model.con_limit_battery_max,
+            "limit_battery_min": model.con_limit_battery_min,
+            "eq_energy": model.con_eq_energy,
+        }
+
+        model.dual = pyo.Suffix(direction=pyo.Suffix.IMPORT)
+
+
+    @timed("add_dual")
+    def add_dual(self) -> None:
+        if not "primal" in self.variables:
+            raise Exception("primal variables and constraints should be added first")
+        par = self.parameters
+        PV_availability = self.PV_availability
+        Demand = par["Demand"]
+        assignment = self.aggregation.assignment
+        weights = self.weights
+        model = self.model
+        T = self.T
+        C = self.C
+        D = self.D
+
+        # define dual variables
+        model.dual_limit_PV = pyo.Var(T, within=pyo.NonPositiveReals)
+        model.dual_eq_battery = pyo.Var(T, within=pyo.Reals)
+        model.dual_limit_battery_intra_max = pyo.Var(T, within=pyo.NonPositiveReals)
+        model.dual_limit_battery_intra_min = pyo.Var(T, within=pyo.NonPositiveReals)
+        model.dual_eq_battery_inter = pyo.Var(D, within=pyo.Reals)
+        model.dual_limit_battery_max = pyo.Var(D, within=pyo.NonPositiveReals)
+        model.dual_limit_battery_min = pyo.Var(D, within=pyo.NonPositiveReals)
+        model.dual_eq_demand = pyo.Var(T, within=pyo.Reals)
+
+        self.variables["dual"] = {
+            "limit_PV": model.dual_limit_PV,
+            "eq_battery": model.dual_eq_battery,
+            "limit_battery_intra_max": model.dual_limit_battery_intra_max,
+            "limit_battery_intra_min": model.dual_limit_battery_intra_min,
+            "eq_battery_inter": model.dual_eq_battery_inter,
+            "limit_battery_max": model.dual_limit_battery_max,
+            "limit_battery_min": model.dual_limit_battery_min,
+            "eq_demand": model.dual_eq_demand,
+        }
+
+        # dual objective
+        model.dual_obj = pyo.Objective(expr = sum(model.dual_eq_demand[i] * (Demand[i] + model.delta_demand[i]) * par["Demand_total"] for i in T), sense=pyo.maximize)
+        model.dual_obj.deactivate()
+
+        # dual feasibility constraints, one per primal variable
+        def rule_energy_buy(model, i):
+            return model.dual_eq_demand[i] <= weights[i] * par["Cost_buy"]
+        model.con_dual_energy_buy = pyo.Constraint(T, rule = rule_energy_buy)
+
+        def rule_energy_sell(model, i):
+            return - model.dual_eq_demand[i] <= - weights[i] * par["Sell_price"]
+        model.con_dual_energy_sell = pyo.Constraint(T, rule = rule_energy_sell)
+
+        def rule_energy_battery_out(model, i):
+            return model.dual_eq_demand[i] - model.dual_eq_battery[i] <= 0
+        model.con_dual_energy_battery_out = pyo.Constraint(T, rule = rule_energy_battery_out)
+
+        def rule_energy_battery_in(model, i):
+            return - model.dual_eq_demand[i] + model.dual_eq_battery[i] <= 0
+        model.con_dual_energy_battery_in = pyo.Constraint(T, rule = rule_energy_battery_in)
+
+        # the intra-day state of charge is free, so its dual constraint is an equality
+        def rule_energy_battery(model, i):
+            if (i + 1) % HOURS_PER_DAY:
+                following = model.dual_eq_battery[i + 1]
+            else:
+                following = sum(model.dual_eq_battery_inter[d] for d in self._members(self._day(i)))
+            return following - model.dual_eq_battery[i] + model.dual_limit_battery_intra_max[i] - model.dual_limit_battery_intra_min[i] == 0
+        model.con_dual_energy_battery = pyo.Constraint(T, rule = rule_energy_battery)
+
+        def rule_energy_PV(model, i):
+            return model.dual_eq_demand[i] + model.dual_limit_PV[i] <= 0
+        model.con_dual_energy_PV = pyo.Constraint(T, rule = rule_energy_PV)
+
+        def rule_energy_battery_inter(model, d):
+            return model.dual_eq_battery_inter[d] - model.dual_eq_battery_inter[D[d - 1]] + model.dual_limit_battery_max[d] - model.dual_limit_battery_min[d] <= 0
+        model.con_dual_energy_battery_inter = pyo.Constraint(D, rule = rule_energy_battery_inter)
+
+        def rule_energy_battery_max(model, c):
+            hours = range(c * HOURS_PER_DAY, (c + 1) * HOURS_PER_DAY)
+            return - sum(model.dual_limit_battery_intra_max[i] for i in hours) + sum(model.dual_limit_battery_max[d] for d in self._members(c)) <= 0
+        model.con_dual_energy_battery_max = pyo.Constraint(C, rule = rule_energy_battery_max)
+
+        # energy_battery_min is nonpositive, so its dual constraint is reversed
+        def rule_energy_battery_min(model, c):
+            hours = range(c * HOURS_PER_DAY, (c + 1) * HOURS_PER_DAY)
+            return sum(model.dual_limit_battery_intra_min[i] for i in hours) - sum(model.dual_limit_battery_min[d] for d in self._members(c)) >= 0
+        model.con_dual_energy_battery_min = pyo.Constraint(C, rule = rule_energy_battery_min)
+
+        model.con_dual_capacity_battery = pyo.Constraint(expr = - sum(model.dual_limit_battery_max[d] for d in D) <= par["Cost_battery"])
+        model.con_dual_capacity_PV = pyo.Constraint(expr = - sum(model.dual_limit_PV[i] * PV_availability[i] for i in T) <= par["Cost_PV"])
+
+        self.constraints["dual"] = {
+            "energy_buy": model.con_dual_energy_buy,
+            "energy_sell": model.con_dual_energy_sell,
+            "energy_battery_out": model.con_dual_energy_battery_out,
+            "energy_battery_in": model.con_dual_energy_battery_in,
+            "energy_battery": model.con_dual_energy_battery,
+            "energy_PV": model.con_dual_energy_PV,
+            "energy_battery_inter": model.con_dual_energy_battery_inter,
+            "energy_battery_max": model.con_dual_energy_battery_max,
+            "energy_battery_min": model.con_dual_energy_battery_min,
+            "capacity_battery": model.con_dual_capacity_battery,
+            "capacity_PV": model.con_dual_capacity_PV,
+        }
+
+        # every primal inequality with its dual variable and every sign-constrained
+        # primal variable with its dual constraint
+        self.complementarity = [
+            ("dual_limit_PV", model.dual_limit_PV, model.con_limit_pv),
+            ("dual_limit_battery_intra_max", model.dual_limit_battery_intra_max, model.con_limit_battery_intra_max),
+            ("dual_limit_battery_intra_min", model.dual_limit_battery_intra_min, model.con_limit_battery_intra_min),
+            ("dual_limit_battery_max", model.dual_limit_battery_max, model.con_limit_battery_max),
+            ("dual_limit_battery_min", model.dual_limit_battery_min, model.con_limit_battery_min),
+            ("energy_buy", model.energy_buy, model.con_dual_energy_buy),
+            ("energy_sell", model.energy_sell, model.con_dual_energy_sell),
+            ("energy_battery_out", model.energy_battery_out, model.con_dual_energy_battery_out),
+            ("energy_battery_in", model.energy_battery_in, model.con_dual_energy_battery_in),
+            ("energy_PV", model.energy_PV, model.con_dual_energy_PV),
+            ("energy_battery_inter", model.energy_battery_inter, model.con_dual_energy_battery_inter),
+            ("energy_battery_max", model.energy_battery_max, model.con_dual_energy_battery_max),
+            ("energy_battery_min", model.energy_battery_min, model.con_dual_energy_battery_min),
+            ("capacity_battery", model.capacity_battery, model.con_dual_capacity_battery),
+            ("capacity_PV", model.capacity_PV, model.con_dual_capacity_PV),
+        ]
+
+
+    def complementarity_pairs(self) -> list[tuple]:
+        if not ("primal" in self.variables and "dual" in self.variables):
+            raise Exception("primal and dual variables and constraints should be added first")
+
+        def slack(con):
+            return con.upper - con.body if con.has_ub() else con.body - con.lower
+
+        pairs = []
+        for name, var, con in self.complementarity:
+            if var.is_indexed():
+                pairs.append((name, var.index_set(), lambda i, var = var: var[i], lambda i, con = con: slack(con[i])))
+            else:
+                pairs.append((name, None, lambda i, var = var: var, lambda i, con = con: slack(con)))
+        return pairs
+
+
+    def get_kpis(self) -> dict[str, float]:
+        return _kpis(self, self.weights)
+
+
+def _kpis(house: HouseModel, weights: np.ndarray) -> dict[str, float]:
+    model = house.model
+    settings = house.settings
+    energy_PV = np.fromiter((v.value for v in model.energy_PV.values()), dtype=float)
+    energy_sell = np.fromiter((v.value for v in model.energy_sell.values()), dtype=float)
+    demand = settings.Demand_total * np.dot(weights, house.Demand)
+    return {
+        "Cap_PV": model.capacity_PV.value,
+        "Cap_Bat": model.capacity_battery.value,
+        "Own_Gen": float(np.dot(weights, energy_PV - energy_sell) / demand),
+        "TOTEX": pyo.value(model.primal_obj),
+        "CAPEX": settings.Cost_PV * model.capacity_PV.value + settings.Cost_battery * model.capacity_battery.value,
+    }
+
+
+class AggregationReport(BaseModel):
+    k: int
+    full: dict[str, float]
+    aggregated: dict[str, float]
+    # (aggregated - full) / full, nan if the full KPI is 0
+    relative_error: dict[str, float]
+    time_full: float
+    time_aggregated: float
+
+
+def error_report(settings: Settings, PV_availability: list[float], Demand: list[float], k: int, solver_name: str = "appsi_highs", **cluster_options) -> AggregationReport:
+    """Solve the primal model on the full time series and on k representative days and compare the KPIs."""
+    start = time.perf_counter()
+    full = HouseModel(settings, PV_availability, Demand)
+    full.add_primal()
+    full.model.primal_obj.activate()
+    full.solve(solver_name, tee=False)
+    kpi_full = _kpis(full, np.ones(len(full.T)))
+    time_full = time.perf_counter() - start
+
+    start = time.perf_counter()
+    aggregated = AggregatedHouseModel(settings, cluster_days(PV_availability, Demand, k, **cluster_options))
+    aggregated.add_primal()
+    aggregated.model.primal_obj.activate()
+    aggregated.solve(solver_name, tee=False)
+    kpi_aggregated = aggregated.get_kpis()
+    time_aggregated = time.perf_counter() - start
+
+    relative_error = {}
+    for name in KPI_NAMES:
+        reference = kpi_full[name]
+        relative_error[name] = (kpi_aggregated[name] - reference) / reference if reference else float("nan")
+    return AggregationReport(
+        k = k,
+        full = kpi_full,
+        aggregated = kpi_aggregated,
+        relative_error = relative_error,
+        time_full = time_full,
+        time_aggregated = time_aggregated,
+    )
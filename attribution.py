@@ -0,0 +1,267 @@
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from pydantic import BaseModel
+
+from cache import ResultCache
+from model import ArrayOutput, HouseModel, Settings
+from sweep import KPI_NAMES
+
+# time series that can be players, the names of the HouseModel arguments
+SERIES = ["PV_availability", "Demand"]
+
+class Player(BaseModel):
+    """An input that moves from its baseline to its actual value when the player joins a coalition."""
+    name: str
+    # a field of Settings or one of SERIES
+    field: str
+    # hours of a time series that the player moves, default all
+    hours: list[int] | None = None
+
+class Attribution(BaseModel):
+    method: str
+    players: list[str]
+    # KPI name -> value without any player (the baseline) and with all players (the actual inputs)
+    baseline: dict[str, float]
+    actual: dict[str, float]
+    # KPI name -> player -> Shapley value, they sum to actual - baseline
+    values: dict[str, dict[str, float]]
+    # KPI name -> player -> standard error of the sampled values, 0 for method="exact"
+    errors: dict[str, dict[str, float]]
+    # distinct coalitions evaluated, of them solved and read from the result cache
+    coalitions: int
+    solves: int
+    cache_hits: int
+    time: float
+
+
+def default_players(settings: Settings, baseline: Settings, baseline_series: dict[str, np.ndarray] | None = None) -> list[Player]:
+    """One player per Settings field that differs from the baseline, and one per time series with a baseline."""
+    players = [Player(name=name, field=name) for name in Settings.model_fields if getattr(settings, name) != getattr(baseline, name)]
+    players += [Player(name=name, field=name) for name in (baseline_series or {})]
+    return players
+
+def time_players(field: str, hours: int, parts: int = 4) -> list[Player]:
+    """Split a time series into parts consecutive blocks of hours, e.g. the quarters of a year."""
+    bounds = np.linspace(0, hours, parts + 1).round().astype(int)
+    return [Player(name=f"{field}[{start}:{stop}]", field=field, hours=list(range(start, stop))) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def _kpis(output: ArrayOutput, settings: Settings, Demand: np.ndarray) -> dict[str, float]:
+    # the KPIs of sweep.get_kpi from the arrays of a (possibly cached) solve
+    variables = output.variables
+    capacity_PV, capacity_battery = float(variables["capacity_PV"]), float(variables["capacity_battery"])
+    return {
+        "Cap_PV": capacity_PV,
+        "Cap_Bat": capacity_battery,
+        "Own_Gen": float((variables["energy_PV"].sum() - variables["energy_sell"].sum()) / (settings.Demand_total * np.sum(Demand))),
+        "TOTEX": output.objective,
+        "CAPEX": settings.Cost_PV * capacity_PV + settings.Cost_battery * capacity_battery,
+    }
+
+
+# state of a worker process, one mutable model per PV availability is re-solved for every coalition
+_worker = {}
+
+def _init_worker(players: list[Player], settings: Settings, baseline: Settings, series: dict, baseline_series: dict,
+                 solver_name: str, cache: str | None) -> None:
+    _worker.clear()
+    _worker.update(players=players, settings=settings, baseline=baseline, series=series, baseline_series=baseline_series,
+                   solver_name=solver_name, cache=ResultCache(cache) if cache is not None else None, houses={})
+
+def _inputs(mask: int) -> tuple[Settings, dict[str, np.ndarray]]:
+    """Settings and time series of a coalition, the players of the bits of mask take their actual values."""
+    update = {}
+    series = {name: np.array(_worker["baseline_series"].get(name, _worker["series"][name]), dtype=float) for name in SERIES}
+    for bit, player in enumerate(_worker["players"]):
+        if not mask >> bit & 1:
+            continue
+        if player.field in SERIES:
+            hours = slice(None) if player.hours is None else player.hours
+            series[player.field][hours] = _worker["series"][player.field][hours]
+        else:
+            update[player.field] = getattr(_worker["settings"], player.field)
+    return _worker["baseline"].model_copy(update=update), series
+
+def _solve(masks: list[int]) -> list[tuple[int, dict[str, float] | None, bool]]:
+    """Solve the coalitions in the given order, returns (mask, KPIs or None, cache hit) per coalition.
+
+    Consecutive coalitions that differ in few players only change a few
+    parameters of the mutable model, so a persistent solver re-solves them
+    from the previous basis. The PV availability is not a parameter, so
+    every PV availability gets its own model.
+    """
+    results = []
+    for mask in masks:
+        settings, series = _inputs(mask)
+        key = series["PV_availability"].tobytes()
+        house = _worker["houses"].get(key)
+        if house is None:
+            house = HouseModel(settings, series["PV_availability"], series["Demand"], mutable=True)
+            house.add_primal()
+            house.model.primal_obj.activate()
+            _worker["houses"][key] = house
+        house.update(settings=settings, demand=series["Demand"])
+        cache = _worker["cache"]
+        hits = cache.stats.hits if cache is not None else 0
+        try:
+            if cache is not None:
+                output = cache.solve(house, _worker["solver_name"])
+            else:
+                house.solve(_worker["solver_name"], tee=False)
+                output = house.get_arrays(duals=False, slacks=False) if house.status.optimal else None
+        except (RuntimeError, ValueError):
+            # persistent solvers raise if no solution can be loaded
+            output = None
+        hit = cache is not None and cache.stats.hits > hits
+        results.append((mask, _kpis(output, settings, series["Demand"]) if output is not None else None, hit))
+    return results
+
+
+def _chunks(chains: list[list[int]], parts: int) -> list[list[int]]:
+    # consecutive chains per task, so that every task keeps neighboring coalitions together
+    parts = max(1, min(parts, len(chains)))
+    bounds = np.linspace(0, len(chains), parts + 1).round().astype(int)
+    return [[mask for chain in chains[start:stop] for mask in chain] for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def shapley(
+    settings: Settings,
+    PV_availability: list[float],
+    Demand: list[float],
+    baseline: Settings,
+    baseline_series: dict[str, list[float]] | None = None,
+    players: list[Player] | None = None,
+    method: str = "exact",
+    permutations: int = 64,
+    seed: int = 0,
+    solver_name: str = "appsi_highs",
+    processes: int | None = None,
+    cache: str | None = None,
+) -> Attribution:
+    """Shapley values of the players for the KPIs of the primal model (see sweep.KPI_NAMES).
+
+    The value of a coalition is the KPI of the model whose players have
+    their actual inputs and all other inputs their baseline, e.g. Cap_Bat
+    for the actual Price_battery and Demand but the baseline of everything
+    else. The Shapley values of the players sum to the KPI of the actual
+    inputs minus the KPI of the baseline.
+
+    method="exact" evaluates all 2^n coalitions, in Gray code order, so that
+    consecutive coalitions differ in one player. method="permutation"
+    averages the marginal contributions along random orders of the players,
+    every order together with its reverse (antithetic sampling), and reports
+    the standard errors. Every order is a chain of coalitions that grow by
+    one player. Coalitions are evaluated once, in chunks of neighboring
+    coalitions per worker process, and with cache (a directory of
+    cache.ResultCache) the solutions are kept across calls and processes.
+
+    :param baseline_series: baselines of the time series that are players, e.g. {"Demand": flat}
+    :param players: default_players(settings, baseline, baseline_series)
+    :param permutations: number of sampled orders for method="permutation", rounded up to an even number
+    """
+    start_time = time.perf_counter()
+    series = {"PV_availability": np.asarray(PV_availability, dtype=float), "Demand": np.asarray(Demand, dtype=float)}
+    baseline_series = {name: np.asarray(values, dtype=float) for name, values in (baseline_series or {}).items()}
+    for name, values in baseline_series.items():
+        if name not in SERIES:
+            raise ValueError(f"unknown time series {name}, use one of {SERIES}")
+        if len(values) != len(series[name]):
+            raise ValueError(f"Length of the baseline of {name} should be equal to the length of {name}")
+    if players is None:
+        players = default_players(settings, baseline, baseline_series)
+    for player in players:
+        if player.field not in Settings.model_fields and player.field not in SERIES:
+            raise ValueError(f"{player.field} of player {player.name} is neither a field of Settings nor one of {SERIES}")
+        if player.field in SERIES and player.field not in baseline_series:
+            raise ValueError(f"player {player.name} needs a baseline of {player.field} in baseline_series")
+    n = len(players)
+    if n == 0:
+        raise ValueError("no players, the inputs do not differ from the baseline")
+    full = (1 << n) - 1
+
+    # Step 1: the coalitions, as chains of neighbors
+    rng = np.random.default_rng(seed)
+    if method == "exact":
+        if n > 20:
+            raise ValueError(f"{n} players need 2^{n} coalitions, use method='permutation'")
+        gray = [i ^ (i >> 1) for i in range(1 << n)]
+        parts = 4 * (processes or os.cpu_count() or 1)
+        chains = [gray[start:start + max(1, len(gray) // parts)] for start in range(0, len(gray), max(1, len(gray) // parts))]
+    elif method == "permutation":
+        orders = []
+        for _ in range(-(-permutations // 2)):
+            order = rng.permutation(n)
+            orders += [order, order[::-1]]
+        chains = [list(np.cumsum([0] + [1 << int(i) for i in order])) for order in orders]
+    else:
+        raise ValueError("method should be 'exact' or 'permutation'")
+    seen = set()
+    unique_chains = []
+    for chain in chains:
+        unique = [int(mask) for mask in chain if not (int(mask) in seen or seen.add(int(mask)))]
+        if unique:
+            unique_chains.append(unique)
+
+    # Step 2: evaluate every coalition once
+    values = {}
+    hits = 0
+    if processes is None:
+        processes = os.cpu_count() or 1
+    initargs = (players, settings, baseline, series, baseline_series, solver_name, cache)
+    if processes == 1:
+        _init_worker(*initargs)
+        batches = [_solve(chunk) for chunk in _chunks(unique_chains, 1)]
+    else:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=initargs) as pool:
+            futures = [pool.submit(_solve, chunk) for chunk in _chunks(unique_chains, 4 * processes)]
+            batches = [future.result() for future in as_completed(futures)]
+    for batch in batches:
+        for mask, kpis, hit in batch:
+            if kpis is None:
+                names = [player.name for bit, player in enumerate(players) if mask >> bit & 1]
+                raise Exception(f"the coalition {names} could not be solved to optimality")
+            values[mask] = kpis
+            hits += hit
+
+    # Step 3: Shapley values
+    shapley_values, errors = {}, {}
+    if method == "exact":
+        masks = np.arange(full + 1)
+        size = np.array([bin(mask).count("1") for mask in masks])
+        weight = np.array([math.factorial(s) * math.factorial(n - s - 1) / math.factorial(n) for s in range(n)])
+        for name in KPI_NAMES:
+            V = np.array([values[mask][name] for mask in masks])
+            shapley_values[name], errors[name] = {}, {}
+            for bit, player in enumerate(players):
+                without = masks[(masks >> bit & 1) == 0]
+                shapley_values[name][player.name] = float(np.sum(weight[size[without]] * (V[without | (1 << bit)] - V[without])))
+                errors[name][player.name] = 0.0
+    else:
+        for name in KPI_NAMES:
+            marginal = np.zeros((len(orders), n))
+            for k, (order, chain) in enumerate(zip(orders, chains)):
+                chain_values = np.array([values[int(mask)][name] for mask in chain])
+                marginal[k, order] = np.diff(chain_values)
+            # an order and its reverse are one sample
+            pairs = marginal.reshape(-1, 2, n).mean(axis=1)
+            mean = pairs.mean(axis=0)
+            error = pairs.std(axis=0, ddof=1) / np.sqrt(len(pairs)) if len(pairs) > 1 else np.full(n, np.nan)
+            shapley_values[name] = {player.name: float(mean[bit]) for bit, player in enumerate(players)}
+            errors[name] = {player.name: float(error[bit]) for bit, player in enumerate(players)}
+
+    return Attribution(
+        method = method,
+        players = [player.name for player in players],
+        baseline = values[0],
+        actual = values[full],
+        values = shapley_values,
+        errors = errors,
+        coalitions = len(values),
+        solves = len(values) - hits,
+        cache_hits = hits,
+        time = time.perf_counter() - start_time,
+    )
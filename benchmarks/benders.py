@@ -0,0 +1,45 @@
+"""Benders decomposition on the capacities against the monolithic primal LP.
+
+Run from the repository root:
+
+    python -m benchmarks.benders --hours 8760 --block 168 --processes 4
+    python -m benchmarks.benders --kkt
+"""
+import argparse
+import time
+
+from decomposition import benders
+from matrix import MatrixModel
+from model import Settings
+from timeseries import load_store
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hours", type=int, default=8760)
+    parser.add_argument("--block", type=int, default=168)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--tolerance", type=float, default=1e-5)
+    parser.add_argument("--kkt", action="store_true", help="solve the big-M KKT model of every block at the result")
+    args = parser.parse_args()
+
+    PV_availability, Demand = load_store().inputs(start=0, stop=args.hours)
+    settings = Settings(Lifetime=round(10 * 8760 / args.hours), Price_PV=1000, Price_battery=300, Cost_buy=0.25, Sell_price=0.05, Demand_total=3500)
+
+    start = time.perf_counter()
+    lp = MatrixModel(settings, PV_availability, Demand)
+    lp.add_primal()
+    lp.solve("primal_obj")
+    output = lp.get_output()
+    print(f"primal LP: PV {output.variables['capacity_PV']:.4f}  battery {output.variables['capacity_battery']:.4f}  "
+          f"cost {output.objective:.4f}  {time.perf_counter() - start:.2f} s")
+
+    result = benders(settings, PV_availability, Demand, block=args.block, tolerance=args.tolerance, kkt=args.kkt, processes=args.processes)
+    print(f"{'iteration':>9} {'PV':>9} {'battery':>9} {'lower':>11} {'upper':>11} {'gap':>9} {'cuts':>5} {'feas':>5} {'time':>7} {'master':>7} {'max':>7}")
+    for iteration in result.iterations:
+        upper = "-" if iteration.upper_bound is None else f"{iteration.upper_bound:.4f}"
+        gap = "-" if iteration.gap is None else f"{iteration.gap:.2e}"
+        print(f"{iteration.iteration:>9} {iteration.capacity_PV:>9.4f} {iteration.capacity_battery:>9.4f} {iteration.lower_bound:>11.4f} {upper:>11} "
+              f"{gap:>9} {iteration.optimality_cuts:>5} {iteration.feasibility_cuts:>5} {iteration.time:>7.3f} {iteration.master_time:>7.3f} {iteration.max_solve_time:>7.3f}")
+    statuses = {window.status for window in result.windows}
+    print(f"benders: PV {result.capacity_PV:.4f}  battery {result.capacity_battery:.4f}  lower {result.lower_bound:.4f}  upper {result.upper_bound:.4f}  "
+          f"converged {result.converged}  {result.time:.2f} s" + (f"  KKT windows {sorted(statuses)}" if args.kkt else ""))
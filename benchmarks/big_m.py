@@ -0,0 +1,52 @@
+"""Solve time and branch-and-bound nodes of the big-M KKT model with the global M against per-row M values.
+
+Run from the repository root:
+
+    python -m benchmarks.big_m --hours 72 168
+"""
+import argparse
+import time
+
+import numpy as np
+
+from bigm import compute_big_M
+from matrix import MatrixModel
+from model import Settings
+
+settings = Settings(
+    Lifetime = 12*10,
+    Price_PV = 1000,
+    Price_battery= 300,
+    Cost_buy = 0.25,
+    Sell_price = 0.05,
+    Demand_total = 3500
+)
+
+def solve(PV_availability, Demand, M, time_limit):
+    model = MatrixModel(settings, PV_availability, Demand)
+    model.add_primal()
+    model.add_dual()
+    model.add_big_M(M)
+    start = time.perf_counter()
+    model.solve("primal_obj", time_limit=time_limit)
+    elapsed = time.perf_counter() - start
+    result = model.result
+    return result, elapsed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hours", type=int, nargs="+", default=[48, 96, 168])
+    parser.add_argument("--M", type=float, default=100, help="the global M")
+    parser.add_argument("--time-limit", type=float, default=600)
+    args = parser.parse_args()
+
+    PV_availability = np.loadtxt("data/TS_PVAvail.csv")
+    Demand = np.loadtxt("data/TS_Demand.csv")
+
+    print(f"{'hours':>6} {'M':>8} {'time [s]':>9} {'nodes':>7} {'objective':>12} {'status':>7}")
+    for hours in args.hours:
+        PV, D = PV_availability[0:hours], Demand[0:hours]
+        for label, M in [("global", args.M), ("tight", compute_big_M(settings, PV, D)), ("refined", compute_big_M(settings, PV, D, refine=True))]:
+            result, elapsed = solve(PV, D, M, args.time_limit)
+            objective = f"{result.fun:.6f}" if result.fun is not None else "-"
+            print(f"{hours:>6} {label:>8} {elapsed:>9.2f} {result.mip_node_count or 0:>7} {objective:>12} {result.status:>7}")
@@ -0,0 +1,68 @@
+"""Build and solve time of the KKT model for every complementarity formulation and solver.
+
+Run from the repository root:
+
+    python -m benchmarks.complementarity --hours 96 168 --solvers highs cbc cplex
+"""
+import argparse
+import time
+
+import numpy as np
+from pyomo.opt import SolverFactory
+
+from bigm import compute_big_M
+from kkt import KKT
+from model import Settings
+
+settings = Settings(
+    Lifetime = 12*10,
+    Price_PV = 1000,
+    Price_battery= 300,
+    Cost_buy = 0.25,
+    Sell_price = 0.05,
+    Demand_total = 3500
+)
+
+def available(solver_name):
+    try:
+        return SolverFactory(solver_name).available(exception_flag=False)
+    except Exception:
+        return False
+
+def run(PV_availability, Demand, formulation, options, solver_name):
+    start = time.perf_counter()
+    house = KKT(settings, PV_availability, Demand, formulation, **options)
+    house.model.primal_obj.activate()
+    build = time.perf_counter() - start
+    start = time.perf_counter()
+    try:
+        solver_output = house.solve(solver_name, tee=False)
+        status = str(solver_output.solver.termination_condition)
+        objective = house.model.primal_obj()
+    except (NotImplementedError, RuntimeError, ValueError) as error:
+        status = type(error).__name__
+        objective = None
+    return build, time.perf_counter() - start, status, objective
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hours", type=int, nargs="+", default=[96, 168])
+    parser.add_argument("--solvers", nargs="+", default=["highs", "cbc", "glpk", "cplex", "gurobi"])
+    parser.add_argument("--formulations", nargs="+", default=["big-M", "SOS1", "indicator"])
+    args = parser.parse_args()
+
+    PV_availability = np.loadtxt("data/TS_PVAvail.csv")
+    Demand = np.loadtxt("data/TS_Demand.csv")
+    solvers = [name for name in args.solvers if available(name)]
+    print("available solvers:", ", ".join(solvers))
+
+    print(f"{'hours':>6} {'formulation':>11} {'solver':>8} {'build [s]':>10} {'solve [s]':>10} {'objective':>12} status")
+    for hours in args.hours:
+        PV, D = PV_availability[0:hours], Demand[0:hours]
+        M = compute_big_M(settings, PV, D, refine=True)
+        for formulation in args.formulations:
+            options = {"M": M} if formulation in ("big-M", "indicator") else {}
+            for solver_name in solvers:
+                build, solve, status, objective = run(PV, D, formulation, options, solver_name)
+                objective = f"{objective:.6f}" if objective is not None else "-"
+                print(f"{hours:>6} {formulation:>11} {solver_name:>8} {build:>10.2f} {solve:>10.2f} {objective:>12} {status}")
@@ -0,0 +1,77 @@
+"""Time of counterfactual.py over the horizon length, per round of the growing active set.
+
+Every horizon asks for the smallest demand change that raises the target
+variable by --increase (relative) above the optimum of the primal LP.
+
+Run from the repository root:
+
+    python -m benchmarks.counterfactual --hours 72 168 720 --time-limit 60
+"""
+import argparse
+import json
+import logging
+import time
+
+from counterfactual import counterfactual
+from model import HouseModel, Settings, UpperSettings
+from profiling import logger
+from timeseries import load_store
+
+def settings_for(hours: int) -> Settings:
+    # the investment costs are per horizon, a lifetime of 10 years keeps the full year bounded
+    return Settings(
+        Lifetime = round(10 * 8760 / hours),
+        Price_PV = 1000,
+        Price_battery= 300,
+        Cost_buy = 0.25,
+        Sell_price = 0.05,
+        Demand_total = 3500
+    )
+
+class Rounds(logging.Handler):
+    # collects the time of the "counterfactual" events, one per round
+    def __init__(self):
+        super().__init__()
+        self.times = []
+        self.start = time.perf_counter()
+
+    def emit(self, record):
+        event = json.loads(record.getMessage())
+        if event.get("event") == "counterfactual":
+            self.times.append(time.perf_counter() - self.start)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hours", type=int, nargs="+", default=[72, 168, 720])
+    parser.add_argument("--variable", default="capacity_battery")
+    parser.add_argument("--increase", type=float, default=0.2, help="relative increase of the target variable")
+    parser.add_argument("--max-rounds", type=int, default=6)
+    parser.add_argument("--time-limit", type=float, default=60, help="seconds per round")
+    args = parser.parse_args()
+
+    store = load_store()
+    logger.setLevel(logging.INFO)
+    print(f"{'hours':>6} {'LP [s]':>7} {'time [s]':>9} {'rounds':>6} {'released':>8} {'changed':>7} {'objective':>12} {'target':>9} status  end of each round [s]")
+    for hours in args.hours:
+        settings = settings_for(hours)
+        PV_availability, Demand = store.inputs(stop=hours)
+
+        start = time.perf_counter()
+        lp = HouseModel(settings, PV_availability, Demand)
+        lp.add_primal()
+        lp.model.primal_obj.activate()
+        lp.solve("appsi_highs", tee=False)
+        lp_time = time.perf_counter() - start
+        lower = (1 + args.increase) * getattr(lp.model, args.variable).value + 0.05
+
+        rounds = Rounds()
+        logger.addHandler(rounds)
+        try:
+            result = counterfactual(settings, PV_availability, Demand, UpperSettings(variable=args.variable, lower=lower),
+                                    max_rounds=args.max_rounds, time_limit=args.time_limit)
+        finally:
+            logger.removeHandler(rounds)
+        objective = f"{result.objective:>12.6f}" if result.objective is not None else f"{'-':>12}"
+        target = f"{result.target:>9.4f}" if result.target is not None else f"{'-':>9}"
+        round_times = " ".join(f"{elapsed:.2f}" for elapsed in rounds.times)
+        print(f"{hours:>6} {lp_time:>7.3f} {result.time:>9.2f} {result.rounds:>6} {result.released_hours:>8} {len(result.changed_hours):>7} {objective} {target} {result.status}  {round_times}")
@@ -0,0 +1,54 @@
+"""Capacity search of dispatch.py against the primal LP, time and deviation of the optimum.
+
+Run from the repository root:
+
+    python -m benchmarks.dispatch --hours 720 8760
+"""
+import argparse
+import time
+
+from dispatch import optimize_capacities, simulate
+from matrix import MatrixModel
+from model import Settings
+from timeseries import load_store
+
+def settings_for(hours: int) -> Settings:
+    # the investment costs are per horizon, a lifetime of 10 years keeps the full year bounded
+    return Settings(
+        Lifetime = round(10 * 8760 / hours),
+        Price_PV = 1000,
+        Price_battery= 300,
+        Cost_buy = 0.25,
+        Sell_price = 0.05,
+        Demand_total = 3500
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hours", type=int, nargs="+", default=[168, 720, 8760])
+    args = parser.parse_args()
+
+    store = load_store()
+    print(f"{'hours':>6} {'method':>9} {'time [s]':>9} {'TOTEX':>12} {'Cap_PV':>9} {'Cap_Bat':>9}")
+    for hours in args.hours:
+        settings = settings_for(hours)
+        PV_availability, Demand = store.inputs(stop=hours)
+
+        start = time.perf_counter()
+        lp = MatrixModel(settings, PV_availability, Demand)
+        lp.add_primal()
+        lp.solve("primal_obj")
+        output = lp.get_output()
+        elapsed = time.perf_counter() - start
+        print(f"{hours:>6} {'LP':>9} {elapsed:>9.3f} {output.objective:>12.6f} {output.variables['capacity_PV']:>9.4f} {output.variables['capacity_battery']:>9.4f}")
+
+        start = time.perf_counter()
+        result = optimize_capacities(settings, PV_availability, Demand)
+        elapsed = time.perf_counter() - start
+        print(f"{hours:>6} {'search':>9} {elapsed:>9.3f} {float(result.TOTEX):>12.6f} {float(result.capacity_PV):>9.4f} {float(result.capacity_battery):>9.4f}")
+
+        # the dispatch of the LP capacities has to reproduce the LP optimum
+        start = time.perf_counter()
+        check = simulate(settings, PV_availability, Demand, output.variables["capacity_PV"], output.variables["capacity_battery"])
+        elapsed = time.perf_counter() - start
+        print(f"{hours:>6} {'simulate':>9} {elapsed:>9.3f} {float(check.TOTEX):>12.6f}   deviation from the LP {float(check.TOTEX) - output.objective:.2e}")
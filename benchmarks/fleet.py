@@ -0,0 +1,43 @@
+"""Throughput of run_fleet against one Pyomo HouseModel per house.
+
+The fleet is made of the sample profiles, shifted by whole days and with a
+random Demand_total per house. Run from the repository root:
+
+    python -m benchmarks.fleet --houses 256 --hours 720 --processes 4
+"""
+import argparse
+import time
+
+import numpy as np
+
+from fleet import run_fleet
+from model import HouseModel, Settings
+from timeseries import load_store
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--houses", type=int, default=256)
+    parser.add_argument("--hours", type=int, default=720)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--pyomo", type=int, default=8, help="houses solved with HouseModel for comparison")
+    args = parser.parse_args()
+
+    PV_availability, Demand = load_store().inputs(start=0, stop=args.hours)
+    rng = np.random.default_rng(0)
+    PV = np.array([np.roll(PV_availability, 24 * house) for house in range(args.houses)])
+    D = np.array([np.roll(Demand, -24 * house) for house in range(args.houses)])
+    base = Settings(Lifetime=round(10 * 8760 / args.hours), Price_PV=1000, Price_battery=300, Cost_buy=0.25, Sell_price=0.05, Demand_total=3500)
+    settings = [base.model_copy(update={"Demand_total": base.Demand_total * factor}) for factor in rng.uniform(0.5, 2, args.houses)]
+
+    result = run_fleet(settings, PV, D, processes=args.processes)
+    print(f"fleet:  {args.houses} houses in {result.time:.2f} s, {result.houses_per_second:.1f} houses/s, {np.sum(result.status == 0)} optimal")
+
+    start = time.perf_counter()
+    for house in range(args.pyomo):
+        model = HouseModel(settings[house], PV[house], D[house])
+        model.add_primal()
+        model.model.primal_obj.activate()
+        model.solve("appsi_highs", tee=False)
+        assert abs(model.model.primal_obj() - result.columns["TOTEX"][house]) <= 1e-6 * abs(model.model.primal_obj())
+    elapsed = time.perf_counter() - start
+    print(f"pyomo:  {args.pyomo} houses in {elapsed:.2f} s, {args.pyomo / elapsed:.1f} houses/s")
@@ -0,0 +1,51 @@
+"""Solve time of the big-M KKT model without and with the LP-guided MIP start.
+
+Run from the repository root:
+
+    python -m benchmarks.lp_start --hours 168 720 --solver appsi_highs
+"""
+import argparse
+import time
+
+import numpy as np
+
+from bigm import compute_big_M
+from kkt import BigM_KKT
+from model import Settings
+
+settings = Settings(
+    Lifetime = 12*10,
+    Price_PV = 1000,
+    Price_battery= 300,
+    Cost_buy = 0.25,
+    Sell_price = 0.05,
+    Demand_total = 3500
+)
+
+def solve(PV_availability, Demand, M, solver_name, lp_start):
+    house = BigM_KKT(settings, PV_availability, Demand, M)
+    house.model.primal_obj.activate()
+    start = time.perf_counter()
+    if lp_start:
+        house.lp_start(solver_name)
+    solver_output = house.solve(solver_name, tee=False, warmstart=lp_start)
+    elapsed = time.perf_counter() - start
+    return str(solver_output.solver.termination_condition), house.model.primal_obj(), elapsed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hours", type=int, nargs="+", default=[168, 720])
+    parser.add_argument("--M", type=float, default=100, help="the global M")
+    parser.add_argument("--solver", default="appsi_highs", help="a solver that accepts warmstart=True")
+    args = parser.parse_args()
+
+    PV_availability = np.loadtxt("data/TS_PVAvail.csv")
+    Demand = np.loadtxt("data/TS_Demand.csv")
+
+    print(f"{'hours':>6} {'M':>8} {'start':>6} {'time [s]':>9} {'objective':>12} status")
+    for hours in args.hours:
+        PV, D = PV_availability[0:hours], Demand[0:hours]
+        for label, M in [("global", args.M), ("refined", compute_big_M(settings, PV, D, refine=True))]:
+            for lp_start in [False, True]:
+                status, objective, elapsed = solve(PV, D, M, args.solver, lp_start)
+                print(f"{hours:>6} {label:>8} {'LP' if lp_start else '-':>6} {elapsed:>9.2f} {objective:>12.6f} {status}")
@@ -0,0 +1,96 @@
+"""Build time and peak memory of the Pyomo and the sparse-matrix model builders.
+
+Run from the repository root:
+
+    python -m benchmarks.matrix_build
+    python -m benchmarks.matrix_build --parity --solver highs
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from model import HouseModel, Settings
+from matrix import MatrixModel
+
+settings = Settings(
+    Lifetime = 12*10,
+    Price_PV = 1000,
+    Price_battery= 300,
+    Cost_buy = 0.25,
+    Sell_price = 0.05,
+    Demand_total = 3500
+)
+
+def build(cls, PV_availability, Demand, layers, M = 100):
+    model = cls(settings, PV_availability, Demand)
+    model.add_primal()
+    if "dual" in layers:
+        model.add_dual()
+    if "big-M" in layers:
+        model.add_big_M(M)
+    return model
+
+def measure(cls, PV_availability, Demand, layers):
+    tracemalloc.start()
+    start = time.perf_counter()
+    model = build(cls, PV_availability, Demand, layers)
+    if cls is MatrixModel:
+        # include the assembly of the sparse matrix
+        model.A
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 2**20
+
+def check_parity(PV_availability, Demand, solver_name):
+    """Solve the primal and the dual LP with both builders and compare the results."""
+    for layers, objective in [(["primal"], "primal_obj"), (["primal", "dual"], "dual_obj")]:
+        house = build(HouseModel, PV_availability, Demand, layers)
+        getattr(house.model, objective).activate()
+        house.solve(solver_name)
+        expected = house.get_output()
+
+        matrix = build(MatrixModel, PV_availability, Demand, layers)
+        matrix.solve(objective)
+        actual = matrix.get_output()
+
+        assert list(expected.variables) == list(actual.variables), "variables differ"
+        assert np.isclose(expected.objective, actual.objective, rtol=1e-6), f"{objective}: {expected.objective} != {actual.objective}"
+        print(f"parity {objective}: {actual.objective:.6f} ok")
+
+    # the big-M layer has no objective, compare the dimensions of the generated problems
+    from pyomo.repn.plugins.standard_form import LinearStandardFormCompiler
+    house = build(HouseModel, PV_availability, Demand, ["primal", "dual", "big-M"])
+    house.model.primal_obj.activate()
+    repn = LinearStandardFormCompiler().write(house.model, mixed_form=True)
+    matrix = build(MatrixModel, PV_availability, Demand, ["primal", "dual", "big-M"])
+    A = matrix.A
+    A.eliminate_zeros()
+    # the fixed delta_demand columns are presolved away by Pyomo
+    n_fixed = len(matrix.T)
+    assert repn.A.shape == (A.shape[0], A.shape[1] - n_fixed), f"{repn.A.shape} != {A.shape}"
+    assert repn.A.nnz == A.nnz - n_fixed, f"{repn.A.nnz} != {A.nnz - n_fixed}"
+    print(f"parity big-M: {A.shape[0]} rows, {A.nnz - n_fixed} nonzeros ok")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hours", type=int, nargs="+", default=[720, 2190, 8760])
+    parser.add_argument("--parity", action="store_true", help="check the results against the Pyomo model")
+    parser.add_argument("--parity-hours", type=int, default=168)
+    parser.add_argument("--solver", default="cplex")
+    args = parser.parse_args()
+
+    PV_availability = np.loadtxt("data/TS_PVAvail.csv")
+    Demand = np.loadtxt("data/TS_Demand.csv")
+
+    if args.parity:
+        check_parity(PV_availability[0:args.parity_hours], Demand[0:args.parity_hours], args.solver)
+
+    layers = ["primal", "dual", "big-M"]
+    print(f"{'hours':>6} {'builder':>8} {'time [s]':>10} {'peak [MiB]':>11}")
+    for hours in args.hours:
+        for cls in (HouseModel, MatrixModel):
+            elapsed, peak = measure(cls, PV_availability[0:hours], Demand[0:hours], layers)
+            print(f"{hours:>6} {cls.__name__.replace('Model', ''):>8} {elapsed:>10.3f} {peak:>11.1f}")
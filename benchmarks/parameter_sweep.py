@@ -0,0 +1,61 @@
+"""Cost of a Cost_buy sweep: full rebuild per point against update() + persistent re-solve.
+
+Run from the repository root:
+
+    python -m benchmarks.parameter_sweep --solver appsi_highs
+"""
+import argparse
+import time
+
+import numpy as np
+
+from model import HouseModel, Settings
+
+settings = Settings(
+    Lifetime = 12*10,
+    Price_PV = 1000,
+    Price_battery= 300,
+    Cost_buy = 0.25,
+    Sell_price = 0.05,
+    Demand_total = 3500
+)
+
+def rebuild(PV_availability, Demand, prices, solver_name):
+    objectives = []
+    for price in prices:
+        model = HouseModel(settings.model_copy(update={"Cost_buy": price}), PV_availability, Demand)
+        model.add_primal()
+        model.model.primal_obj.activate()
+        model.solve(solver_name, tee=False)
+        objectives.append(model.model.primal_obj())
+    return objectives
+
+def persistent(PV_availability, Demand, prices, solver_name):
+    objectives = []
+    model = HouseModel(settings, PV_availability, Demand, mutable=True)
+    model.add_primal()
+    model.model.primal_obj.activate()
+    for price in prices:
+        model.update(settings=settings.model_copy(update={"Cost_buy": price}))
+        model.solve(solver_name, tee=False)
+        objectives.append(model.model.primal_obj())
+    return objectives
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hours", type=int, default=720)
+    parser.add_argument("--points", type=int, default=100)
+    parser.add_argument("--solver", default="appsi_highs", help="a persistent Pyomo solver")
+    args = parser.parse_args()
+
+    PV_availability = np.loadtxt("data/TS_PVAvail.csv")[0:args.hours]
+    Demand = np.loadtxt("data/TS_Demand.csv")[0:args.hours]
+    prices = np.linspace(0.15, 0.45, args.points)
+
+    results = {}
+    for run in (rebuild, persistent):
+        start = time.perf_counter()
+        results[run.__name__] = run(PV_availability, Demand, prices, args.solver)
+        elapsed = time.perf_counter() - start
+        print(f"{run.__name__:>10}: {elapsed:8.3f} s total, {1000*elapsed/args.points:8.2f} ms per point")
+    assert np.allclose(results["rebuild"], results["persistent"], rtol=1e-6), "objectives differ"
@@ -0,0 +1,39 @@
+"""Two-stage stochastic sizing: extensive form against progressive hedging.
+
+The scenarios are sampled from the bundled profiles by stochastic.sample_scenario.
+Run from the repository root:
+
+    python -m benchmarks.stochastic --scenarios 8 --hours 720 --processes 4
+    python -m benchmarks.stochastic --scenarios 50 --no-extensive
+"""
+import argparse
+
+from model import Settings
+from stochastic import ScenarioSettings, extensive_form, progressive_hedging
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", type=int, default=8)
+    parser.add_argument("--hours", type=int, default=8760)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--max-iterations", type=int, default=50)
+    parser.add_argument("--tolerance", type=float, default=1e-3)
+    parser.add_argument("--no-extensive", action="store_true", help="skip the extensive form")
+    args = parser.parse_args()
+
+    settings = Settings(Lifetime=round(10 * 8760 / args.hours), Price_PV=1000, Price_battery=300, Cost_buy=0.25, Sell_price=0.05, Demand_total=3500)
+    scenario_settings = ScenarioSettings(hours=args.hours)
+
+    if not args.no_extensive:
+        result = extensive_form(settings, args.scenarios, scenario_settings)
+        print(f"extensive form: PV {result.capacity_PV:.4f}  battery {result.capacity_battery:.4f}  cost {result.objective:.4f}  {result.time:.2f} s")
+
+    result = progressive_hedging(settings, args.scenarios, scenario_settings, processes=args.processes,
+                                 max_iterations=args.max_iterations, tolerance=args.tolerance)
+    print(f"{'iteration':>9} {'PV':>9} {'battery':>9} {'convergence':>12} {'time':>8} {'solve':>8} {'max':>8}")
+    for iteration in result.iterations:
+        print(f"{iteration.iteration:>9} {iteration.capacity_PV:>9.4f} {iteration.capacity_battery:>9.4f} {iteration.convergence:>12.2e} "
+              f"{iteration.time:>8.2f} {iteration.solve_time:>8.2f} {iteration.max_solve_time:>8.2f}")
+    lower_bound = "-" if result.lower_bound is None else f"{result.lower_bound:.4f}"
+    print(f"progressive hedging: PV {result.capacity_PV:.4f}  battery {result.capacity_battery:.4f}  cost {result.objective:.4f}  "
+          f"lower bound {lower_bound}  converged {result.converged}  {result.time:.2f} s")
@@ -0,0 +1,223 @@
+"""Benchmark suite over horizon length, formulation and solver.
+
+Every run builds one model in a fresh process and records the time of the
+phases build, write (LP file), solve and load, the peak memory of the
+process and the solver process, and the size of the model. The results are
+written as JSON and compared against a stored baseline.
+
+Run from the repository root:
+
+    python -m benchmarks.suite --hours 168 720 --output results.json
+    python -m benchmarks.suite --output results.json --baseline baseline.json
+    python -m benchmarks.suite --output baseline.json --save-baseline
+
+The exit code is 1 if a run is slower than the baseline by more than the
+tolerance, or if its status changed.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, the peak memory is then not recorded
+    resource = None
+
+import numpy as np
+import pyomo.environ as pyo
+from pydantic import BaseModel
+from pyomo.opt import SolverFactory
+from pyomo.repn import generate_standard_repn
+
+from bigm import compute_big_M
+from kkt import BigM_KKT, DualModel
+from model import HouseModel, Settings
+
+FORMULATIONS = ["primal", "dual", "big-M"]
+SOLVERS = ["highs", "glpk", "cbc"]
+PHASES = ["build", "write", "solve", "load"]
+
+class Run(BaseModel):
+    hours: int
+    formulation: str
+    solver: str
+    status: str
+    objective: float | None = None
+    # seconds per phase, the solve time of file based solvers includes their own write
+    build: float
+    write: float
+    solve: float | None = None
+    load: float | None = None
+    # peak resident memory in MB of this process and of the solver processes, None without the resource module
+    peak_rss: float | None
+    peak_rss_solver: float | None
+    variables: int
+    constraints: int
+    nonzeros: int
+
+    @property
+    def key(self) -> str:
+        return f"{self.hours}/{self.formulation}/{self.solver}"
+
+
+def settings_for(hours: int) -> Settings:
+    # the investment costs are per horizon, a lifetime of 10 years keeps the full year bounded
+    return Settings(
+        Lifetime = round(10 * 8760 / hours),
+        Price_PV = 1000,
+        Price_battery= 300,
+        Cost_buy = 0.25,
+        Sell_price = 0.05,
+        Demand_total = 3500
+    )
+
+def build(formulation: str, settings: Settings, PV_availability: np.ndarray, Demand: np.ndarray) -> HouseModel:
+    if formulation == "primal":
+        house = HouseModel(settings, PV_availability, Demand)
+        house.add_primal()
+        house.model.primal_obj.activate()
+    elif formulation == "dual":
+        house = DualModel(settings, PV_availability, Demand)
+        house.model.dual_obj.activate()
+    elif formulation == "big-M":
+        house = BigM_KKT(settings, PV_availability, Demand, compute_big_M(settings, PV_availability, Demand))
+        house.model.primal_obj.activate()
+    else:
+        raise ValueError(f"unknown formulation {formulation}, use one of {FORMULATIONS}")
+    return house
+
+def size(model: pyo.ConcreteModel) -> tuple[int, int, int]:
+    variables = sum(1 for var in model.component_data_objects(pyo.Var) if not var.fixed)
+    constraints = 0
+    nonzeros = 0
+    for con in model.component_data_objects(pyo.Constraint, active=True):
+        constraints += 1
+        nonzeros += len(generate_standard_repn(con.body, compute_values=True).linear_vars)
+    return variables, constraints, nonzeros
+
+def peak_rss(who: str) -> float | None:
+    if resource is None:
+        return None
+    # ru_maxrss is in kB on Linux
+    return resource.getrusage(getattr(resource, who)).ru_maxrss / 1024
+
+def run(hours: int, formulation: str, solver_name: str, time_limit: float) -> Run:
+    """Build, write, solve and load one model, called in a fresh process."""
+    PV_availability = np.loadtxt("data/TS_PVAvail.csv")[0:hours]
+    Demand = np.loadtxt("data/TS_Demand.csv")[0:hours]
+    settings = settings_for(hours)
+
+    start = time.perf_counter()
+    house = build(formulation, settings, PV_availability, Demand)
+    times = {"build": time.perf_counter() - start}
+    model = house.model
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        model.write(os.path.join(directory, "model.lp"))
+        times["write"] = time.perf_counter() - start
+
+    objective = None
+    start = time.perf_counter()
+    try:
+        with house.mip_duals_off():
+            results = SolverFactory(solver_name).solve(model, load_solutions=False, timelimit=time_limit)
+        times["solve"] = time.perf_counter() - start
+        status = str(results.solver.termination_condition)
+        if status == "optimal":
+            start = time.perf_counter()
+            model.solutions.load_from(results)
+            times["load"] = time.perf_counter() - start
+            objective = next(model.component_data_objects(pyo.Objective, active=True))()
+    except (RuntimeError, ValueError) as error:
+        status = f"error: {error}"
+
+    variables, constraints, nonzeros = size(model)
+    return Run(
+        hours = hours,
+        formulation = formulation,
+        solver = solver_name,
+        status = status,
+        objective = objective,
+        **times,
+        peak_rss = peak_rss("RUSAGE_SELF"),
+        peak_rss_solver = peak_rss("RUSAGE_CHILDREN"),
+        variables = variables,
+        constraints = constraints,
+        nonzeros = nonzeros,
+    )
+
+def compare(runs: list[Run], baseline: list[Run], tolerance: float, minimum: float) -> list[str]:
+    """Messages for every run that is slower than the baseline or whose status changed.
+
+    A phase counts as slower if it takes more than (1 + tolerance) times the
+    baseline and more than minimum seconds longer, so noise of short phases
+    is ignored.
+    """
+    baseline = {run.key: run for run in baseline}
+    regressions = []
+    for run in runs:
+        if run.key not in baseline:
+            continue
+        base = baseline[run.key]
+        if run.status != base.status:
+            regressions.append(f"{run.key}: status {base.status} -> {run.status}")
+        for phase in PHASES:
+            new, old = getattr(run, phase), getattr(base, phase)
+            if new is not None and old is not None and new > (1 + tolerance) * old and new - old > minimum:
+                regressions.append(f"{run.key}: {phase} {old:.3f}s -> {new:.3f}s ({new / old - 1:+.0%})")
+        if run.peak_rss is not None and base.peak_rss is not None and run.peak_rss > (1 + tolerance) * base.peak_rss:
+            regressions.append(f"{run.key}: peak_rss {base.peak_rss:.0f}MB -> {run.peak_rss:.0f}MB")
+    return regressions
+
+def load(path: str) -> list[Run]:
+    with open(path) as file:
+        return [Run(**run) for run in json.load(file)]
+
+def save(path: str, runs: list[Run]) -> None:
+    with open(path, "w") as file:
+        json.dump([run.model_dump() for run in runs], file, indent=1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hours", type=int, nargs="+", default=[168, 720, 2190, 8760])
+    parser.add_argument("--formulations", nargs="+", default=FORMULATIONS)
+    parser.add_argument("--solvers", nargs="+", default=SOLVERS)
+    parser.add_argument("--time-limit", type=float, default=600, help="time limit of every solve in seconds")
+    parser.add_argument("--output", default="benchmark.json", help="JSON file of the results")
+    parser.add_argument("--baseline", help="JSON file of earlier results to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="only write the results, no comparison")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown")
+    parser.add_argument("--minimum", type=float, default=0.05, help="allowed absolute slowdown in seconds")
+    args = parser.parse_args()
+
+    solvers = [name for name in args.solvers if SolverFactory(name).available(exception_flag=False)]
+    skipped = sorted(set(args.solvers) - set(solvers))
+    if skipped:
+        print("not installed:", ", ".join(skipped))
+
+    runs = []
+    print(f"{'hours':>6} {'formulation':>11} {'solver':>7} {'build':>7} {'write':>7} {'solve':>7} {'load':>7} {'RSS [MB]':>9} {'vars':>8} {'cons':>8} {'nnz':>9} status")
+    for hours in args.hours:
+        for formulation in args.formulations:
+            for solver_name in solvers:
+                # one process per run, so that the peak memory belongs to this run
+                with ProcessPoolExecutor(max_workers=1) as pool:
+                    result = pool.submit(run, hours, formulation, solver_name, args.time_limit).result()
+                runs.append(result)
+                phases = " ".join(f"{value:>7.2f}" if value is not None else f"{'-':>7}" for value in (getattr(result, phase) for phase in PHASES))
+                rss = f"{result.peak_rss:.0f}" if result.peak_rss is not None else "-"
+                print(f"{hours:>6} {formulation:>11} {solver_name:>7} {phases} {rss:>9} {result.variables:>8} {result.constraints:>8} {result.nonzeros:>9} {result.status}")
+    save(args.output, runs)
+
+    if args.baseline and not args.save_baseline:
+        regressions = compare(runs, load(args.baseline), args.tolerance, args.minimum)
+        for message in regressions:
+            print("regression", message)
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,46 @@
+"""Throughput of run_sweep for an increasing number of worker processes.
+
+Run from the repository root:
+
+    python -m benchmarks.sweep_scaling --processes 1 2 4 8
+"""
+import argparse
+import time
+
+import numpy as np
+
+from model import Settings
+from sweep import grid, run_sweep
+
+settings = Settings(
+    Lifetime = 12*10,
+    Price_PV = 1000,
+    Price_battery= 300,
+    Cost_buy = 0.25,
+    Sell_price = 0.05,
+    Demand_total = 3500
+)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hours", type=int, default=720)
+    parser.add_argument("--points", type=int, default=8, help="points per scaled field")
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--solver", default="appsi_highs")
+    args = parser.parse_args()
+
+    PV_availability = np.loadtxt("data/TS_PVAvail.csv")[0:args.hours]
+    Demand = np.loadtxt("data/TS_Demand.csv")[0:args.hours]
+    factors = np.linspace(0.8, 1.2, args.points)
+    scenarios = grid(Price_PV=factors, Price_battery=factors)
+
+    print(f"{len(scenarios)} scenarios, {args.hours} hours")
+    print(f"{'processes':>9} {'time [s]':>9} {'scenarios/s':>12} {'speedup':>8}")
+    reference = None
+    for processes in args.processes:
+        start = time.perf_counter()
+        kpis = list(run_sweep(settings, PV_availability, Demand, scenarios, args.solver, processes))
+        elapsed = time.perf_counter() - start
+        assert all(kpi.status == "optimal" for kpi in kpis)
+        reference = reference or elapsed
+        print(f"{processes:>9} {elapsed:>9.2f} {len(scenarios)/elapsed:>12.2f} {reference/elapsed:>8.2f}")
@@ -0,0 +1,98 @@
+import numpy as np
+
+from matrix import MatrixModel
+from model import Settings
+
+def capacity_bounds(settings: Settings, PV_availability: list[float], Demand: list[float], refine: bool = False) -> tuple[float, float]:
+    """Upper bounds of capacity_PV and capacity_battery in every optimal solution.
+
+    Buying all energy is feasible, so an optimal solution costs at most
+    Cost_buy * E with E the total demand. With a cyclic battery the sold
+    energy is at most the bought energy plus the PV energy minus E, so
+
+        capacity_PV * (Cost_PV - Sell_price * sum(PV)) + Cost_battery * capacity_battery <= (Cost_buy - Sell_price) * E
+
+    With refine=True the bounds are tightened by maximizing each capacity
+    over the optimal face of the primal LP (three LP solves).
+    """
+    PV_availability = np.asarray(PV_availability, dtype=float)
+    Demand = np.asarray(Demand, dtype=float)
+    energy = settings.Demand_total * Demand.sum()
+    spread = settings.Cost_buy - settings.Sell_price
+    margin = settings.Cost_PV - settings.Sell_price * PV_availability.sum()
+    if margin <= 0:
+        raise ValueError("selling PV energy pays more than the PV costs, the model is unbounded")
+    if settings.Cost_battery <= 0:
+        raise ValueError("Cost_battery should be positive to bound the battery capacity")
+    capacity_PV = spread * energy / margin
+    capacity_battery = spread * energy / settings.Cost_battery
+
+    if refine:
+        lp = MatrixModel(settings, PV_availability, Demand)
+        lp.add_primal()
+        lp.solve("primal_obj")
+        if not lp.status.optimal:
+            raise Exception(f"the primal LP could not be solved: {lp.status.message}")
+        # restrict to the optimal face, with a small tolerance for the solver accuracy
+        cols, vals, _ = lp.objectives["primal_obj"]
+        optimum = lp.result.fun
+        lp._add_rows([(0, cols, vals)], -np.inf, optimum + 1e-7 * max(1.0, abs(optimum)), size=1)
+        bounds = []
+        for name in ["capacity_PV", "capacity_battery"]:
+            lp.objectives["max_" + name] = ([lp.columns[name]], [1.0], "maximize")
+            lp.solve("max_" + name)
+            if not lp.status.optimal:
+                raise Exception(f"the bound of {name} could not be computed: {lp.status.message}")
+            bounds.append(-lp.result.fun)
+        # add a small relative margin so that the bounds stay valid for the MILP tolerances
+        capacity_PV = min(capacity_PV, bounds[0] * (1 + 1e-6) + 1e-9)
+        capacity_battery = min(capacity_battery, bounds[1] * (1 + 1e-6) + 1e-9)
+
+    return capacity_PV, capacity_battery
+
+
+def compute_big_M(settings: Settings, PV_availability: list[float], Demand: list[float], refine: bool = False) -> dict[str, float | np.ndarray]:
+    """Per-row big-M values for HouseModel.add_big_M and MatrixModel.add_big_M.
+
+    The values bound every complementarity pair for at least one optimal
+    primal-dual solution of the cyclic model:
+
+    - dual_eq_demand lies in [Sell_price, Cost_buy] and dual_eq_battery equals it
+    - -dual_limit_PV can be chosen as dual_eq_demand <= Cost_buy
+    - -dual_limit_battery can be chosen <= min(Cost_battery, Cost_buy - Sell_price)
+    - the capacities are bounded by capacity_bounds(), which bounds the hourly
+      energies; simultaneous charging and discharging is removed without cost
+
+    The bounds only hold for the given data, so the delta_demand variables
+    have to stay fixed. They are not valid for AggregatedHouseModel, whose
+    duals are scaled by the weights of the representative days.
+    """
+    PV_availability = np.asarray(PV_availability, dtype=float)
+    Demand = np.asarray(Demand, dtype=float)
+    capacity_PV, capacity_battery = capacity_bounds(settings, PV_availability, Demand, refine)
+    spread = settings.Cost_buy - settings.Sell_price
+    dual_limit_battery = min(settings.Cost_battery, spread)
+
+    return {
+        "dual_limit_PV_A": settings.Cost_buy,
+        "dual_limit_PV_B": capacity_PV * PV_availability,
+        "dual_limit_battery_A": dual_limit_battery,
+        "dual_limit_battery_B": capacity_battery,
+        "energy_buy_A": settings.Demand_total * Demand + capacity_battery,
+        "energy_buy_B": spread,
+        "energy_sell_A": capacity_PV * PV_availability + capacity_battery,
+        "energy_sell_B": spread,
+        "energy_battery_out_A": capacity_battery,
+        # dual_eq_battery equals dual_eq_demand, so these slacks are always 0
+        "energy_battery_out_B": 0.0,
+        "energy_battery_in_A": capacity_battery,
+        "energy_battery_in_B": 0.0,
+        "energy_battery_A": capacity_battery,
+        "energy_battery_B": spread + dual_limit_battery,
+        "energy_PV_A": capacity_PV * PV_availability,
+        "energy_PV_B": spread,
+        "capacity_battery_A": capacity_battery,
+        "capacity_battery_B": settings.Cost_battery,
+        "capacity_PV_A": capacity_PV,
+        "capacity_PV_B": settings.Cost_PV,
+    }
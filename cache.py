@@ -0,0 +1,248 @@
+import hashlib
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+import numpy as np
+import pyomo.environ as pyo
+from pydantic import BaseModel
+
+from model import ArrayOutput, HouseModel
+from solvers import SolverSettings, read_solver_settings
+
+class CacheStats(BaseModel):
+    hits: int = 0
+    misses: int = 0
+    stores: int = 0
+    evictions: int = 0
+    # seconds spent in loading hits and in solving misses
+    hit_time: float = 0.0
+    miss_time: float = 0.0
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.0
+
+
+def _update(digest, value) -> None:
+    # feed nested settings, options and arrays into the hash in a canonical form
+    if isinstance(value, np.ndarray):
+        array = np.ascontiguousarray(value, dtype=float)
+        digest.update(f"array{array.shape}".encode())
+        digest.update(array.tobytes())
+    elif isinstance(value, dict):
+        digest.update(b"dict")
+        for key in sorted(value, key=str):
+            digest.update(str(key).encode())
+            _update(digest, value[key])
+    elif isinstance(value, (list, tuple)):
+        digest.update(b"list")
+        for item in value:
+            _update(digest, item)
+    elif isinstance(value, BaseModel):
+        digest.update(type(value).__name__.encode())
+        digest.update(value.model_dump_json().encode())
+    else:
+        digest.update(repr(value).encode())
+    digest.update(b";")
+
+def scenario_key(house: HouseModel, solver_name: str | SolverSettings | None, options: dict | None = None) -> str:
+    """Hash of everything that determines the result of house.solve().
+
+    The settings, the input arrays, the model class with its layers,
+    formulation options and boundary states, the UpperSettings of
+    add_upper_level, the weights and assignment of an aggregation, the
+    active objectives, the values of all fixed variables (e.g. fixed
+    capacities or delta_demand) and the solver with its options. Without a
+    solver the settings of solverSettings.txt are used, like in solve().
+    """
+    if solver_name is None:
+        solver_name = read_solver_settings()
+    model = house.model
+    digest = hashlib.sha256()
+    _update(digest, f"{type(house).__module__}.{type(house).__qualname__}")
+    _update(digest, house.settings)
+    _update(digest, np.asarray(house.PV_availability, dtype=float))
+    # update() keeps settings and Demand in sync with the mutable parameters
+    _update(digest, np.asarray(house.Demand, dtype=float))
+    _update(digest, sorted(house.constraints))
+    _update(digest, getattr(house, "options", {}))
+    _update(digest, [house.initial_battery, house.final_battery])
+    _update(digest, getattr(house, "upper_settings", None))
+    aggregation = getattr(house, "aggregation", None)
+    if aggregation is not None:
+        _update(digest, [aggregation.weights, np.asarray(aggregation.assignment)])
+    _update(digest, [obj.name for obj in model.component_data_objects(pyo.Objective, active=True)])
+    fixed = [(var.name, var.value) for var in model.component_data_objects(pyo.Var) if var.fixed]
+    _update(digest, [name for name, _ in fixed])
+    _update(digest, np.array([value for _, value in fixed], dtype=float))
+    _update(digest, solver_name)
+    _update(digest, options or {})
+    return digest.hexdigest()
+
+
+@contextmanager
+def _locked(path: str):
+    """Exclusive lock on the file path, across processes."""
+    with open(path, "a+") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+            return
+        lock.seek(0)
+        msvcrt.locking(lock.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            lock.seek(0)
+            msvcrt.locking(lock.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class ResultCache:
+    """Content-addressed on-disk cache of solved models.
+
+    Results are stored as <directory>/<key[:2]>/<key>.npz (see ArrayOutput.save)
+    under the scenario_key of the model. Files are written to a temporary
+    name and renamed, so concurrent workers (processes or machines sharing
+    the directory) never read partial results; two workers that solve the
+    same scenario simply store the same file twice. A hit updates the
+    modification time, and when the directory grows beyond max_bytes the
+    least recently used results are removed, under an exclusive file lock.
+    The total size is kept in <directory>/.size and updated by every put, so
+    the directory is only walked when it has to be evicted (or .size is
+    missing). Only optimal results are stored.
+    """
+    def __init__(self, directory: str = ".cache", max_bytes: int = 2**30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".npz")
+
+    def get(self, key: str) -> ArrayOutput | None:
+        path = self.path(key)
+        try:
+            output = ArrayOutput.load(path)
+        except (FileNotFoundError, OSError, ValueError, KeyError):
+            # missing, evicted by another worker or unreadable
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return output
+
+    def put(self, key: str, output: ArrayOutput) -> None:
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp.npz")
+        os.close(handle)
+        try:
+            output.save(temporary)
+            size = os.path.getsize(temporary)
+            with _locked(self._lock):
+                total = self._read_size()
+                try:
+                    # another worker stored the same scenario
+                    size -= os.path.getsize(path)
+                except FileNotFoundError:
+                    pass
+                os.replace(temporary, path)
+                total += size
+                if total > self.max_bytes:
+                    total = self._evict()
+                self._write_size(total)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+        self.stats.stores += 1
+
+    @property
+    def _lock(self) -> str:
+        return os.path.join(self.directory, ".lock")
+
+    def _entries(self) -> list[tuple[float, int, str]]:
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".npz") or name.endswith(".tmp.npz"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+        return entries
+
+    def _read_size(self) -> int:
+        # called with the lock held, walks the directory once if the size is not recorded yet
+        try:
+            with open(os.path.join(self.directory, ".size")) as file:
+                return int(file.read())
+        except (FileNotFoundError, ValueError):
+            return sum(size for _, size, _ in self._entries())
+
+    def _write_size(self, total: int) -> None:
+        with open(os.path.join(self.directory, ".size"), "w") as file:
+            file.write(str(total))
+
+    def _evict(self) -> int:
+        # called with the lock held, returns the size after the eviction
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self.stats.evictions += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        return total
+
+    def evict(self) -> None:
+        """Remove the least recently used results until the cache fits in max_bytes."""
+        with _locked(self._lock):
+            self._write_size(self._evict())
+
+    def solve(self, house: HouseModel, solver_name: str | SolverSettings | None = "appsi_highs", options: dict | None = None, tee: bool = False) -> ArrayOutput | None:
+        """Cached house.solve(solver_name, options=options) followed by house.get_arrays().
+
+        Returns None if the solve is not optimal. On a hit the model is not
+        solved, so its variables keep their values.
+        """
+        start = time.perf_counter()
+        key = scenario_key(house, solver_name, options)
+        output = self.get(key)
+        if output is not None:
+            self.stats.hits += 1
+            self.stats.hit_time += time.perf_counter() - start
+            return output
+
+        self.stats.misses += 1
+        solver_output = house.solve(solver_name, tee = tee, options = options)
+        output = None
+        if str(solver_output.solver.termination_condition) == "optimal":
+            output = house.get_arrays()
+            self.put(key, output)
+        self.stats.miss_time += time.perf_counter() - start
+        return output
+
+    def clear(self) -> None:
+        with _locked(self._lock):
+            for root, _, files in os.walk(self.directory):
+                for name in files:
+                    if name.endswith(".npz"):
+                        os.remove(os.path.join(root, name))
+            self._write_size(0)
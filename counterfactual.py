@@ -0,0 +1,155 @@
+import json
+import time
+
+import numpy as np
+import pyomo.environ as pyo
+from pydantic import BaseModel, ConfigDict
+
+from bigm import compute_big_M
+from kkt import BigM_KKT
+from model import Settings, UpperSettings
+from profiling import logger
+from solvers import SolverSettings
+
+class Counterfactual(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    # delta_demand of every hour, zero outside the changed hours
+    delta_demand: np.ndarray
+    changed_hours: list[int]
+    # upper_obj (L1 norm or number of changed hours) and the value of the target variable
+    objective: float | None = None
+    target: float | None = None
+    # the status of the last round if it released all hours, else "restricted":
+    # the best solution of a model with fixed binaries, not a proven optimum
+    status: str
+    rounds: int
+    # hours with free complementarity binaries in the last round
+    released_hours: int
+    time: float
+
+
+def rank_hours(house: BigM_KKT) -> np.ndarray:
+    """Hours ordered by the change of the energy price dual_eq_demand around them, after lp_start().
+
+    The price changes where the house switches between buying, storing and
+    selling, the hours in which a change of the demand moves the battery and
+    PV use most. Ties keep the order of time.
+    """
+    price = np.array([house.model.dual_eq_demand[i].value for i in house.T], dtype=float)
+    jump = np.abs(np.diff(price, append=price[:1]))
+    score = jump + np.roll(jump, 1)
+    return np.argsort(-score, kind="stable")
+
+
+def _window(hours: list[int], window: int, length: int) -> set[int]:
+    released = set()
+    for i in hours:
+        released.update(range(max(i - window, 0), min(i + window + 1, length)))
+    return released
+
+
+def counterfactual(
+    settings: Settings,
+    PV_availability: list[float],
+    Demand: list[float],
+    upper_settings: UpperSettings,
+    solver_name: str = "appsi_highs",
+    focus_hours: int = 24,
+    window: int = 6,
+    max_rounds: int = 6,
+    time_limit: float | None = None,
+    tolerance: float = 1e-6,
+    M: float | dict | None = None,
+) -> Counterfactual:
+    """Smallest delta_demand that reaches the target of upper_settings, by a growing active set.
+
+    The big-M KKT model with add_upper_level is built once, with delta_demand
+    released in upper_settings.candidate_hours (default all hours). The
+    active set is the set of hours whose complementarity binaries are free,
+    all other binaries are fixed to the pattern of the primal LP (lp_start).
+    A fixed pattern is still complementary, so every solution is optimal for
+    the lower level, the restriction only shrinks the search.
+
+    Round 1 fixes all binaries, which leaves an LP (plus the binaries of a
+    cardinality norm): the smallest change that keeps the LP basis pattern,
+    e.g. a scaled demand. Every further round frees the binaries within
+    window hours of the changed hours of the best solution and of the
+    focus_hours hours ranked first by rank_hours, and re-solves from the
+    best solution, which stays feasible. focus_hours and window double every
+    round, until the objective improves by less than tolerance or all
+    binaries are free. Rounds without any solution keep releasing hours.
+    Only a last round with all binaries free that is solved to optimality
+    proves the optimum, otherwise the status is "restricted".
+
+    The counterfactual is optimistic: if the primal LP has several optimal
+    solutions, the target is reached by one of them, a re-solve of the LP
+    with the changed demand can return another one of the same cost.
+
+    :param time_limit: seconds per round, passed to the solver
+    :param M: big-M values, default compute_big_M for the demand plus max_increase
+    """
+    start = time.perf_counter()
+    Demand = np.asarray(Demand, dtype=float)
+    if M is None:
+        max_increase = upper_settings.max_increase if upper_settings.max_increase is not None else float(Demand.max())
+        M = compute_big_M(settings, PV_availability, Demand + max_increase)
+    solver_settings = SolverSettings(solver=solver_name, time_limit=time_limit)
+
+    house = BigM_KKT(settings, PV_availability, Demand, M)
+    house.lp_start(solver_name)
+    ranking = rank_hours(house)
+    binaries = [binary for binary in house.variables["big-M"].values() if binary.is_indexed()]
+    for binary in binaries:
+        for i in binary:
+            binary[i].fix(round(binary[i].value))
+    house.add_upper_level(upper_settings)
+
+    best = None
+    released = set()
+    for rounds in range(1, max_rounds + 1):
+        # the solution of the previous round is feasible for this one
+        house.solve(solver_settings, tee=False, warmstart=best is not None)
+        status = house.status
+        logger.info(json.dumps({"event": "counterfactual", "round": rounds, "released": len(released), "status": status.status, "objective": status.objective}))
+        complete = len(released) == len(house.T)
+        improved = status.feasible and (best is None or status.objective < best.objective - tolerance * max(1.0, abs(best.objective)))
+        if improved:
+            delta = np.array([house.model.delta_demand[i].value for i in house.T], dtype=float)
+            target = house.variables["primal"][upper_settings.variable]
+            best = Counterfactual(
+                delta_demand = delta,
+                changed_hours = [int(i) for i in np.flatnonzero(np.abs(delta) > 1e-9 * max(1.0, float(Demand.max())))],
+                objective = status.objective,
+                target = pyo.value(sum(target.values()) if target.is_indexed() else target),
+                status = status.status,
+                rounds = rounds,
+                released_hours = len(released),
+                time = 0.0,
+            )
+        # without a solution yet the active set grows until it holds all hours
+        if complete or (best is not None and not improved):
+            break
+
+        # grow the active set around the changed and the highest ranked hours
+        focus = list(ranking[:focus_hours]) + (best.changed_hours if best is not None else [])
+        grown = _window(focus, window, len(house.T))
+        for binary in binaries:
+            for i in grown - released:
+                if i in binary:
+                    binary[i].unfix()
+        released |= grown
+        # a persistent solver would remove and re-add every row of the unfixed binaries one by one,
+        # loading the model again is much faster
+        house.solver = None
+        focus_hours *= 2
+        window *= 2
+
+    if best is None:
+        best = Counterfactual(delta_demand = np.zeros(len(Demand)), changed_hours = [], status = status.status if complete else "restricted",
+                              rounds = rounds, released_hours = len(released), time = 0.0)
+    else:
+        best.status = status.status if complete and status.optimal else "restricted"
+    best.rounds = rounds
+    best.time = time.perf_counter() - start
+    return best
@@ -0,0 +1,536 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pyomo.environ as pyo
+import scipy.sparse as sp
+from pydantic import BaseModel
+from scipy.optimize import linprog
+
+from kkt import BigM_KKT
+from matrix import MatrixModel
+from model import Settings, UpperSettings
+from profiling import logger
+
+class Window(BaseModel):
+    # hours [start, stop) are solved, hours [start, core_stop) are kept
+    start: int
+    core_stop: int
+    stop: int
+    initial_battery: float
+    final_battery: float | None = None
+
+class WindowResult(BaseModel):
+    window: Window
+    status: str
+    # cost of the kept hours, without the capacity costs
+    objective: float | None = None
+    time: float
+    # values of the kept hours for every hourly variable
+    variables: dict[str, list[float]] = {}
+
+class DecompositionResult(BaseModel):
+    capacity_PV: float
+    capacity_battery: float
+    # full-year primal LP, a lower bound of every stitched solution
+    lower_bound: float
+    # cost of the stitched solution, None if a window failed
+    upper_bound: float | None
+    gap: float | None
+    windows: list[WindowResult]
+    variables: dict[str, list[float]]
+    time: float
+
+class BendersIteration(BaseModel):
+    iteration: int
+    # capacities of the master problem in this iteration
+    capacity_PV: float
+    capacity_battery: float
+    # objective of the master problem, and the cost of the best capacities and battery states so far
+    lower_bound: float
+    upper_bound: float | None
+    gap: float | None
+    # cuts added in this iteration
+    optimality_cuts: int
+    feasibility_cuts: int
+    # wall time of the iteration, of the master problem, and the sum and maximum of the block solve times
+    time: float
+    master_time: float
+    solve_time: float
+    max_solve_time: float
+
+class BendersResult(BaseModel):
+    capacity_PV: float
+    capacity_battery: float
+    # state of charge at the end of every block
+    battery: list[float]
+    lower_bound: float
+    upper_bound: float | None
+    gap: float | None
+    converged: bool
+    iterations: list[BendersIteration]
+    # big-M KKT model of every block, with kkt=True
+    windows: list[WindowResult]
+    variables: dict[str, list[float]]
+    time: float
+
+
+def make_windows(hours: int, window: int, overlap: int) -> list[tuple[int, int, int]]:
+    """Split range(hours) into (start, core_stop, stop) windows whose kept cores tile the horizon."""
+    if window <= overlap:
+        raise ValueError("window should be longer than the overlap")
+    core = window - overlap
+    windows = []
+    for start in range(0, hours, core):
+        core_stop = min(start + core, hours)
+        windows.append((start, core_stop, min(start + window, hours)))
+    return windows
+
+
+def solve_window(settings: Settings, PV_availability: np.ndarray, Demand: np.ndarray, window: Window,
+                 capacity_PV: float, capacity_battery: float, M: float, solver_name: str) -> WindowResult:
+    """Solve the big-M KKT model of one window for fixed capacities."""
+    start_time = time.perf_counter()
+    house = BigM_KKT(
+        settings, PV_availability[window.start:window.stop], Demand[window.start:window.stop], M,
+        initial_battery = window.initial_battery, final_battery = window.final_battery,
+    )
+    model = house.model
+    # the capacities are coordinated across the windows, so they are no decisions of the window
+    model.capacity_PV.fix(capacity_PV)
+    model.capacity_battery.fix(capacity_battery)
+    for name in ["capacity_PV", "capacity_battery"]:
+        house.constraints["dual"][name].deactivate()
+        house.constraints["big-M"][name + "_A"].deactivate()
+        house.constraints["big-M"][name + "_B"].deactivate()
+        house.variables["big-M"][name].fix(0)
+    model.primal_obj.activate()
+
+    try:
+        solver_output = house.solve(solver_name, tee=False)
+        status = str(solver_output.solver.termination_condition)
+    except RuntimeError as error:
+        status = f"error: {error}"
+    if status != "optimal":
+        return WindowResult(window=window, status=status, time=time.perf_counter() - start_time)
+
+    core = window.core_stop - window.start
+    variables = {}
+    for name, var in model.component_map(pyo.Var, active=True).items():
+        if var.is_indexed():
+            variables[name] = [var[i].value for i in range(core)]
+    buy = np.array(variables["energy_buy"])
+    sell = np.array(variables["energy_sell"])
+    objective = settings.Cost_buy * buy.sum() - settings.Sell_price * sell.sum()
+    return WindowResult(window=window, status=status, objective=objective, variables=variables, time=time.perf_counter() - start_time)
+
+
+def rolling_horizon(
+    settings: Settings,
+    PV_availability: list[float],
+    Demand: list[float],
+    window: int = 168,
+    overlap: int = 24,
+    M: float = 100,
+    mode: str = "sequential",
+    capacities: tuple[float, float] | None = None,
+    solver_name: str = "highs",
+    processes: int | None = None,
+) -> DecompositionResult:
+    """Solve the big-M KKT model over a long horizon in overlapping windows.
+
+    The capacities are coordinated by the full-year primal LP (or given as
+    (capacity_PV, capacity_battery)) and fixed in every window. The LP also
+    gives the lower bound. With mode="sequential" every window starts from the
+    state of charge at the end of the kept hours of the previous window and
+    the overlap hours are solved but dropped. With mode="parallel" the windows
+    start and end at the state of charge of the LP, which makes them
+    independent, so they are solved in a process pool without overlap.
+    The last window ends at the initial state of the year, so the stitched
+    solution is a feasible cyclic schedule and its cost is an upper bound.
+    """
+    start_time = time.perf_counter()
+    PV_availability = np.asarray(PV_availability, dtype=float)
+    Demand = np.asarray(Demand, dtype=float)
+    hours = len(Demand)
+
+    # Step 1: coordination, full-year LP with free or fixed capacities
+    lp = MatrixModel(settings, PV_availability, Demand)
+    lp.add_primal()
+    if capacities is not None:
+        for name, value in zip(["capacity_PV", "capacity_battery"], capacities):
+            lp.fix(name, value)
+    lp.solve("primal_obj")
+    if not lp.status.optimal:
+        raise Exception(f"the full-year LP could not be solved: {lp.status.message}")
+    lp_output = lp.get_output()
+    capacity_PV = lp_output.variables["capacity_PV"]
+    capacity_battery = lp_output.variables["capacity_battery"]
+    lower_bound = lp_output.objective
+    battery = np.asarray(lp_output.variables["energy_battery"])
+    # cyclic: the state before the first hour is the state at the last hour
+    initial_battery = float(battery[-1])
+
+    # Step 2: windows
+    results = []
+    if mode == "sequential":
+        state = initial_battery
+        for start, core_stop, stop in make_windows(hours, window, overlap):
+            final = initial_battery if stop == hours else None
+            result = solve_window(settings, PV_availability, Demand, Window(start=start, core_stop=core_stop, stop=stop, initial_battery=state, final_battery=final),
+                                  capacity_PV, capacity_battery, M, solver_name)
+            results.append(result)
+            if result.status != "optimal":
+                break
+            state = result.variables["energy_battery"][-1]
+    elif mode == "parallel":
+        windows = [
+            Window(start=start, core_stop=stop, stop=stop, initial_battery=float(battery[start - 1]), final_battery=float(battery[stop - 1]))
+            for start, _, stop in make_windows(hours, window, 0)
+        ]
+        with ProcessPoolExecutor(max_workers=processes or os.cpu_count() or 1) as pool:
+            futures = [
+                pool.submit(solve_window, settings, PV_availability, Demand, w, capacity_PV, capacity_battery, M, solver_name)
+                for w in windows
+            ]
+            results = [future.result() for future in futures]
+    else:
+        raise ValueError("mode should be 'sequential' or 'parallel'")
+
+    # Step 3: stitch the kept hours and compare with the bound
+    variables = {}
+    upper_bound = None
+    gap = None
+    if all(result.status == "optimal" for result in results) and results[-1].window.core_stop == hours:
+        for name in results[0].variables:
+            variables[name] = [value for result in results for value in result.variables[name]]
+        variables["capacity_PV"] = [capacity_PV]
+        variables["capacity_battery"] = [capacity_battery]
+        upper_bound = settings.Cost_PV * capacity_PV + settings.Cost_battery * capacity_battery + sum(result.objective for result in results)
+        gap = (upper_bound - lower_bound) / abs(upper_bound) if upper_bound else 0.0
+
+    return DecompositionResult(
+        capacity_PV = capacity_PV,
+        capacity_battery = capacity_battery,
+        lower_bound = lower_bound,
+        upper_bound = upper_bound,
+        gap = gap,
+        windows = results,
+        variables = variables,
+        time = time.perf_counter() - start_time,
+    )
+
+
+# columns of a block that are decisions of the Benders master problem
+COUPLING = ["capacity_PV", "capacity_battery", "initial_battery", "final_battery"]
+
+def _linprog(c: np.ndarray, A: sp.csr_matrix, row_lb: np.ndarray, row_ub: np.ndarray, lb: np.ndarray, ub: np.ndarray):
+    """scipy.optimize.linprog for row_lb <= A x <= row_ub, the equality rows keep their order in eqlin."""
+    equal = row_lb == row_ub
+    upper = ~equal & np.isfinite(row_ub)
+    lower = ~equal & np.isfinite(row_lb)
+    return linprog(
+        c,
+        A_ub = sp.vstack([A[upper], -A[lower]]), b_ub = np.concatenate([row_ub[upper], -row_lb[lower]]),
+        A_eq = A[equal], b_eq = row_lb[equal],
+        bounds = np.column_stack([lb, ub]), method = "highs",
+    )
+
+
+class _Block:
+    """Primal LP of the hours of one block for fixed capacities and states of charge at both ends.
+
+    The columns of COUPLING are fixed by their bounds, so their reduced costs
+    are a subgradient of the operating cost of the block with respect to the
+    master decisions, the slopes of the optimality cut. With highspy one
+    HiGHS instance is kept per block and re-solves from its previous basis,
+    otherwise every solve is a scipy.optimize.linprog call.
+    """
+    def __init__(self, settings: Settings, PV_availability: np.ndarray, Demand: np.ndarray):
+        lp = MatrixModel(settings, PV_availability, Demand)
+        lp.add_primal()
+        n = len(Demand)
+        battery = lp.columns["energy_battery"]
+        initial = lp.n_cols
+        # MatrixModel is cyclic, the first hour starts from the initial state instead of the last hour
+        matrix = lp.A.tocoo()
+        link = np.flatnonzero((matrix.row == lp.constraints["primal"]["eq_battery"][0]) & (matrix.col == battery[n - 1]))[0]
+        matrix.col[link] = initial
+        self.A = sp.csr_matrix((matrix.data, (matrix.row, matrix.col)), shape=(lp.n_rows, lp.n_cols + 1))
+        self.A.sort_indices()
+        self.row_lb, self.row_ub = lp.row_lb, lp.row_ub
+        self.lb, self.ub = np.append(lp.lb, 0.0), np.append(lp.ub, np.inf)
+        # the capacity costs belong to the master problem
+        self.c = np.append(lp.c("primal_obj"), 0.0)
+        self.c[[lp.columns["capacity_PV"], lp.columns["capacity_battery"]]] = 0.0
+        self.coupling = np.array([lp.columns["capacity_PV"], lp.columns["capacity_battery"], initial, battery[n - 1]])
+        self.hourly = {name: index for name, index in lp.columns.items() if not isinstance(index, int)}
+
+        try:
+            import highspy
+        except ImportError:
+            highspy = None
+        self.highspy = highspy
+        self.highs = None
+        if highspy is not None:
+            highs = self.highs = highspy.Highs()
+            highs.setOptionValue("output_flag", False)
+            highs.setOptionValue("threads", 1)
+            highs.addVars(len(self.c), self.lb, self.ub)
+            highs.changeColsCost(len(self.c), np.arange(len(self.c), dtype=np.int32), self.c)
+            highs.addRows(self.A.shape[0], self.row_lb, self.row_ub, self.A.nnz, self.A.indptr[:-1].astype(np.int32),
+                          self.A.indices.astype(np.int32), self.A.data)
+
+    def solve(self, x: np.ndarray, values: bool = False) -> tuple[bool, float, np.ndarray, dict[str, list[float]]]:
+        """Solve for the master decisions x (in the order of COUPLING).
+
+        Returns (feasible, value, slopes, hourly variables). If the block is
+        feasible, value is its operating cost. Otherwise value is the L1
+        distance of x to the decisions for which the block is feasible. In
+        both cases value + slopes (x' - x) is a lower bound for x'.
+        """
+        lb, ub = self.lb.copy(), self.ub.copy()
+        lb[self.coupling] = ub[self.coupling] = x
+        if self.highs is not None:
+            self.highs.changeColsBounds(len(x), self.coupling.astype(np.int32), lb[self.coupling], ub[self.coupling])
+            self.highs.run()
+            status = self.highs.getModelStatus()
+            if status == self.highspy.HighsModelStatus.kOptimal:
+                solution = self.highs.getSolution()
+                col_value, col_dual = np.array(solution.col_value), np.array(solution.col_dual)
+                variables = {name: col_value[index].tolist() for name, index in self.hourly.items()} if values else {}
+                return True, float(self.highs.getInfo().objective_function_value), col_dual[self.coupling], variables
+            if status == self.highspy.HighsModelStatus.kUnbounded:
+                raise Exception("a block is unbounded, Cost_buy should not be below Sell_price")
+        else:
+            result = _linprog(self.c, self.A, self.row_lb, self.row_ub, lb, ub)
+            if result.status == 0:
+                slopes = result.lower.marginals[self.coupling] + result.upper.marginals[self.coupling]
+                variables = {name: result.x[index].tolist() for name, index in self.hourly.items()} if values else {}
+                return True, float(result.fun), slopes, variables
+            if result.status == 3:
+                raise Exception("a block is unbounded, Cost_buy should not be below Sell_price")
+        return (False, *self._phase_one(x), {})
+
+    def _phase_one(self, x: np.ndarray) -> tuple[float, np.ndarray]:
+        # min |x' - x| over the x' for which the block is feasible, the duals of x' - x = d+ - d- are the slopes
+        k = len(x)
+        rows = sp.hstack([self.A, sp.csr_matrix((self.A.shape[0], 2 * k))])
+        copies = sp.hstack([sp.csr_matrix((np.ones(k), (np.arange(k), self.coupling)), shape=(k, self.A.shape[1])), -sp.eye(k), sp.eye(k)])
+        result = _linprog(
+            np.concatenate([np.zeros(self.A.shape[1]), np.ones(2 * k)]),
+            sp.vstack([rows, copies]).tocsr(),
+            np.concatenate([self.row_lb, x]), np.concatenate([self.row_ub, x]),
+            np.concatenate([self.lb, np.zeros(2 * k)]), np.concatenate([self.ub, np.full(2 * k, np.inf)]),
+        )
+        if result.status != 0:
+            raise Exception(f"the feasibility problem of a block could not be solved: {result.message}")
+        return float(result.fun), result.eqlin.marginals[-k:]
+
+
+# state of a worker process, the blocks are built on first use and kept for the following iterations
+_worker = {}
+
+def _init_worker(settings: Settings, PV_availability: np.ndarray, Demand: np.ndarray) -> None:
+    _worker.clear()
+    _worker.update(settings=settings, PV_availability=PV_availability, Demand=Demand, blocks={})
+
+def _solve_blocks(tasks: list[tuple[int, int, int, np.ndarray]], values: bool = False) -> list[tuple]:
+    """Solve (index, start, stop, x) blocks, returns (index, feasible, value, slopes, variables, solve time) per block."""
+    results = []
+    for index, start, stop, x in tasks:
+        start_time = time.perf_counter()
+        block = _worker["blocks"].get(index)
+        if block is None:
+            block = _worker["blocks"][index] = _Block(_worker["settings"], _worker["PV_availability"][start:stop], _worker["Demand"][start:stop])
+        results.append((index, *block.solve(x, values), time.perf_counter() - start_time))
+    return results
+
+
+def benders(
+    settings: Settings,
+    PV_availability: list[float],
+    Demand: list[float],
+    block: int = 168,
+    max_iterations: int = 200,
+    tolerance: float = 1e-5,
+    kkt: bool = False,
+    M: float = 100,
+    solver_name: str = "highs",
+    processes: int | None = None,
+    upper_settings: UpperSettings | None = None,
+) -> BendersResult:
+    """Solve the full-year primal LP by Benders decomposition on the capacities.
+
+    This is Benders for the primal LP only: the cuts come from the LP duals
+    of the blocks, which do not exist for the upper level of the bilevel
+    counterfactual (delta_demand and its binaries), so upper_settings raises
+    a ValueError, use counterfactual.counterfactual for those queries.
+
+    The hours are split into blocks that are only coupled by the capacities
+    and the state of charge at their ends. The master LP chooses these and
+    estimates the operating cost of every block by its own cuts (multi-cut
+    Benders). Every block is then solved as primal LP for the master
+    decisions and returns an optimality cut, or, if it is infeasible, a
+    feasibility cut. The master objective is a lower bound and the cost of
+    the best master decisions with their block costs an upper bound. The
+    blocks are solved in a process pool and keep their LP, so they re-solve
+    from the previous basis in later iterations.
+
+    With kkt=True the big-M KKT model of every block is solved at the best
+    capacities and states of charge (see solve_window), in parallel, so the
+    full-year KKT solution is assembled without building the monolithic MILP.
+    The capacity rows of the dual are not part of the blocks, the
+    optimality of the capacities is certified by the bounds instead. This
+    only assembles the KKT solution of the LP optimum, delta_demand stays 0.
+
+    :param block: hours per block, a 1 hour remainder is added to the last block
+    :param tolerance: stop when (upper - lower) / |upper| is below
+    """
+    if upper_settings is not None:
+        raise ValueError("benders decomposes the primal LP only, the bilevel upper level is solved by counterfactual.counterfactual")
+    start_time = time.perf_counter()
+    PV_availability = np.asarray(PV_availability, dtype=float)
+    Demand = np.asarray(Demand, dtype=float)
+    hours = len(Demand)
+    if settings.Cost_buy < settings.Sell_price:
+        raise ValueError("Cost_buy below Sell_price makes the model unbounded")
+    blocks = [(start, stop) for start, _, stop in make_windows(hours, block, 0)]
+    if len(blocks) > 1 and blocks[-1][1] - blocks[-1][0] == 1:
+        blocks[-2:] = [(blocks[-2][0], hours)]
+    B = len(blocks)
+
+    # master columns: capacity_PV, capacity_battery, the state of charge at the end of every block and the cost of every block
+    n = 2 + 2 * B
+    state = 2 + np.arange(B)
+    theta = 2 + B + np.arange(B)
+    # master columns of the COUPLING decisions of every block, the first block starts from the state at the end of the last one (cyclic)
+    columns = [np.array([0, 1, state[b - 1], state[b]]) for b in range(B)]
+    cost = np.zeros(n)
+    cost[[0, 1]] = settings.Cost_PV, settings.Cost_battery
+    cost[theta] = 1.0
+    bounds = np.column_stack([np.zeros(n), np.full(n, np.inf)])
+    bounds[theta, 0] = -np.inf
+
+    def cut(b, slopes, x, value, optimality):
+        # value + slopes (x' - x) <= theta_b (optimality) or <= 0 (feasibility)
+        row = np.zeros(n)
+        np.add.at(row, columns[b], slopes)
+        if optimality:
+            row[theta[b]] = -1.0
+        return row, float(slopes @ x - value)
+
+    # initial cuts: the block sells at most its PV generation and the energy it takes from the battery
+    # (with Cost_buy >= Sell_price), which bounds the master problem unless PV is profitable without any demand
+    cuts, rhs = [], []
+    for b, (start, stop) in enumerate(blocks):
+        slopes = -settings.Sell_price * np.array([PV_availability[start:stop].sum(), 0.0, 1.0, -1.0])
+        row, bound = cut(b, slopes, np.zeros(4), -settings.Sell_price * settings.Demand_total * Demand[start:stop].sum(), True)
+        cuts.append(row)
+        rhs.append(bound)
+
+    processes = max(1, min(processes or os.cpu_count() or 1, B))
+    pool = ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(settings, PV_availability, Demand)) if processes > 1 else None
+    if pool is None:
+        _init_worker(settings, PV_availability, Demand)
+    chunks = [list(range(B))[part::processes] for part in range(processes)]
+
+    def solve(x, values=False):
+        tasks = [[(b, *blocks[b], x[columns[b]]) for b in chunk] for chunk in chunks]
+        if pool is None:
+            return _solve_blocks(tasks[0], values)
+        return [result for future in [pool.submit(_solve_blocks, task, values) for task in tasks] for result in future.result()]
+
+    iterations = []
+    best, upper_bound, gap, converged = None, None, None, False
+    try:
+        for iteration in range(1, max_iterations + 1):
+            iteration_start = time.perf_counter()
+            result = linprog(cost, A_ub=np.array(cuts), b_ub=np.array(rhs), bounds=bounds, method="highs")
+            if result.status == 3:
+                raise Exception("the master problem is unbounded, selling PV energy pays for the PV capacity")
+            if result.status != 0:
+                raise Exception(f"the master problem could not be solved: {result.message}")
+            x, lower_bound = result.x, float(result.fun)
+            master_time = time.perf_counter() - iteration_start
+
+            results = solve(x)
+            optimality_cuts = feasibility_cuts = 0
+            operating = 0.0
+            for b, feasible, value, slopes, _, _ in results:
+                operating += value if feasible else np.nan
+                if feasible and value <= x[theta[b]] + tolerance * max(abs(value), 1.0):
+                    continue
+                row, bound = cut(b, slopes, x[columns[b]], value, feasible)
+                cuts.append(row)
+                rhs.append(bound)
+                optimality_cuts += feasible
+                feasibility_cuts += not feasible
+            if not np.isnan(operating):
+                total = float(cost[:2] @ x[:2] + operating)
+                if upper_bound is None or total < upper_bound:
+                    best, upper_bound = x, total
+            gap = (upper_bound - lower_bound) / abs(upper_bound) if upper_bound else None
+            times = np.array([result[-1] for result in results])
+            iterations.append(BendersIteration(
+                iteration = iteration,
+                capacity_PV = float(x[0]),
+                capacity_battery = float(x[1]),
+                lower_bound = lower_bound,
+                upper_bound = upper_bound,
+                gap = gap,
+                optimality_cuts = optimality_cuts,
+                feasibility_cuts = feasibility_cuts,
+                time = time.perf_counter() - iteration_start,
+                master_time = master_time,
+                solve_time = float(times.sum()),
+                max_solve_time = float(times.max()),
+            ))
+            logger.info(json.dumps({"event": "benders", **iterations[-1].model_dump()}))
+            if gap is not None and gap <= tolerance or optimality_cuts + feasibility_cuts == 0:
+                converged = True
+                break
+        if best is None:
+            raise Exception("no feasible capacities were found")
+
+        # Step 2: the schedule of the best decisions, from the block LPs or the big-M KKT windows
+        windows = []
+        if kkt:
+            window_list = [
+                Window(start=start, core_stop=stop, stop=stop, initial_battery=float(best[state[b - 1]]), final_battery=float(best[state[b]]))
+                for b, (start, stop) in enumerate(blocks)
+            ]
+            arguments = [(settings, PV_availability, Demand, window, float(best[0]), float(best[1]), M, solver_name) for window in window_list]
+            if pool is None:
+                windows = [solve_window(*args) for args in arguments]
+            else:
+                windows = [future.result() for future in [pool.submit(solve_window, *args) for args in arguments]]
+            parts = [window.variables for window in windows] if all(window.status == "optimal" for window in windows) else []
+        else:
+            parts = [variables for _, _, _, _, variables, _ in sorted(solve(best, values=True), key=lambda result: result[0])]
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    variables = {}
+    if parts:
+        for name in parts[0]:
+            variables[name] = [value for part in parts for value in part[name]]
+        variables["capacity_PV"] = [float(best[0])]
+        variables["capacity_battery"] = [float(best[1])]
+
+    return BendersResult(
+        capacity_PV = float(best[0]),
+        capacity_battery = float(best[1]),
+        battery = best[state].tolist(),
+        lower_bound = iterations[-1].lower_bound,
+        upper_bound = upper_bound,
+        gap = gap,
+        converged = converged,
+        iterations = iterations,
+        windows = windows,
+        variables = variables,
+        time = time.perf_counter() - start_time,
+    )
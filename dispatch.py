@@ -0,0 +1,143 @@
+import numpy as np
+from pydantic import BaseModel, ConfigDict
+
+from bigm import capacity_bounds
+from model import Settings
+
+class Dispatch(BaseModel):
+    """Result of simulate(), every array has the broadcast shape of the capacities and profiles."""
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    capacity_PV: np.ndarray
+    capacity_battery: np.ndarray
+    energy_buy: np.ndarray
+    energy_sell: np.ndarray
+    # PV energy that is used or sold, the rest is curtailed
+    energy_PV: np.ndarray
+    CAPEX: np.ndarray
+    # primal_obj of HouseModel for these capacities
+    TOTEX: np.ndarray
+    # share of the demand covered by self produced energy, as Own_Gen in sweep.KPI
+    Own_Gen: np.ndarray
+    # cyclic state of charge at the start (and the end) of the horizon
+    initial_battery: np.ndarray
+
+
+def simulate(
+    settings: Settings,
+    PV_availability: np.ndarray,
+    Demand: np.ndarray,
+    capacity_PV: float | np.ndarray,
+    capacity_battery: float | np.ndarray,
+) -> Dispatch:
+    """Exact operating cost of the primal model for fixed capacities, without an LP.
+
+    With constant prices Cost_buy >= Sell_price and a lossless battery without
+    power limits, the optimal dispatch charges every PV surplus the battery can
+    take and discharges on every deficit: emptying the battery early never
+    costs anything and frees space for later surpluses.
+
+    Every hour maps the state of charge x to clip(x + surplus, 0, capacity),
+    and a composition of such clamps is again a clamp, so the final state is
+    clip(start + A, L, U) with A the total surplus. The first pass computes
+    A, L and U, the cyclic start state is U if A > 0 and L otherwise (every
+    state in [L, U] is cyclic if A == 0), and the second pass runs the
+    dispatch from it. Repeating the year from the final state instead
+    converges only slowly when a large battery gains little per year.
+
+    The capacities and the time series (shape (..., hours)) are broadcast, so
+    one call evaluates many capacity pairs and/or profiles. The loop runs over
+    the runs of hours with an unchanged sign of the PV surplus only.
+    """
+    if settings.Cost_buy < settings.Sell_price:
+        raise ValueError("Sell_price should not exceed Cost_buy, otherwise buying to sell is unbounded")
+    PV_availability = np.asarray(PV_availability, dtype=float)
+    Demand = np.asarray(Demand, dtype=float)
+    if PV_availability.shape[-1] != Demand.shape[-1]:
+        raise ValueError("Length of the Demand and PV_availability should be equal")
+    capacity_PV = np.asarray(capacity_PV, dtype=float)
+    capacity_battery = np.asarray(capacity_battery, dtype=float)
+    shape = np.broadcast_shapes(capacity_PV.shape, capacity_battery.shape, PV_availability.shape[:-1], Demand.shape[:-1])
+
+    # hourly surplus of PV over demand
+    production = capacity_PV[..., None] * PV_availability
+    net = production - settings.Demand_total * Demand
+    # hours in which no series changes its sign are merged: within such a run the battery only
+    # fills (or only empties), so the overflow (deficit) of the run follows from its sum
+    positive = (net > 0).reshape(-1, net.shape[-1])
+    starts = np.flatnonzero(np.concatenate([[True], np.any(positive[:, 1:] != positive[:, :-1], axis=0)]))
+    net = np.add.reduceat(net, starts, axis=-1)
+    # runs first, so that every step is one contiguous row
+    net = np.broadcast_to(net, shape + (len(starts),))
+    net = np.ascontiguousarray(np.moveaxis(net, -1, 0))
+    capacity = np.broadcast_to(capacity_battery, shape)
+
+    # final state = clip(start + shift, lower, upper)
+    shift = np.zeros(shape)
+    lower = np.zeros(shape)
+    upper = capacity.copy()
+    for surplus in net:
+        shift += surplus
+        np.clip(lower + surplus, 0, capacity, out=lower)
+        np.clip(upper + surplus, 0, capacity, out=upper)
+    initial = np.where(shift > 0, upper, lower)
+
+    state = initial.copy()
+    buy = np.zeros(shape)
+    overflow = np.zeros(shape)
+    for surplus in net:
+        level = state + surplus
+        buy += np.maximum(-level, 0)
+        overflow += np.maximum(level - capacity, 0)
+        np.clip(level, 0, capacity, out=state)
+
+    # a negative sell price curtails the overflow instead of selling it
+    sell = overflow if settings.Sell_price > 0 else np.zeros(shape)
+    energy_PV = np.broadcast_to(production.sum(axis=-1), shape) - (overflow - sell)
+    capex = settings.Cost_PV * capacity_PV + settings.Cost_battery * capacity_battery
+    demand = settings.Demand_total * Demand.sum(axis=-1)
+    return Dispatch.model_construct(
+        capacity_PV = np.broadcast_to(capacity_PV, shape),
+        capacity_battery = np.broadcast_to(capacity_battery, shape),
+        energy_buy = buy,
+        energy_sell = sell,
+        energy_PV = np.asarray(energy_PV),
+        CAPEX = np.broadcast_to(capex, shape),
+        TOTEX = np.asarray(capex + settings.Cost_buy * buy - settings.Sell_price * sell),
+        Own_Gen = np.asarray((energy_PV - sell) / demand),
+        initial_battery = initial,
+    )
+
+
+def optimize_capacities(
+    settings: Settings,
+    PV_availability: np.ndarray,
+    Demand: np.ndarray,
+    points: int = 17,
+    rounds: int = 30,
+    tolerance: float = 1e-7,
+) -> Dispatch:
+    """Optimal (capacity_PV, capacity_battery) of the primal model by a zooming grid search.
+
+    TOTEX is convex in the capacities (the value function of an LP in its
+    right-hand side plus linear costs), so the minimum lies near the best
+    point of a grid. Every round evaluates a points x points grid in one
+    simulate() call and shrinks the box to two grid cells around the best
+    point, until the box is smaller than tolerance times the bounds of
+    bigm.capacity_bounds.
+    """
+    bounds = np.array(capacity_bounds(settings, PV_availability, Demand))
+    lower = np.zeros(2)
+    upper = bounds.copy()
+    for _ in range(rounds):
+        grid_PV = np.linspace(lower[0], upper[0], points)
+        grid_battery = np.linspace(lower[1], upper[1], points)
+        result = simulate(settings, PV_availability, Demand, grid_PV[:, None], grid_battery[None, :])
+        i, j = np.unravel_index(np.argmin(result.TOTEX), result.TOTEX.shape)
+        best = np.array([grid_PV[i], grid_battery[j]])
+        step = (upper - lower) / (points - 1)
+        lower = np.maximum(best - 2 * step, 0)
+        upper = np.minimum(best + 2 * step, bounds)
+        if np.all(upper - lower <= tolerance * np.maximum(bounds, 1.0)):
+            break
+    return simulate(settings, PV_availability, Demand, best[0], best[1])
@@ -0,0 +1,152 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from pydantic import BaseModel, ConfigDict
+from scipy.optimize import Bounds, LinearConstraint, milp
+
+from matrix import MatrixModel
+from model import Settings
+from sweep import KPI_NAMES
+
+class FleetResult(BaseModel):
+    """Columnar results of a fleet, row h of every column belongs to house h."""
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    # KPI name (see sweep.KPI_NAMES) -> float array over the houses, nan if not optimal
+    columns: dict[str, np.ndarray]
+    # status of scipy.optimize.milp per house, 0 is optimal
+    status: np.ndarray
+    # wall time of the whole run in seconds, including the template of every worker
+    time: float
+
+    @property
+    def houses_per_second(self) -> float:
+        return len(self.status) / self.time if self.time > 0 else float("inf")
+
+
+class FleetTemplate:
+    """Primal LP (MatrixModel.add_primal) of one house, shared by all houses of the same length.
+
+    Only the PV availability in the rows limit_pv, the right-hand sides of
+    eq_energy and the costs differ between houses, so the sparse matrix is
+    assembled once and every house only overwrites these values.
+    """
+    def __init__(self, hours: int):
+        settings = Settings(Lifetime=1, Price_PV=1, Price_battery=1, Cost_buy=1, Sell_price=1, Demand_total=1)
+        lp = MatrixModel(settings, np.ones(hours), np.ones(hours))
+        lp.add_primal()
+        self.hours = hours
+        self.columns = lp.columns
+        self.A = lp.A
+        self.lb, self.ub = lp.lb, lp.ub
+        self.row_lb, self.row_ub = lp.row_lb, lp.row_ub
+        self.eq_energy = lp.constraints["primal"]["eq_energy"]
+
+        # positions in A.data of capacity_PV in limit_pv and of delta_demand in eq_energy, in the order of the hours
+        matrix = self.A.tocoo()
+        limit_pv = np.isin(matrix.row, lp.constraints["primal"]["limit_pv"]) & (matrix.col == lp.columns["capacity_PV"])
+        self.PV_entries = np.flatnonzero(limit_pv)[np.argsort(matrix.row[limit_pv], kind="stable")]
+        delta = np.isin(matrix.col, lp.columns["delta_demand"])
+        self.delta_entries = np.flatnonzero(delta)[np.argsort(matrix.row[delta], kind="stable")]
+
+    def solve(self, settings: Settings, PV_availability: np.ndarray, Demand: np.ndarray, **options) -> tuple[int, dict[str, float]]:
+        """Solve the primal LP of one house, returns the milp status and the KPIs."""
+        A = self.A.copy()
+        A.data[self.PV_entries] = -PV_availability
+        A.data[self.delta_entries] = -settings.Demand_total
+        row_lb, row_ub = self.row_lb.copy(), self.row_ub.copy()
+        row_lb[self.eq_energy] = row_ub[self.eq_energy] = settings.Demand_total * Demand
+
+        columns = self.columns
+        c = np.zeros(A.shape[1])
+        c[columns["capacity_PV"]] = settings.Cost_PV
+        c[columns["capacity_battery"]] = settings.Cost_battery
+        c[columns["energy_buy"]] = settings.Cost_buy
+        c[columns["energy_sell"]] = -settings.Sell_price
+        result = milp(c, constraints=LinearConstraint(A, row_lb, row_ub), bounds=Bounds(self.lb, self.ub), options=options)
+        if result.status != 0:
+            return result.status, {name: np.nan for name in KPI_NAMES}
+
+        x = result.x
+        capex = settings.Cost_PV * x[columns["capacity_PV"]] + settings.Cost_battery * x[columns["capacity_battery"]]
+        demand = settings.Demand_total * Demand.sum()
+        return result.status, {
+            "Cap_PV": x[columns["capacity_PV"]],
+            "Cap_Bat": x[columns["capacity_battery"]],
+            # share of the demand covered by self produced energy, as in sweep.get_kpi
+            "Own_Gen": (x[columns["energy_PV"]].sum() - x[columns["energy_sell"]].sum()) / demand,
+            "TOTEX": result.fun,
+            "CAPEX": capex,
+        }
+
+
+# state of a worker process, the template is built once and shared by all batches
+_worker = {}
+
+def _init_worker(hours: int, options: dict) -> None:
+    _worker.clear()
+    _worker.update(template=FleetTemplate(hours), options=options)
+
+def _solve_batch(start: int, settings: list[Settings], PV_availability: np.ndarray, Demand: np.ndarray) -> tuple[int, np.ndarray, dict[str, np.ndarray]]:
+    template = _worker["template"]
+    status = np.zeros(len(settings), dtype=int)
+    columns = {name: np.empty(len(settings)) for name in KPI_NAMES}
+    for h, house_settings in enumerate(settings):
+        status[h], kpis = template.solve(house_settings, PV_availability[h], Demand[h], **_worker["options"])
+        for name, value in kpis.items():
+            columns[name][h] = value
+    return start, status, columns
+
+
+def run_fleet(
+    settings: Settings | list[Settings],
+    PV_availability: np.ndarray,
+    Demand: np.ndarray,
+    processes: int | None = None,
+    batch_size: int = 64,
+    **options,
+) -> FleetResult:
+    """Solve the primal model of every house of a fleet.
+
+    :param settings: one Settings for all houses or one per house
+    :param PV_availability: (houses, hours) matrix, e.g. TimeSeriesStore.subset
+    :param Demand: (houses, hours) matrix
+    :param batch_size: houses per task of a worker process
+    :param options: passed to scipy.optimize.milp
+    """
+    start = time.perf_counter()
+    PV_availability = np.atleast_2d(np.asarray(PV_availability, dtype=float))
+    Demand = np.atleast_2d(np.asarray(Demand, dtype=float))
+    if PV_availability.shape != Demand.shape:
+        raise ValueError("PV_availability and Demand should have the same (houses, hours) shape")
+    houses, hours = Demand.shape
+    if isinstance(settings, Settings):
+        settings = [settings] * houses
+    if len(settings) != houses:
+        raise ValueError(f"expected one Settings or {houses}, got {len(settings)}")
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    status = np.zeros(houses, dtype=int)
+    columns = {name: np.empty(houses) for name in KPI_NAMES}
+    def store(batch):
+        first, batch_status, batch_columns = batch
+        status[first:first + len(batch_status)] = batch_status
+        for name, values in batch_columns.items():
+            columns[name][first:first + len(values)] = values
+
+    batches = [(first, settings[first:first + batch_size], PV_availability[first:first + batch_size], Demand[first:first + batch_size])
+               for first in range(0, houses, batch_size)]
+    if processes == 1:
+        _init_worker(hours, options)
+        for batch in batches:
+            store(_solve_batch(*batch))
+    else:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(hours, options)) as pool:
+            futures = [pool.submit(_solve_batch, *batch) for batch in batches]
+            for future in as_completed(futures):
+                store(future.result())
+
+    return FleetResult(columns = columns, status = status, time = time.perf_counter() - start)
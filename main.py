@@ -1,7 +1,8 @@
 
 from model import HouseModel, Settings
 from kkt import DualModel, BigM_KKT
-import numpy as np
+from bigm import compute_big_M
+from timeseries import load_store
 
 settings = Settings(
     Lifetime = 12*10,
@@ -12,13 +13,11 @@ settings = Settings(
     Demand_total = 3500
 )
 
-PV_availability = np.loadtxt("data/TS_PVAvail.csv")
-Demand = np.loadtxt("data/TS_Demand.csv")
-PV_availability = PV_availability[0:720]
-Demand = Demand[0:720]
+# the CSV files are converted once into data/store and memory-mapped afterwards
+PV_availability, Demand = load_store().inputs(start=0, stop=720)
 # model = HouseModel(settings, PV_availability, Demand)
 # model = DualModel(settings, PV_availability, Demand)
-model = BigM_KKT(settings, PV_availability, Demand)
+model = BigM_KKT(settings, PV_availability, Demand, M = compute_big_M(settings, PV_availability, Demand))
 model.solve()
 output = model.get_output()
 print(output.variables["capacity_battery"])
@@ -0,0 +1,413 @@
+import json
+import time
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.optimize import milp, LinearConstraint, Bounds
+
+from model import ArrayOutput, Output, Settings
+from profiling import logger
+from solvers import SolveResult
+
+# status of scipy.optimize.milp -> termination condition of Pyomo
+MILP_STATUS = {0: "optimal", 1: "maxTimeLimit", 2: "infeasible", 3: "unbounded", 4: "error"}
+
+class MatrixModel():
+    """Vectorized counterpart of HouseModel.
+
+    The layers (add_primal, add_dual, add_big_M) produce the same variables and
+    constraints as the Pyomo version, but they are assembled directly from the
+    NumPy time series into one sparse matrix with row bounds
+
+        row_lb <= A x <= row_ub,  lb <= x <= ub
+
+    Variables and constraints keep the Pyomo component names so that
+    get_output returns the same Output as HouseModel.get_output.
+    """
+    def __init__(self, settings: Settings, PV_availability: list[float], Demand: list[float]):
+        if len(Demand) != len(PV_availability):
+            raise ValueError("Length of the Demand and PV_availability should be equal")
+
+        self.settings = settings
+        self.PV_availability = np.asarray(PV_availability, dtype=float)
+        self.Demand = np.asarray(Demand, dtype=float)
+
+        T = range(len(Demand))
+        self.T = T
+        # index of the previous hour, T[i-1] in the Pyomo model (cyclic)
+        self.T_prev = np.roll(np.arange(len(T)), 1)
+
+        # dictionary of variables and constraints
+        # layer -> {name: column (row) indices}
+        self.variables = {}
+        self.constraints = {}
+
+        # columns in declaration order, keyed by the Pyomo component name
+        self.columns = {}
+        self.n_cols = 0
+        self._lb = []
+        self._ub = []
+        self._integrality = []
+        # column -> fixed value
+        self._fixed = {}
+
+        self.n_rows = 0
+        self._rows = []
+        self._cols = []
+        self._vals = []
+        self._row_lb = []
+        self._row_ub = []
+
+        # name -> (column indices, coefficients, sense)
+        self.objectives = {}
+        # scipy result and SolveResult of the last solve()
+        self.result = None
+        self.status = None
+
+    def _add_var(self, name: str, size: int | None, lb: float, ub: float, integral: bool = False) -> np.ndarray | int:
+        n = 1 if size is None else size
+        index = np.arange(self.n_cols, self.n_cols + n)
+        self.n_cols += n
+        self._lb.append(np.full(n, lb, dtype=float))
+        self._ub.append(np.full(n, ub, dtype=float))
+        self._integrality.append(np.full(n, int(integral), dtype=np.uint8))
+        self.columns[name] = index if size is not None else int(index[0])
+        return self.columns[name]
+
+    def _add_rows(self, terms: list[tuple], lb, ub, size: int | None = None) -> np.ndarray:
+        """Append a block of rows.
+
+        :param terms: list of (local row, column, value) arrays, broadcast against each other
+        :param lb: lower bound of each row (scalar or array)
+        :param ub: upper bound of each row (scalar or array)
+        :param size: number of rows, defaults to the length of the horizon
+        """
+        n = len(self.T) if size is None else size
+        for rows, cols, vals in terms:
+            rows, cols, vals = np.broadcast_arrays(np.asarray(rows), np.asarray(cols), np.asarray(vals, dtype=float))
+            self._rows.append(rows.ravel() + self.n_rows)
+            self._cols.append(cols.ravel())
+            self._vals.append(vals.ravel())
+        self._row_lb.append(np.broadcast_to(np.asarray(lb, dtype=float), (n,)))
+        self._row_ub.append(np.broadcast_to(np.asarray(ub, dtype=float), (n,)))
+        index = np.arange(self.n_rows, self.n_rows + n)
+        self.n_rows += n
+        return index
+
+    @property
+    def A(self) -> sp.csr_matrix:
+        rows = np.concatenate(self._rows) if self._rows else np.empty(0, dtype=int)
+        cols = np.concatenate(self._cols) if self._cols else np.empty(0, dtype=int)
+        vals = np.concatenate(self._vals) if self._vals else np.empty(0)
+        # duplicate entries are summed, like repeated terms in a Pyomo expression
+        return sp.csr_matrix((vals, (rows, cols)), shape=(self.n_rows, self.n_cols))
+
+    @property
+    def row_lb(self) -> np.ndarray:
+        return np.concatenate(self._row_lb) if self._row_lb else np.empty(0)
+
+    @property
+    def row_ub(self) -> np.ndarray:
+        return np.concatenate(self._row_ub) if self._row_ub else np.empty(0)
+
+    @property
+    def lb(self) -> np.ndarray:
+        lb = np.concatenate(self._lb)
+        lb[list(self._fixed)] = list(self._fixed.values())
+        return lb
+
+    @property
+    def ub(self) -> np.ndarray:
+        ub = np.concatenate(self._ub)
+        ub[list(self._fixed)] = list(self._fixed.values())
+        return ub
+
+    def fix(self, name: str, value: float) -> None:
+        """Fix all columns of a variable to a value."""
+        for column in np.atleast_1d(self.columns[name]):
+            self._fixed[int(column)] = value
+
+    def unfix(self, name: str) -> None:
+        for column in np.atleast_1d(self.columns[name]):
+            self._fixed.pop(int(column), None)
+
+    @property
+    def integrality(self) -> np.ndarray:
+        return np.concatenate(self._integrality)
+
+    def c(self, objective: str | None = None) -> np.ndarray:
+        """Cost vector of the given objective in minimization form, zero if None."""
+        c = np.zeros(self.n_cols)
+        if objective is not None:
+            cols, vals, sense = self.objectives[objective]
+            np.add.at(c, cols, vals)
+            if sense == "maximize":
+                c = -c
+        return c
+
+    def solve(self, objective: str | None = "primal_obj", **options) -> None:
+        """Solve with the HiGHS solver bundled in scipy, the outcome is kept as self.status.
+
+        :param objective: name of the objective, None for a feasibility problem
+        :param options: passed to scipy.optimize.milp
+        """
+        self.objective = objective
+        start = time.perf_counter()
+        result = milp(
+            self.c(objective),
+            constraints=LinearConstraint(self.A, self.row_lb, self.row_ub),
+            integrality=self.integrality,
+            bounds=Bounds(self.lb, self.ub),
+            options=options,
+        )
+        self.result = result
+        feasible = result.x is not None
+        self.status = SolveResult(
+            solver = "scipy",
+            status = MILP_STATUS.get(result.status, "error"),
+            optimal = result.status == 0,
+            feasible = feasible,
+            objective = self.get_output().objective if feasible else None,
+            lower_bound = getattr(result, "mip_dual_bound", None),
+            time = time.perf_counter() - start,
+            message = result.message,
+        )
+        logger.info(json.dumps({"event": "solve", "model": type(self).__name__, **self.status.model_dump()}))
+
+    def get_output(self) -> Output:
+        x = self.result.x
+        objective = 0.0
+        if self.objective is not None:
+            cols, vals, sense = self.objectives[self.objective]
+            objective = float(np.dot(vals, x[cols]))
+
+        variables = {}
+        for name, index in self.columns.items():
+            if isinstance(index, int):
+                variables[name] = float(x[index])
+            else:
+                variables[name] = x[index].tolist()
+        return Output(objective = objective, variables = variables)
+
+    def get_arrays(self) -> ArrayOutput:
+        """Columnar output like HouseModel.get_arrays, the slacks are those of the primal and dual rows."""
+        x = self.result.x
+        objective = float("nan")
+        if self.objective is not None:
+            cols, vals, sense = self.objectives[self.objective]
+            objective = float(np.dot(vals, x[cols]))
+        variables = {name: np.array(x[index]) for name, index in self.columns.items()}
+        activity = self.A @ x
+        slack = np.minimum(activity - self.row_lb, self.row_ub - activity)
+        slacks = {}
+        for layer, prefix in [("primal", "con_"), ("dual", "con_dual_")]:
+            for name, rows in self.constraints.get(layer, {}).items():
+                slacks[prefix + name] = slack[rows]
+        return ArrayOutput.model_construct(objective = objective, variables = variables, duals = {}, slacks = slacks, timings = {})
+
+
+    def add_primal(self) -> None:
+        settings = self.settings
+        PV_availability = self.PV_availability
+        Demand = self.Demand
+        n = len(self.T)
+        r = np.arange(n)
+        prev = self.T_prev
+
+        # decision variables
+        energy_PV = self._add_var("energy_PV", n, 0, np.inf)
+        energy_battery = self._add_var("energy_battery", n, 0, np.inf)
+        energy_battery_in = self._add_var("energy_battery_in", n, 0, np.inf)
+        energy_battery_out = self._add_var("energy_battery_out", n, 0, np.inf)
+        energy_buy = self._add_var("energy_buy", n, 0, np.inf)
+        capacity_PV = self._add_var("capacity_PV", None, 0, np.inf)
+        capacity_battery = self._add_var("capacity_battery", None, 0, np.inf)
+        energy_sell = self._add_var("energy_sell", n, 0, np.inf)
+
+        self.variables["primal"] = {
+            "energy_PV": energy_PV,
+            "energy_battery": energy_battery,
+            "energy_battery_in": energy_battery_in,
+            "energy_battery_out": energy_battery_out,
+            "energy_buy": energy_buy,
+            "capacity_PV": capacity_PV,
+            "capacity_battery": capacity_battery,
+            "energy_sell": energy_sell,
+        }
+
+        # fixed at 0 like the Pyomo variable
+        delta_demand = self._add_var("delta_demand", n, 0, 0)
+
+        # objective
+        self.objectives["primal_obj"] = (
+            np.concatenate(([capacity_PV], energy_buy, [capacity_battery], energy_sell)),
+            np.concatenate(([settings.Cost_PV], np.full(n, settings.Cost_buy), [settings.Cost_battery], np.full(n, -settings.Sell_price))),
+            "minimize",
+        )
+
+        # constraints
+        limit_pv = self._add_rows([
+            (r, energy_PV, 1.0),
+            (r, capacity_PV, -PV_availability),
+        ], -np.inf, 0)
+
+        limit_battery = self._add_rows([
+            (r, energy_battery, 1.0),
+            (r, capacity_battery, -1.0),
+        ], -np.inf, 0)
+
+        eq_battery = self._add_rows([
+            (r, energy_battery, 1.0),
+            (r, energy_battery[prev], -1.0),
+            (r, energy_battery_out, 1.0),
+            (r, energy_battery_in, -1.0),
+        ], 0, 0)
+
+        rhs = settings.Demand_total * Demand
+        eq_energy = self._add_rows([
+            (r, energy_buy, 1.0),
+            (r, energy_battery_out, 1.0),
+            (r, energy_battery_in, -1.0),
+            (r, energy_PV, 1.0),
+            (r, energy_sell, -1.0),
+            (r, delta_demand, -settings.Demand_total),
+        ], rhs, rhs)
+
+        self.constraints["primal"] = {
+            "limit_pv": limit_pv,
+            "limit_battery": limit_battery,
+            "eq_battery": eq_battery,
+            "eq_energy": eq_energy,
+        }
+
+
+    def add_dual(self) -> None:
+        if not "primal" in self.variables:
+            raise Exception("primal variables and constraints should be added first")
+        settings = self.settings
+        PV_availability = self.PV_availability
+        Demand = self.Demand
+        n = len(self.T)
+        r = np.arange(n)
+        prev = self.T_prev
+
+        # dual variables
+        dual_limit_battery = self._add_var("dual_limit_battery", n, -np.inf, 0)
+        dual_limit_PV = self._add_var("dual_limit_PV", n, -np.inf, 0)
+        dual_eq_battery = self._add_var("dual_eq_battery", n, -np.inf, np.inf)
+        dual_eq_demand = self._add_var("dual_eq_demand", n, -np.inf, np.inf)
+
+        self.variables["dual"] = {
+            "limit_battery": dual_limit_battery,
+            "limit_PV": dual_limit_PV,
+            "eq_battery": dual_eq_battery,
+            "eq_demand": dual_eq_demand,
+        }
+
+        # dual objective, delta_demand is fixed at 0
+        self.objectives["dual_obj"] = (dual_eq_demand, Demand * settings.Demand_total, "maximize")
+
+        # dual feasibility constraints
+        energy_buy = self._add_rows([(r, dual_eq_demand, 1.0)], -np.inf, settings.Cost_buy)
+        energy_sell = self._add_rows([(r, dual_eq_demand, -1.0)], -np.inf, -settings.Sell_price)
+
+        energy_battery_out = self._add_rows([
+            (r, dual_eq_demand, 1.0),
+            (r, dual_eq_battery, -1.0),
+        ], -np.inf, 0)
+
+        energy_battery_in = self._add_rows([
+            (r, dual_eq_demand, -1.0),
+            (r, dual_eq_battery, 1.0),
+        ], -np.inf, 0)
+
+        energy_battery = self._add_rows([
+            (r, dual_eq_battery, 1.0),
+            (r, dual_eq_battery[prev], -1.0),
+            (r, dual_limit_battery[prev], 1.0),
+        ], -np.inf, 0)
+
+        energy_PV = self._add_rows([
+            (r, dual_eq_demand, 1.0),
+            (r, dual_limit_PV, 1.0),
+        ], -np.inf, 0)
+
+        capacity_battery = self._add_rows([(0, dual_limit_battery, -1.0)], -np.inf, settings.Cost_battery, size=1)
+        capacity_PV = self._add_rows([(0, dual_limit_PV, -PV_availability)], -np.inf, settings.Cost_PV, size=1)
+
+        self.constraints["dual"] = {
+            "energy_buy": energy_buy,
+            "energy_sell": energy_sell,
+            "energy_battery_out": energy_battery_out,
+            "energy_battery_in": energy_battery_in,
+            "energy_battery": energy_battery,
+            "energy_PV": energy_PV,
+            "capacity_battery": capacity_battery,
+            "capacity_PV": capacity_PV,
+        }
+
+
+    def add_big_M(self, M: float | dict[str, float | np.ndarray]) -> None:
+        if not ("primal" in self.variables and "dual" in self.variables):
+            raise Exception("primal and dual variables and constraints should be added first")
+
+        settings = self.settings
+        PV_availability = self.PV_availability
+        n = len(self.T)
+        r = np.arange(n)
+        prev = self.T_prev
+        p = self.variables["primal"]
+        d = self.variables["dual"]
+
+        # binary variables
+        binary = {}
+        for name in ["dual_limit_PV", "dual_limit_battery", "energy_buy", "energy_sell", "energy_battery_out", "energy_battery_in", "energy_battery", "energy_PV"]:
+            binary[name] = self._add_var("binary_" + name, n, 0, 1, integral=True)
+        for name in ["capacity_PV", "capacity_battery"]:
+            binary[name] = self._add_var("binary_" + name, None, 0, 1, integral=True)
+        self.variables["big-M"] = binary
+
+        def big_M(name):
+            return np.asarray(M[name] if isinstance(M, dict) else M, dtype=float)
+
+        # complementary slackness, every pair is  A: x <= M*b  and  B: s <= M*(1-b)
+        rows = {}
+        def pair(name, A_terms, B_terms, B_const = 0.0, size = None):
+            b = binary[name]
+            r_ = r if size is None else 0
+            M_A, M_B = big_M(name + "_A"), big_M(name + "_B")
+            rows[name + "_A"] = self._add_rows(A_terms + [(r_, b, -M_A)], -np.inf, 0, size=size)
+            rows[name + "_B"] = self._add_rows(B_terms + [(r_, b, M_B)], -np.inf, M_B - B_const, size=size)
+
+        pair("dual_limit_PV",
+            [(r, d["limit_PV"], -1.0)],
+            [(r, p["capacity_PV"], PV_availability), (r, p["energy_PV"], -1.0)])
+        pair("dual_limit_battery",
+            [(r, d["limit_battery"], -1.0)],
+            [(r, p["capacity_battery"], 1.0), (r, p["energy_battery"], -1.0)])
+        pair("energy_buy",
+            [(r, p["energy_buy"], 1.0)],
+            [(r, d["eq_demand"], -1.0)], B_const = settings.Cost_buy)
+        pair("energy_sell",
+            [(r, p["energy_sell"], 1.0)],
+            [(r, d["eq_demand"], 1.0)], B_const = -settings.Sell_price)
+        pair("energy_battery_out",
+            [(r, p["energy_battery_out"], 1.0)],
+            [(r, d["eq_battery"], 1.0), (r, d["eq_demand"], -1.0)])
+        pair("energy_battery_in",
+            [(r, p["energy_battery_in"], 1.0)],
+            [(r, d["eq_demand"], 1.0), (r, d["eq_battery"], -1.0)])
+        pair("energy_battery",
+            [(r, p["energy_battery"][prev], 1.0)],
+            [(r, d["eq_battery"], -1.0), (r, d["eq_battery"][prev], 1.0), (r, d["limit_battery"][prev], -1.0)])
+        pair("energy_PV",
+            [(r, p["energy_PV"], 1.0)],
+            [(r, d["eq_demand"], -1.0), (r, d["limit_PV"], -1.0)])
+        pair("capacity_battery",
+            [(0, p["capacity_battery"], 1.0)],
+            [(0, d["limit_battery"], 1.0)], B_const = settings.Cost_battery, size=1)
+        pair("capacity_PV",
+            [(0, p["capacity_PV"], 1.0)],
+            [(0, d["limit_PV"], PV_availability)], B_const = settings.Cost_PV, size=1)
+
+        self.constraints["big-M"] = rows
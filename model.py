@@ -1,12 +1,112 @@
+from __future__ import annotations
+
+import json
+import os
+from contextlib import contextmanager
+
 import numpy as np
 import pyomo
 import pyomo.environ as pyo
+from pyomo.gdp import Disjunct
 from pyomo.opt import SolverFactory, SolverStatus, TerminationCondition
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
+
+from profiling import Timing, logger, phase, timed
+from solvers import SolveResult, SolverSettings, read_solver_settings
+
+def _number(value, kind = (int, float)):
+    # Pyomo results leave unknown entries as UndefinedData
+    return value if isinstance(value, kind) else None
+
+def _highs_solution(solver) -> dict | None:
+    """The solution vectors of an appsi HiGHS solver and its maps from Pyomo components to columns and rows.
+
+    None for other solvers. get_arrays reads the values with one fancy index
+    per component instead of one Python call per element.
+    """
+    highs = getattr(solver, "_solver_model", None)
+    solution = getattr(solver, "_sol", None)
+    if highs is None or solution is None or not hasattr(solver, "_pyomo_var_to_solver_var_map") or not solution.value_valid:
+        return None
+    lp = highs.getLp()
+    return {
+        "columns": solver._pyomo_var_to_solver_var_map,
+        "rows": solver._pyomo_con_to_solver_con_map,
+        "col_value": np.asarray(solution.col_value, dtype=float),
+        "row_value": np.asarray(solution.row_value, dtype=float),
+        "row_dual": np.asarray(solution.row_dual, dtype=float) if solution.dual_valid else None,
+        "row_lower": np.asarray(lp.row_lower_, dtype=float),
+        "row_upper": np.asarray(lp.row_upper_, dtype=float),
+    }
+
+def _positions(datas, index: dict, key = id) -> np.ndarray | None:
+    # column or row of every element, None if one of them is not in the solver
+    positions = np.fromiter((index.get(key(data), -1) for data in datas), dtype=np.int64)
+    return None if np.any(positions < 0) else positions
 
 class Output(BaseModel):
     objective: float
     variables: dict[str, float|list[float]]
+    # wall time and memory of the phases of the model, see profiling.py
+    timings: dict[str, Timing] = {}
+
+class ArrayOutput(BaseModel):
+    """Columnar counterpart of Output, one NumPy array per component.
+
+    Built with model_construct, so the arrays are not validated element by
+    element. Scalar variables are 0-d arrays. duals and slacks are keyed by
+    the constraint component name (e.g. "con_eq_energy").
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    objective: float
+    variables: dict[str, np.ndarray]
+    duals: dict[str, np.ndarray] = {}
+    slacks: dict[str, np.ndarray] = {}
+    timings: dict[str, Timing] = {}
+
+    def _arrays(self) -> dict[str, np.ndarray]:
+        arrays = {}
+        for group in ["variables", "duals", "slacks"]:
+            for name, values in getattr(self, group).items():
+                arrays[f"{group}.{name}"] = values
+        return arrays
+
+    def _meta(self) -> dict:
+        return {"objective": self.objective, "timings": {name: timing.model_dump() for name, timing in self.timings.items()}}
+
+    def save(self, path: str, compressed: bool = False) -> None:
+        """Save as .npz, or as a directory of .npy files (which can be memory-mapped) if path has no .npz suffix."""
+        if path.endswith(".npz"):
+            savez = np.savez_compressed if compressed else np.savez
+            savez(path, __meta__=np.array(json.dumps(self._meta())), **self._arrays())
+            return
+        os.makedirs(path, exist_ok=True)
+        for name, values in self._arrays().items():
+            np.save(os.path.join(path, name + ".npy"), values)
+        with open(os.path.join(path, "meta.json"), "w") as file:
+            json.dump(self._meta(), file)
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: str | None = None) -> ArrayOutput:
+        """Load a result of save(), the arrays of a directory are memory-mapped with mmap_mode="r"."""
+        if path.endswith(".npz"):
+            with np.load(path) as file:
+                meta = json.loads(str(file["__meta__"]))
+                arrays = {name: file[name] for name in file.files if name != "__meta__"}
+        else:
+            with open(os.path.join(path, "meta.json")) as file:
+                meta = json.load(file)
+            arrays = {
+                name[:-len(".npy")]: np.load(os.path.join(path, name), mmap_mode=mmap_mode)
+                for name in sorted(os.listdir(path)) if name.endswith(".npy")
+            }
+        groups = {"variables": {}, "duals": {}, "slacks": {}}
+        for key, values in arrays.items():
+            group, name = key.split(".", 1)
+            groups[group][name] = values
+        timings = {name: Timing(**timing) for name, timing in meta["timings"].items()}
+        return cls.model_construct(objective = meta["objective"], timings = timings, **groups)
 
 class Settings(BaseModel):
     Lifetime: int
@@ -24,13 +124,54 @@ class Settings(BaseModel):
     def Cost_battery(self):
         return self.Price_battery/self.Lifetime
 
+class UpperSettings(BaseModel):
+    """Counterfactual query of add_upper_level: the smallest demand change that reaches a target."""
+    # primal variable of the target, e.g. capacity_battery, indexed variables are summed over the hours
+    variable: str = "capacity_battery"
+    # the target is lower <= variable <= upper
+    lower: float | None = None
+    upper: float | None = None
+    # "L1": minimize sum |delta_demand|, "cardinality": minimize the number of changed hours
+    norm: str = "L1"
+    # at most this many hours may change
+    max_changes: int | None = None
+    # upper bound of delta_demand, in the units of Demand, default max(Demand)
+    max_increase: float | None = None
+    # hours in which the demand may change, default all
+    candidate_hours: list[int] | None = None
+
+class Reduction(BaseModel):
+    """Rows, columns and binaries of a layer that the presolve of HouseModel does not pass to the solver."""
+    rows: int = 0
+    columns: int = 0
+    binaries: int = 0
+
 class HouseModel():
-    def __init__(self, settings: Settings, PV_availability: list[float], Demand: list[float]):   
+    # primal row -> (dual variable, sign), the solver duals times the sign are
+    # the values of the dual variables in the convention of add_dual
+    dual_rows = {
+        "limit_pv": ("limit_PV", 1),
+        "limit_battery": ("limit_battery", 1),
+        "eq_battery": ("eq_battery", -1),
+        "eq_energy": ("eq_demand", -1),
+        "final_battery": ("final_battery", 1),
+    }
+    # complementarity pairs removed by the presolve -> value of their binary at the removed hours
+    presolved_pairs = {"dual_limit_PV": 1, "energy_PV": 0}
+
+    def __init__(self, settings: Settings, PV_availability: list[float], Demand: list[float], mutable: bool = False,
+                 initial_battery: float | None = None, final_battery: float | None = None, presolve: bool = False):
         if len(Demand) != len(PV_availability):
             raise ValueError("Length of the Demand and PV_availability should be equal")
         
         self.settings = settings
+        self.PV_availability = PV_availability
         self.Demand = Demand
+        self.mutable = mutable
+        # the battery is cyclic over the horizon unless the state of charge
+        # before the first hour and/or at the last hour is given
+        self.initial_battery = initial_battery
+        self.final_battery = final_battery
         # Step 0: Create an instance of the model
         model = pyo.ConcreteModel()
         self.model = model
@@ -39,27 +180,168 @@ class HouseModel():
         T = range(len(Demand)) # hours in one year
         self.T = T
 
+        # Step 1.1.1: presolve, at hours without PV availability energy_PV is 0, so
+        # dual_limit_PV only appears in its own dual constraint, and both of their
+        # complementarity pairs hold for any solution. These entries are fixed
+        # instead of passed to the solver, see self.reductions.
+        self.presolve = presolve
+        self.hours_PV = [i for i in T if PV_availability[i] > 0] if presolve else T
+        self.hours_no_PV = [i for i in T if not PV_availability[i] > 0] if presolve else []
+        # layer -> Reduction
+        self.reductions = {}
+
+        # Step 1.2: Define parameters
+        # with mutable=True they are Pyomo parameters that can be changed by update()
+        # without rebuilding the expressions, otherwise they are plain floats
+        if mutable:
+            model.Cost_PV = pyo.Param(initialize=settings.Cost_PV, mutable=True)
+            model.Cost_battery = pyo.Param(initialize=settings.Cost_battery, mutable=True)
+            model.Cost_buy = pyo.Param(initialize=settings.Cost_buy, mutable=True)
+            model.Sell_price = pyo.Param(initialize=settings.Sell_price, mutable=True)
+            model.Demand_total = pyo.Param(initialize=settings.Demand_total, mutable=True)
+            model.Demand = pyo.Param(T, initialize=dict(enumerate(Demand)), mutable=True)
+            self.parameters = {
+                "Cost_PV": model.Cost_PV,
+                "Cost_battery": model.Cost_battery,
+                "Cost_buy": model.Cost_buy,
+                "Sell_price": model.Sell_price,
+                "Demand_total": model.Demand_total,
+                "Demand": model.Demand,
+            }
+        else:
+            self.parameters = {
+                "Cost_PV": settings.Cost_PV,
+                "Cost_battery": settings.Cost_battery,
+                "Cost_buy": settings.Cost_buy,
+                "Sell_price": settings.Sell_price,
+                "Demand_total": settings.Demand_total,
+                "Demand": Demand,
+            }
+
         # dictionary of variables and constraints
         self.variables = {}
         self.constraints = {}
+
+        # solver instance, kept between solves so that persistent solvers can re-solve incrementally
+        self.solver = None
+        self.solver_name = None
+        # solution vectors of the last appsi HiGHS solve while the model values are the loaded ones, see get_arrays
+        self.solution = None
+        # SolveResult of the last solve()
+        self.status = None
+
+        # wall time and memory of every phase (add_* layers, solve, load, output)
+        self.timings = {}
         
 
         # Write model to mps file
         # model.write(filename=r"model.mps", io_options={"symbolic_solver_labels": True})
     
-    def solve(self, solver_name = "cplex"):
-        solver = SolverFactory(solver_name)
-        solver_output = solver.solve(self.model, tee = True)
-        if (solver_output.solver.status == SolverStatus.ok) and (solver_output.solver.termination_condition == TerminationCondition.optimal):
-            # Do something when the solution in optimal and feasible
-            print("Termination Condition is Optimal")
-        elif (solver_output.solver.termination_condition == TerminationCondition.infeasible):
-            # Do something when model in infeasible
-            print("Termination Condition is Infeasible")
+    def solve(self, solver_name: str | SolverSettings | None = None, tee = True, warmstart = False, options: dict | None = None):
+        """Solve the model and load the solution, the result is also kept as self.status.
+
+        :param solver_name: a Pyomo solver name, SolverSettings or None to read solverSettings.txt
+        :param warmstart: pass the current variable values as MIP start, e.g. from lp_start()
+        :param options: solver specific options on top of the settings, e.g. {"presolve": "off"}
+        """
+        if solver_name is None:
+            solver_settings = read_solver_settings()
+        elif isinstance(solver_name, str):
+            solver_settings = SolverSettings(solver = solver_name)
         else:
-            # Something else is wrong
-            print("Solver Termination Condition: ", solver_output.solver.termination_condition)
-            print("Solver Status:" ,  solver_output.solver.status)
+            solver_settings = solver_name
+        # reuse the solver instance, persistent solvers (e.g. appsi_highs) then only
+        # receive the changed coefficients and start from the previous basis
+        if self.solver is None or self.solver_name != solver_settings.solver:
+            self.solver = solver_settings.create()
+            self.solver_name = solver_settings.solver
+        solver = self.solver
+        solver_options = {**solver_settings.solver_options(), **(options or {})}
+        keywords = {"options": solver_options} if solver_options else {}
+        if warmstart:
+            keywords["warmstart"] = True
+        owner = type(self).__name__
+        # the solve phase includes writing the problem (or passing it to an in-memory solver)
+        with phase(self.timings, "solve", owner), self.mip_duals_off():
+            solver_output = solver.solve(self.model, tee = tee, load_solutions = False, **keywords)
+        # solvers that report their own time split the solve phase into write and solver
+        solver_time = _number(getattr(solver_output.solver, "time", None))
+        if solver_time is not None:
+            self.timings["solver"] = Timing(time = solver_time, rss = 0)
+            self.timings["write"] = Timing(time = max(self.timings["solve"].time - solver_time, 0), rss = 0)
+        feasible = len(solver_output.solution) > 0
+        self.solution = None
+        if feasible:
+            with phase(self.timings, "load", owner):
+                self.model.solutions.load_from(solver_output)
+            self.solution = _highs_solution(solver)
+
+        condition = solver_output.solver.termination_condition
+        objective = next(self.model.component_data_objects(pyo.Objective, active=True), None)
+        self.status = SolveResult(
+            solver = solver_settings.solver,
+            status = str(condition),
+            optimal = solver_output.solver.status == SolverStatus.ok and condition == TerminationCondition.optimal,
+            feasible = feasible,
+            objective = pyo.value(objective) if feasible and objective is not None else None,
+            lower_bound = _number(getattr(solver_output.problem, "lower_bound", None)),
+            upper_bound = _number(getattr(solver_output.problem, "upper_bound", None)),
+            time = self.timings["solve"].time,
+            message = _number(getattr(solver_output.solver, "message", None), str),
+        )
+        logger.info(json.dumps({"event": "solve", "model": owner, **self.status.model_dump()}))
+        return solver_output
+
+    def is_mip(self) -> bool:
+        """Whether the active model has free integer variables, SOS constraints or disjunctions."""
+        model = self.model
+        if any(var.is_integer() and not var.fixed for var in model.component_data_objects(pyo.Var, active=True)):
+            return True
+        if next(model.component_data_objects(pyo.SOSConstraint, active=True), None) is not None:
+            return True
+        return next(model.component_data_objects(Disjunct, active=True), None) is not None
+
+    @contextmanager
+    def mip_duals_off(self):
+        """Switch off the import of model.dual while the model is a MIP.
+
+        A MIP has no duals and the HiGHS interfaces raise if the suffix asks
+        for them. LP solves still import the duals.
+        """
+        dual = getattr(self.model, "dual", None)
+        if not (isinstance(dual, pyo.Suffix) and dual.import_enabled() and self.is_mip()):
+            yield
+            return
+        dual.clear()
+        dual.direction = pyo.Suffix.LOCAL
+        try:
+            yield
+        finally:
+            dual.direction = pyo.Suffix.IMPORT
+
+    def update(self, settings: Settings | None = None, demand: list[float] | None = None) -> None:
+        """Change the settings and/or the demand of a model built with mutable=True.
+
+        Only the values of the parameters change, the expressions are kept. The next
+        call of solve() with a persistent solver updates the affected objective
+        coefficients and right-hand sides and re-solves from the previous basis.
+        """
+        if not self.mutable:
+            raise Exception("the model should be built with mutable=True to be updated")
+        model = self.model
+        self.solution = None
+        if settings is not None:
+            model.Cost_PV.set_value(settings.Cost_PV)
+            model.Cost_battery.set_value(settings.Cost_battery)
+            model.Cost_buy.set_value(settings.Cost_buy)
+            model.Sell_price.set_value(settings.Sell_price)
+            model.Demand_total.set_value(settings.Demand_total)
+            self.settings = settings
+        if demand is not None:
+            if len(demand) != len(self.T):
+                raise ValueError("Length of the demand should be equal to the length of the model")
+            model.Demand.store_values(dict(enumerate(demand)))
+            self.Demand = demand
 
     # def set_delta_demand(self, values: dict[int,float]) -> None:
     #     """_summary_
@@ -71,9 +353,33 @@ class HouseModel():
     #         self.model.delta_demand[key] = value
 
 
+    def _reduced(self, layer: str, rows: int = 0, columns: int = 0, binaries: int = 0) -> None:
+        if not self.presolve:
+            return
+        self.reductions[layer] = Reduction(rows = rows, columns = columns, binaries = binaries)
+        logger.info(json.dumps({"event": "presolve", "model": type(self).__name__, "layer": layer, **self.reductions[layer].model_dump()}))
+
+    def _reconstruct(self, variables: dict) -> None:
+        """Set the entries of the output that the presolve fixed at a placeholder, in place.
+
+        dual_limit_PV of an hour without PV availability only has to satisfy
+        dual_eq_demand + dual_limit_PV <= 0, the value complementary to
+        energy_PV = 0 is min(0, -dual_eq_demand).
+        """
+        if not self.hours_no_PV or "dual_limit_PV" not in variables:
+            return
+        price = np.array(variables["dual_eq_demand"], dtype=float)[self.hours_no_PV]
+        limit = variables["dual_limit_PV"]
+        for i, value in zip(self.hours_no_PV, np.minimum(0.0, -price)):
+            limit[i] = float(value)
+
     def get_output(self) -> dict[str, list[float] | float]:
+        with phase(self.timings, "output", type(self).__name__):
+            output = self._output()
+        return Output(objective = output["objective"], variables = output["variables"], timings = self.timings)
+
+    def _output(self) -> dict:
         output = {}
-        print(pyo.value(self.model.primal_obj))
         # objective function
         for obj in self.model.component_objects(pyo.Objective, active=True):
             output["objective"] = pyo.value(obj)
@@ -86,13 +392,67 @@ class HouseModel():
                     output["variables"][str(v)].append(pyo.value(v[j]))
             else:
                 output["variables"][str(v)] = pyo.value(v)
-        return Output(objective = output["objective"], variables = output["variables"])
+        self._reconstruct(output["variables"])
+        return output
+
+    def get_arrays(self, duals: bool = True, slacks: bool = True) -> ArrayOutput:
+        """Columnar output: every variable, and the duals and slacks of the registered constraints, as one array.
+
+        Unlike get_output no nested lists are built and validated, unset
+        values become NaN. The duals are only there if the solver loaded them
+        into model.dual. After an appsi HiGHS solve the values are taken from
+        the solution vectors of the solver (see _highs_solution) until
+        lp_start or update change the model, other solvers read the Pyomo
+        components element by element.
+        """
+        with phase(self.timings, "output", type(self).__name__):
+            model = self.model
+            solution = self.solution
+            objective = next(model.component_data_objects(pyo.Objective, active=True), None)
+
+            def values(var):
+                if not var.is_indexed():
+                    return np.array(var.value, dtype=float)
+                columns = _positions(var.values(), solution["columns"]) if solution is not None else None
+                if columns is None:
+                    return np.array([data.value for data in var.values()], dtype=float)
+                return solution["col_value"][columns]
+
+            variables = {var.name: values(var) for var in model.component_objects(pyo.Var, active=True)}
+            self._reconstruct(variables)
+            constraints = [con for layer in self.constraints.values() for con in layer.values() if isinstance(con, pyo.Constraint)]
+            rows = {con.name: _positions(con.values(), solution["rows"], key = lambda data: data) if solution is not None else None for con in constraints}
+            dual_values = {}
+            if duals and hasattr(model, "dual") and len(model.dual) > 0:
+                suffix = model.dual
+                for con in constraints:
+                    if rows[con.name] is not None and solution["row_dual"] is not None:
+                        dual_values[con.name] = solution["row_dual"][rows[con.name]]
+                    else:
+                        dual_values[con.name] = np.array([suffix.get(data) for data in con.values()], dtype=float)
+            slack_values = {}
+            if slacks:
+                for con in constraints:
+                    if rows[con.name] is not None:
+                        row = rows[con.name]
+                        activity = solution["row_value"][row]
+                        slack_values[con.name] = np.minimum(activity - solution["row_lower"][row], solution["row_upper"][row] - activity)
+                    else:
+                        slack_values[con.name] = np.array([data.slack() for data in con.values()], dtype=float)
+        return ArrayOutput.model_construct(
+            objective = pyo.value(objective) if objective is not None else float("nan"),
+            variables = variables,
+            duals = dual_values,
+            slacks = slack_values,
+            timings = self.timings,
+        )
 
 
+    @timed("add_primal")
     def add_primal(self) -> None:
-        settings = self.settings
+        par = self.parameters
         PV_availability = self.PV_availability
-        Demand = self.Demand
+        Demand = par["Demand"]
         model = self.model
         T  = self.T
         
@@ -117,22 +477,26 @@ class HouseModel():
             "energy_sell": model.energy_sell,
         }
         
-        model.delta_demand = pyo.Var(T, initialize=0, fixed=True)
+        model.delta_demand = pyo.Var(T, initialize=0)
+        model.delta_demand.fix(0)
 
         # Step 3: Define objective
         model.primal_obj = pyo.Objective(
-            expr=settings.Cost_PV * model.capacity_PV
-            + settings.Cost_buy * sum(model.energy_buy[i] for i in T)
-            + settings.Cost_battery * model.capacity_battery
-            - settings.Sell_price * sum(model.energy_sell[i] for i in T),
+            expr=par["Cost_PV"] * model.capacity_PV
+            + par["Cost_buy"] * sum(model.energy_buy[i] for i in T)
+            + par["Cost_battery"] * model.capacity_battery
+            - par["Sell_price"] * sum(model.energy_sell[i] for i in T),
             sense=pyo.minimize,
         )
         model.primal_obj.deactivate()
 
         # Step 4: Constraints
         model.con_limit_pv = pyo.ConstraintList()
-        for i in T:
+        for i in self.hours_PV:
             model.con_limit_pv.add(model.energy_PV[i] <= model.capacity_PV * PV_availability[i])  # PV Upper Limit
+        for i in self.hours_no_PV:
+            model.energy_PV[i].fix(0)
+        self._reduced("primal", rows = len(self.hours_no_PV), columns = len(self.hours_no_PV))
 
         model.con_limit_battery = pyo.ConstraintList()
         for i in T:
@@ -140,11 +504,15 @@ class HouseModel():
 
         
         def rule_con_eq_battery(model,i):
-            return model.energy_battery[i] == model.energy_battery[T[i - 1]] - model.energy_battery_out[i] + model.energy_battery_in[i]
+            previous = self.initial_battery if i == 0 and self.initial_battery is not None else model.energy_battery[T[i - 1]]
+            return model.energy_battery[i] == previous - model.energy_battery_out[i] + model.energy_battery_in[i]
         model.con_eq_battery = pyo.Constraint(T, rule = rule_con_eq_battery)
 
+        if self.final_battery is not None:
+            model.con_final_battery = pyo.Constraint(expr = model.energy_battery[T[-1]] == self.final_battery)
+
         def rule_con_eq_energy(model, i):
-            return settings.Demand_total  * (Demand[i] + model.delta_demand[i]) == model.energy_buy[i] + model.energy_battery_out[i] - model.energy_battery_in[i] + model.energy_PV[i] - model.energy_sell[i]
+            return par["Demand_total"]  * (Demand[i] + model.delta_demand[i]) == model.energy_buy[i] + model.energy_battery_out[i] - model.energy_battery_in[i] + model.energy_PV[i] - model.energy_sell[i]
         model.con_eq_energy = pyo.Constraint(T, rule = rule_con_eq_energy)
         
         self.constraints["primal"] = {
@@ -153,16 +521,31 @@ class HouseModel():
             "eq_battery": model.con_eq_battery,
             "eq_energy": model.con_eq_energy,
         }
+        if self.final_battery is not None:
+            self.constraints["primal"]["final_battery"] = model.con_final_battery
 
         model.dual = pyo.Suffix(direction=pyo.Suffix.IMPORT)
 
+    def _dual_energy_battery(self, i):
+        """Left-hand side of the dual constraint of energy_battery[T[i-1]] (<= 0)."""
+        model = self.model
+        T = self.T
+        expr = - model.dual_eq_battery[T[i-1]] + model.dual_limit_battery[T[i-1]]
+        # without a given initial state the last hour is linked to the first one
+        if i != 0 or self.initial_battery is None:
+            expr += model.dual_eq_battery[i]
+        if i == 0 and self.final_battery is not None:
+            expr += model.dual_final_battery
+        return expr
+
 
+    @timed("add_dual")
     def add_dual(self) -> None:
         if not "primal" in self.variables:
             raise Exception("primal variables and constraints should be added first")
-        settings = self.settings
+        par = self.parameters
         PV_availability = self.PV_availability
-        Demand = self.Demand
+        Demand = par["Demand"]
         model = self.model
         T  = self.T
 
@@ -178,20 +561,28 @@ class HouseModel():
             "eq_battery": model.dual_eq_battery,
             "eq_demand": model.dual_eq_demand,
         }
+        if self.final_battery is not None:
+            model.dual_final_battery = pyo.Var(within=pyo.Reals)
+            self.variables["dual"]["final_battery"] = model.dual_final_battery
 
         
         # dual objective
-        model.dual_obj = pyo.Objective(expr = sum(model.dual_eq_demand[i] * (Demand[i] + model.delta_demand[i]) * settings.Demand_total for i in T), sense=pyo.maximize)
+        dual_obj = sum(model.dual_eq_demand[i] * (Demand[i] + model.delta_demand[i]) * par["Demand_total"] for i in T)
+        if self.initial_battery is not None:
+            dual_obj -= self.initial_battery * model.dual_eq_battery[T[0]]
+        if self.final_battery is not None:
+            dual_obj += self.final_battery * model.dual_final_battery
+        model.dual_obj = pyo.Objective(expr = dual_obj, sense=pyo.maximize)
         model.dual_obj.deactivate()
 
         # dual feasibility constraints
         model.con_dual_energy_buy = pyo.ConstraintList()
         for i in T:
-            model.con_dual_energy_buy.add(model.dual_eq_demand[i] <= settings.Cost_buy)
+            model.con_dual_energy_buy.add(model.dual_eq_demand[i] <= par["Cost_buy"])
         
         model.con_dual_energy_sell = pyo.ConstraintList()
         for i in T:
-            model.con_dual_energy_sell.add( - model.dual_eq_demand[i] <= - settings.Sell_price)
+            model.con_dual_energy_sell.add( - model.dual_eq_demand[i] <= - par["Sell_price"])
         
         model.con_dual_energy_battery_out = pyo.ConstraintList()
         for i in T:
@@ -203,14 +594,18 @@ class HouseModel():
 
         model.con_dual_energy_battery = pyo.ConstraintList()
         for i in T:
-            model.con_dual_energy_battery.add(model.dual_eq_battery[i] - model.dual_eq_battery[T[i-1]] + model.dual_limit_battery[T[i-1]] <= 0)
+            model.con_dual_energy_battery.add(self._dual_energy_battery(i) <= 0)
 
         model.con_dual_energy_PV = pyo.ConstraintList()
-        for i in T:
+        for i in self.hours_PV:
             model.con_dual_energy_PV.add( model.dual_eq_demand[i] + model.dual_limit_PV[i] <= 0)
+        # the value of the outputs is min(0, -dual_eq_demand), see _reconstruct
+        for i in self.hours_no_PV:
+            model.dual_limit_PV[i].fix(0)
+        self._reduced("dual", rows = len(self.hours_no_PV), columns = len(self.hours_no_PV))
 
-        model.con_dual_capacity_battery = pyo.Constraint(expr = - sum(model.dual_limit_battery[i] for i in T) <= settings.Cost_battery)
-        model.con_dual_capacity_PV = pyo.Constraint(expr = - sum(model.dual_limit_PV[i] * PV_availability[i] for i in T) <= settings.Cost_PV)
+        model.con_dual_capacity_battery = pyo.Constraint(expr = - sum(model.dual_limit_battery[i] for i in T) <= par["Cost_battery"])
+        model.con_dual_capacity_PV = pyo.Constraint(expr = - sum(model.dual_limit_PV[i] * PV_availability[i] for i in self.hours_PV) <= par["Cost_PV"])
 
         self.constraints["dual"] = {
             "energy_buy": model.con_dual_energy_buy,
@@ -224,134 +619,382 @@ class HouseModel():
         }
 
 
-    def add_big_M(self, M) -> None:
-        if not ("primal" in self.variables or "dual" in self.variables):
+    def complementarity_pairs(self) -> list[tuple]:
+        """Complementarity pairs of the primal and dual layers.
+
+        Every entry is (name, index, var, slack): for every i in index (None
+        for a scalar pair) var(i) is a sign-constrained variable and slack(i)
+        the nonnegative slack of the matching inequality, and at most one of
+        them may be nonzero. One pair for every primal inequality and its dual
+        variable and one for every primal variable and its dual constraint.
+        The pairs of presolved_pairs only cover the hours with PV availability.
+        """
+        if not ("primal" in self.variables and "dual" in self.variables):
             raise Exception("primal and dual variables and constraints should be added first")
-        
-        settings = self.settings
+        par = self.parameters
         PV_availability = self.PV_availability
         model = self.model
         T  = self.T
 
-        # Binary variables
-        model.binary_dual_limit_PV = pyo.Var(T, within=pyo.Binary)
-        model.binary_dual_limit_battery = pyo.Var(T, within=pyo.Binary)
-        model.binary_energy_buy = pyo.Var(T, within=pyo.Binary)
-        model.binary_energy_sell = pyo.Var(T, within=pyo.Binary)
-        model.binary_energy_battery_out = pyo.Var(T, within=pyo.Binary)
-        model.binary_energy_battery_in = pyo.Var(T, within=pyo.Binary)
-        model.binary_energy_battery = pyo.Var(T, within=pyo.Binary)
-        model.binary_energy_PV = pyo.Var(T, within=pyo.Binary)
-        model.binary_capacity_PV = pyo.Var(within=pyo.Binary)
-        model.binary_capacity_battery = pyo.Var(within=pyo.Binary)
-
-        self.variables["big-M"] = {
-            "dual_limit_PV": model.binary_dual_limit_PV,
-            "dual_limit_battery": model.binary_dual_limit_battery,
-            "energy_buy": model.binary_energy_buy,
-            "energy_sell": model.binary_energy_sell,
-            "energy_battery_out": model.binary_energy_battery_out,
-            "energy_battery_in": model.binary_energy_battery_in,
-            "energy_battery": model.binary_energy_battery,
-            "energy_PV": model.binary_energy_PV,
-            "capacity_PV": model.binary_capacity_PV,
-            "capacity_battery": model.binary_capacity_battery,
+        return [
+            ("dual_limit_PV", self.hours_PV, lambda i: model.dual_limit_PV[i], lambda i: model.capacity_PV * PV_availability[i] - model.energy_PV[i]),
+            ("dual_limit_battery", T, lambda i: model.dual_limit_battery[i], lambda i: model.capacity_battery - model.energy_battery[i]),
+            ("energy_buy", T, lambda i: model.energy_buy[i], lambda i: par["Cost_buy"] - model.dual_eq_demand[i]),
+            ("energy_sell", T, lambda i: model.energy_sell[i], lambda i: model.dual_eq_demand[i] - par["Sell_price"]),
+            ("energy_battery_out", T, lambda i: model.energy_battery_out[i], lambda i: model.dual_eq_battery[i] - model.dual_eq_demand[i]),
+            ("energy_battery_in", T, lambda i: model.energy_battery_in[i], lambda i: model.dual_eq_demand[i] - model.dual_eq_battery[i]),
+            ("energy_battery", T, lambda i: model.energy_battery[T[i-1]], lambda i: - self._dual_energy_battery(i)),
+            ("energy_PV", self.hours_PV, lambda i: model.energy_PV[i], lambda i: - model.dual_eq_demand[i] - model.dual_limit_PV[i]),
+            ("capacity_battery", None, lambda i: model.capacity_battery, lambda i: par["Cost_battery"] + sum(model.dual_limit_battery[j] for j in T)),
+            ("capacity_PV", None, lambda i: model.capacity_PV, lambda i: par["Cost_PV"] + sum(model.dual_limit_PV[j] * PV_availability[j] for j in self.hours_PV)),
+        ]
+
+    @staticmethod
+    def _nonnegative(var):
+        # NonPositiveReals variables (the duals of <= constraints) enter with a flipped sign
+        return - var if var.ub is not None and var.ub <= 0 else var
+
+    def add_complementarity(self, formulation: str = "big-M", **options) -> None:
+        """Add the complementarity constraints in the chosen formulation.
+
+        :param formulation: "big-M", "SOS1", "indicator" or "nonlinear"
+        :param options: passed to add_big_M, add_SOS, add_indicator or add_nonlinear
+        """
+        formulations = {
+            "big-M": self.add_big_M,
+            "SOS1": self.add_SOS,
+            "indicator": self.add_indicator,
+            "nonlinear": self.add_nonlinear,
         }
+        if formulation not in formulations:
+            raise ValueError(f"unknown formulation {formulation}, use one of {list(formulations)}")
+        formulations[formulation](**options)
+
+    @timed("add_big_M")
+    def add_big_M(self, M: float | dict[str, float | np.ndarray]) -> None:
+        """Add the complementarity constraints as big-M constraints.
+
+        :param M: one value for all rows or a value (scalar or per hour) for every
+            row name of self.constraints["big-M"], e.g. from bigm.compute_big_M
+        """
+        pairs = self.complementarity_pairs()
+        model = self.model
 
-        # complementary slackness
-        model.con_cs_dual_limit_PV_A = pyo.ConstraintList()
-        model.con_cs_dual_limit_PV_B = pyo.ConstraintList()
-        for i in T:
-            model.con_cs_dual_limit_PV_A.add((- model.dual_limit_PV[i]) <= M*model.binary_dual_limit_PV[i])
-            model.con_cs_dual_limit_PV_B.add((model.capacity_PV * PV_availability[i] - model.energy_PV[i]) <= M*(1-model.binary_dual_limit_PV[i]))
-        
-        model.con_cs_dual_limit_battery_A = pyo.ConstraintList()
-        model.con_cs_dual_limit_battery_B = pyo.ConstraintList()
-        for i in T:
-            model.con_cs_dual_limit_battery_A.add((- model.dual_limit_battery[i]) <= M*model.binary_dual_limit_battery[i])
-            model.con_cs_dual_limit_battery_B.add( model.capacity_battery-model.energy_battery[i] <= M*(1-model.binary_dual_limit_battery[i]) )
-        
-        model.con_cs_energy_buy_A = pyo.ConstraintList()
-        model.con_cs_energy_buy_B = pyo.ConstraintList()
-        for i in T:
-            model.con_cs_energy_buy_A.add(model.energy_buy[i] <= M*model.binary_energy_buy[i])
-            model.con_cs_energy_buy_B.add((settings.Cost_buy-model.dual_eq_demand[i]) <= M*(1-model.binary_energy_buy[i]))
+        def big_M(name, i = None):
+            if not isinstance(M, dict):
+                return M
+            value = M[name]
+            return float(value) if i is None or np.ndim(value) == 0 else float(value[i])
+
+        # Binary variables, the ones of presolved pairs cover all hours and are fixed where the pair is removed
+        self.variables["big-M"] = {}
+        for name, index, var, slack in pairs:
+            if index is None:
+                binary = pyo.Var(within=pyo.Binary)
+            else:
+                binary = pyo.Var(self.T if name in self.presolved_pairs else index, within=pyo.Binary)
+            model.add_component("binary_" + name, binary)
+            self.variables["big-M"][name] = binary
+            if name in self.presolved_pairs:
+                for i in self.hours_no_PV:
+                    binary[i].fix(self.presolved_pairs[name])
+
+        # complementary slackness,  var <= M*binary  and  slack <= M*(1-binary)
+        self.constraints["big-M"] = {}
+        for name, index, var, slack in pairs:
+            binary = self.variables["big-M"][name]
+            if index is None:
+                con_A = pyo.Constraint(expr = self._nonnegative(var(None)) <= big_M(name + "_A") * binary)
+                con_B = pyo.Constraint(expr = slack(None) <= big_M(name + "_B") * (1 - binary))
+            else:
+                con_A = pyo.ConstraintList()
+                con_B = pyo.ConstraintList()
+            model.add_component("con_cs_" + name + "_A", con_A)
+            model.add_component("con_cs_" + name + "_B", con_B)
+            if index is not None:
+                for i in index:
+                    con_A.add(self._nonnegative(var(i)) <= big_M(name + "_A", i) * binary[i])
+                    con_B.add(slack(i) <= big_M(name + "_B", i) * (1 - binary[i]))
+            self.constraints["big-M"][name + "_A"] = con_A
+            self.constraints["big-M"][name + "_B"] = con_B
+        removed = len(self.presolved_pairs) * len(self.hours_no_PV)
+        self._reduced("big-M", rows = 2 * removed, binaries = removed)
+
+    @timed("add_SOS")
+    def add_SOS(self) -> None:
+        """Add the complementarity constraints as SOS1 sets {var, slack}.
+
+        The slack of every inequality becomes a nonnegative variable, so the
+        solver needs SOS support (e.g. CPLEX, Gurobi, CBC), but no M.
+        """
+        pairs = self.complementarity_pairs()
+        model = self.model
 
-        model.con_cs_energy_sell_A = pyo.ConstraintList()
-        model.con_cs_energy_sell_B = pyo.ConstraintList()
-        for i in T:
-            model.con_cs_energy_sell_A.add(model.energy_sell[i] <= M*model.binary_energy_sell[i])
-            model.con_cs_energy_sell_B.add((model.dual_eq_demand[i]-settings.Sell_price) <= M*(1-model.binary_energy_sell[i]))
+        self.variables["SOS1"] = {}
+        self.constraints["SOS1"] = {}
+        for name, index, var, slack in pairs:
+            if index is None:
+                slack_var = pyo.Var(within=pyo.NonNegativeReals)
+                con_slack = pyo.Constraint(expr = slack_var == slack(None))
+                con_sos = pyo.SOSConstraint(rule = lambda model, var = var, slack_var = slack_var: [var(None), slack_var], sos = 1)
+            else:
+                slack_var = pyo.Var(index, within=pyo.NonNegativeReals)
+                con_slack = pyo.Constraint(index, rule = lambda model, i, slack = slack, slack_var = slack_var: slack_var[i] == slack(i))
+                con_sos = pyo.SOSConstraint(index, rule = lambda model, i, var = var, slack_var = slack_var: [var(i), slack_var[i]], sos = 1)
+            model.add_component("slack_" + name, slack_var)
+            model.add_component("con_slack_" + name, con_slack)
+            model.add_component("con_sos_" + name, con_sos)
+            self.variables["SOS1"][name] = slack_var
+            self.constraints["SOS1"][name + "_slack"] = con_slack
+            self.constraints["SOS1"][name] = con_sos
+        # a slack row and an SOS set per removed pair
+        removed = len(self.presolved_pairs) * len(self.hours_no_PV)
+        self._reduced("SOS1", rows = 2 * removed, columns = removed)
+
+    @timed("add_indicator")
+    def add_indicator(self, M: float | dict[str, float | np.ndarray] | None = None, transformation: str | None = "gdp.bigm") -> None:
+        """Add the complementarity constraints as disjunctions [var == 0] or [slack == 0].
+
+        The indicator variables of the disjuncts are the binaries. Pyomo's solver
+        interfaces have no native indicator constraints, so the disjunctions are
+        reformulated with gdp.bigm (transformation None keeps the GDP model).
+        gdp.hull is not offered, it needs bounds on all variables and the dual
+        variables are unbounded. M is passed to gdp.bigm like in add_big_M,
+        gdp.bigm cannot derive M from the variable bounds either; without M
+        the per-row values of bigm.compute_big_M are used, which only hold for
+        the cyclic hourly model, so other models (e.g. windows with a given initial or final
+        battery state, or AggregatedHouseModel) need an explicit M.
+        """
+        from pyomo.gdp import Disjunct, Disjunction
+
+        if transformation not in ("gdp.bigm", None):
+            raise ValueError(f"unknown transformation {transformation}, use gdp.bigm or None")
+        if M is None:
+            if type(self).dual_rows is not HouseModel.dual_rows or self.initial_battery is not None or self.final_battery is not None:
+                raise ValueError("M is required, bigm.compute_big_M only holds for the cyclic hourly model")
+            from bigm import compute_big_M
+            M = compute_big_M(self.settings, self.PV_availability, self.Demand)
+
+        pairs = self.complementarity_pairs()
+        model = self.model
 
-        model.con_cs_energy_battery_out_A = pyo.ConstraintList()
-        model.con_cs_energy_battery_out_B = pyo.ConstraintList()
-        for i in T:
-            model.con_cs_energy_battery_out_A.add(model.energy_battery_out[i] <= M * model.binary_energy_battery_out[i])
-            model.con_cs_energy_battery_out_B.add((model.dual_eq_battery[i]-model.dual_eq_demand[i]) <= M * (1 - model.binary_energy_battery_out[i]))
-        
-        model.con_cs_energy_battery_in_A = pyo.ConstraintList()
-        model.con_cs_energy_battery_in_B = pyo.ConstraintList()
-        for i in T:
-            model.con_cs_energy_battery_in_A.add(model.energy_battery_in[i] <= M*model.binary_energy_battery_in[i])
-            model.con_cs_energy_battery_in_B.add((model.dual_eq_demand[i] - model.dual_eq_battery[i]) <= M*(1-model.binary_energy_battery_in[i]))
-        
-        model.con_cs_energy_battery_A = pyo.ConstraintList()
-        model.con_cs_energy_battery_B = pyo.ConstraintList()
-        for i in T:
-            model.con_cs_energy_battery_A.add(model.energy_battery[T[i-1]] <= M*model.binary_energy_battery[i])
-            model.con_cs_energy_battery_B.add((- model.dual_eq_battery[i] + model.dual_eq_battery[T[i-1]] - model.dual_limit_battery[T[i-1]]) <= M*(1-model.binary_energy_battery[i]))
-        
-        model.con_cs_energy_PV_A = pyo.ConstraintList()
-        model.con_cs_energy_PV_B = pyo.ConstraintList()
-        for i in T:
-            model.con_cs_energy_PV_A.add(model.energy_PV[i] <= M*model.binary_energy_PV[i])
-            model.con_cs_energy_PV_B.add((- model.dual_eq_demand[i] - model.dual_limit_PV[i]) <= M*(1-model.binary_energy_PV[i]))
-        
-        model.con_cs_capacity_battery_A = pyo.Constraint(expr = (model.capacity_battery) <= M*model.binary_capacity_battery)
-        model.con_cs_capacity_battery_B = pyo.Constraint(expr = (settings.Cost_battery + sum(model.dual_limit_battery[i] for i in T)) <= M*(1-model.binary_capacity_battery))
-        
-        model.con_cs_capacity_PV_A = pyo.Constraint(expr = model.capacity_PV <= model.binary_capacity_PV * M)
-        model.con_cs_capacity_PV_B = pyo.Constraint(expr = (settings.Cost_PV + sum(model.dual_limit_PV[i] * PV_availability[i] for i in T)) <= (1-model.binary_capacity_PV) * M)
-
-        self.constraints["big-M"] = {
-            "dual_limit_PV_A": model.con_cs_dual_limit_PV_A,
-            "dual_limit_PV_B": model.con_cs_dual_limit_PV_B,
-            "dual_limit_battery_A": model.con_cs_dual_limit_battery_A,
-            "dual_limit_battery_B": model.con_cs_dual_limit_battery_B,
-            "energy_buy_A" : model.con_cs_energy_buy_A,
-            "energy_buy_B" : model.con_cs_energy_buy_B,
-            "energy_sell_A": model.con_cs_energy_sell_A,
-            "energy_sell_B": model.con_cs_energy_sell_B,
-            "energy_battery_out_A": model.con_cs_energy_battery_out_A,
-            "energy_battery_out_B": model.con_cs_energy_battery_out_B,
-            "energy_battery_in_A": model.con_cs_energy_battery_in_A,
-            "energy_battery_in_B": model.con_cs_energy_battery_in_B,
-            "energy_battery_A": model.con_cs_energy_battery_A,
-            "energy_battery_B": model.con_cs_energy_battery_B,
-            "energy_PV_A": model.con_cs_energy_PV_A,
-            "energy_PV_B": model.con_cs_energy_PV_B,
-            "capacity_battery_A": model.con_cs_capacity_battery_A,
-            "capacity_battery_B": model.con_cs_capacity_battery_B,
-            "capacity_PV_A": model.con_cs_capacity_PV_A,
-            "capacity_PV_B": model.con_cs_capacity_PV_B,
-        }
-    
-    def add_SOS(self)->None:
-        settings = self.settings
-        PV_availability = self.PV_availability
+        def big_M(name, i = None):
+            if not isinstance(M, dict):
+                return M
+            value = M[name]
+            return float(value) if i is None or np.ndim(value) == 0 else float(value[i])
+
+        self.variables["indicator"] = {}
+        self.constraints["indicator"] = {}
+        bigM = {}
+        for name, index, var, slack in pairs:
+            zero = Disjunct() if index is None else Disjunct(index)
+            tight = Disjunct() if index is None else Disjunct(index)
+            model.add_component("disjunct_" + name + "_A", zero)
+            model.add_component("disjunct_" + name + "_B", tight)
+            for i in ([None] if index is None else index):
+                data_A, data_B = (zero, tight) if i is None else (zero[i], tight[i])
+                data_A.con = pyo.Constraint(expr = var(i) == 0)
+                data_B.con = pyo.Constraint(expr = slack(i) == 0)
+                bigM[data_A] = big_M(name + "_A", i)
+                bigM[data_B] = big_M(name + "_B", i)
+            if index is None:
+                disjunction = Disjunction(expr = [zero, tight])
+            else:
+                disjunction = Disjunction(index, rule = lambda model, i, zero = zero, tight = tight: [zero[i], tight[i]])
+            model.add_component("con_cs_" + name, disjunction)
+            self.variables["indicator"][name] = zero
+            self.constraints["indicator"][name] = disjunction
+        removed = len(self.presolved_pairs) * len(self.hours_no_PV)
+        self._reduced("indicator", rows = 2 * removed, binaries = 2 * removed)
+
+        if transformation is not None:
+            pyo.TransformationFactory(transformation).apply_to(model, bigM = bigM)
+
+    @timed("add_nonlinear")
+    def add_nonlinear(self) -> None:
+        """Add the complementarity constraints as products var * slack == 0 (needs an NLP solver)."""
+        pairs = self.complementarity_pairs()
         model = self.model
-        T  = self.T
-        
-        model.con_sos_dual_limit_PV = pyo.ConstraintList()
-        for i in T:
-            model.con_sos_dual_limit_PV = pyo.SOSConstraint(model.dual_limit_PV[i],level=1)
-            
 
+        self.constraints["nonlinear"] = {}
+        for name, index, var, slack in pairs:
+            if index is None:
+                con = pyo.Constraint(expr = var(None) * slack(None) == 0)
+            else:
+                con = pyo.Constraint(index, rule = lambda model, i, var = var, slack = slack: var(i) * slack(i) == 0)
+            model.add_component("con_cs_" + name, con)
+            self.constraints["nonlinear"][name] = con
+        self._reduced("nonlinear", rows = len(self.presolved_pairs) * len(self.hours_no_PV))
+
+    @timed("lp_start")
+    def lp_start(self, solver_name: str = "appsi_highs") -> float:
+        """Set the variables of the KKT model to the primal LP optimum and its duals.
+
+        Phase one of the two-phase solve: only the primal layer and primal_obj
+        are active while the LP is solved, the duals are read from model.dual.
+        An optimal primal-dual pair is complementary, so the binaries (or SOS
+        slacks, or disjunct indicators) follow from var(i) > slack(i) and the
+        values form a feasible start for solve(..., warmstart=True), as long
+        as they satisfy the big-M values. bigm.compute_big_M only bounds some
+        optimal dual solution, the LP solver may return another one (e.g. the
+        whole battery price in one hour of dual_limit_battery), which makes
+        the start infeasible. delta_demand and fixed variables keep their
+        values.
+
+        :return: objective of the primal LP
+        """
+        if not ("primal" in self.constraints and "dual" in self.variables):
+            raise Exception("primal and dual variables and constraints should be added first")
+        model = self.model
+        self.solution = None
+
+        # Step 1: solve the primal LP, all other constraints and objectives are switched off
+        primal = set(id(con) for con in self.constraints["primal"].values())
+        inactive = [
+            con for con in model.component_data_objects((pyo.Constraint, pyo.SOSConstraint), active=True)
+            if id(con.parent_component()) not in primal
+        ]
+        objectives = list(model.component_data_objects(pyo.Objective, active=True))
+        delta_demand = [var for var in model.delta_demand.values() if not var.fixed]
+        added_suffix = not hasattr(model, "dual")
+        if added_suffix:
+            model.dual = pyo.Suffix(direction=pyo.Suffix.IMPORT)
+        for component in inactive + objectives:
+            component.deactivate()
+        for var in delta_demand:
+            var.fix()
+        model.primal_obj.activate()
+        try:
+            solver_output = SolverFactory(solver_name).solve(model, tee = False)
+            if solver_output.solver.termination_condition != TerminationCondition.optimal:
+                raise Exception(f"the primal LP could not be solved: {solver_output.solver.termination_condition}")
+            objective = pyo.value(model.primal_obj)
+            duals = {
+                name: [model.dual[con_data] for con_data in con.values()]
+                for name, con in self.constraints["primal"].items()
+            }
+        finally:
+            model.primal_obj.deactivate()
+            for component in inactive + objectives:
+                component.activate()
+            for var in delta_demand:
+                var.unfix()
+            if added_suffix:
+                model.del_component(model.dual)
+
+        # Step 2: dual variables
+        for name, values in duals.items():
+            dual_name, sign = self.dual_rows[name]
+            variables = self.variables["dual"][dual_name]
+            # the rows of limit_pv only exist at the hours with PV availability
+            variables = [variables[i] for i in self.hours_PV] if name == "limit_pv" else variables.values()
+            for var, value in zip(variables, values):
+                if not var.fixed:
+                    var.set_value(sign * value, skip_validation=True)
+
+        # Step 3: complementarity pattern, fixed variables (e.g. of deactivated pairs) are kept
+        def start(component, i, value):
+            var = component if i is None else component[i]
+            if not var.fixed:
+                var.set_value(value, skip_validation=True)
+
+        for name, index, var, slack in self.complementarity_pairs():
+            for i in ([None] if index is None else index):
+                value = pyo.value(self._nonnegative(var(i)))
+                slack_value = pyo.value(slack(i))
+                if "big-M" in self.variables:
+                    start(self.variables["big-M"][name], i, int(value > slack_value))
+                if "SOS1" in self.variables:
+                    start(self.variables["SOS1"][name], i, max(slack_value, 0.0))
+                if "indicator" in self.variables:
+                    zero = self.variables["indicator"][name]
+                    tight = model.component("disjunct_" + name + "_B")
+                    start((zero if i is None else zero[i]).binary_indicator_var, None, int(value <= slack_value))
+                    start((tight if i is None else tight[i]).binary_indicator_var, None, int(value > slack_value))
+
+        return objective
+
+
+    @timed("add_upper_level")
+    def add_upper_level(self, upper_settings: UpperSettings) -> None:
+        """Release delta_demand and add the counterfactual upper level.
+
+        The upper level looks for the smallest change of the demand such that
+        the optimal solution of the lower level (the primal LP, enforced by the
+        dual and complementarity layers) reaches the target of upper_settings.
+        delta_demand = delta_increase - delta_decrease with
+        0 <= delta_increase <= max_increase and 0 <= delta_decrease <= Demand[i];
+        outside the candidate hours both are fixed at 0, release_hours() frees
+        more hours later. The objective upper_obj is in energy units
+        (Demand_total * |delta_demand|) and replaces all other objectives.
+        """
+        if not ("primal" in self.constraints and "dual" in self.constraints):
+            raise Exception("primal and dual variables and constraints should be added first")
+        if not any(layer in self.constraints for layer in ("big-M", "SOS1", "indicator", "nonlinear")):
+            raise Exception("complementarity constraints should be added first, otherwise the lower level is not optimal")
+        if upper_settings.norm not in ("L1", "cardinality"):
+            raise ValueError(f"unknown norm {upper_settings.norm}, use L1 or cardinality")
+        model = self.model
+        T = self.T
+        Demand = np.asarray(self.Demand, dtype=float)
+        Demand_total = self.settings.Demand_total
+        max_increase = upper_settings.max_increase if upper_settings.max_increase is not None else float(Demand.max())
+        self.upper_settings = upper_settings
+
+        # release delta variable, delta = increase - decrease so that the sum of both is the L1 norm
+        model.delta_demand.unfix()
+        model.delta_increase = pyo.Var(T, bounds=(0, max_increase))
+        model.delta_decrease = pyo.Var(T, bounds=lambda model, i: (0, Demand[i]))
+        self.variables["upper"] = {
+            "delta_demand": model.delta_demand,
+            "delta_increase": model.delta_increase,
+            "delta_decrease": model.delta_decrease,
+        }
+        model.con_delta = pyo.Constraint(T, rule = lambda model, i: model.delta_demand[i] == model.delta_increase[i] - model.delta_decrease[i])
+        self.constraints["upper"] = {"delta": model.con_delta}
+
+        # target on the lower level solution, the sum over the hours for an indexed variable
+        target = self.variables["primal"][upper_settings.variable]
+        value = sum(target.values()) if target.is_indexed() else target
+        if upper_settings.lower is not None:
+            model.con_target_lower = pyo.Constraint(expr = value >= upper_settings.lower)
+            self.constraints["upper"]["target_lower"] = model.con_target_lower
+        if upper_settings.upper is not None:
+            model.con_target_upper = pyo.Constraint(expr = value <= upper_settings.upper)
+            self.constraints["upper"]["target_upper"] = model.con_target_upper
+
+        # binary changed[i] allows a change in hour i, at most max_changes hours change
+        norm = Demand_total * sum(model.delta_increase[i] + model.delta_decrease[i] for i in T)
+        if upper_settings.norm == "cardinality" or upper_settings.max_changes is not None:
+            model.delta_changed = pyo.Var(T, within=pyo.Binary)
+            self.variables["upper"]["changed"] = model.delta_changed
+            model.con_changed_increase = pyo.Constraint(T, rule = lambda model, i: model.delta_increase[i] <= max_increase * model.delta_changed[i])
+            model.con_changed_decrease = pyo.Constraint(T, rule = lambda model, i: model.delta_decrease[i] <= Demand[i] * model.delta_changed[i])
+            self.constraints["upper"]["changed_increase"] = model.con_changed_increase
+            self.constraints["upper"]["changed_decrease"] = model.con_changed_decrease
+            if upper_settings.max_changes is not None:
+                model.con_max_changes = pyo.Constraint(expr = sum(model.delta_changed[i] for i in T) <= upper_settings.max_changes)
+                self.constraints["upper"]["max_changes"] = model.con_max_changes
+        if upper_settings.norm == "cardinality":
+            # fewest changed hours first, the L1 norm only breaks ties
+            scale = 1e-3 / max(Demand_total * (max_increase + float(Demand.max())) * len(T), 1e-12)
+            objective = sum(model.delta_changed[i] for i in T) + scale * norm
+        else:
+            objective = norm
 
+        for obj in model.component_data_objects(pyo.Objective, active=True):
+            obj.deactivate()
+        model.upper_obj = pyo.Objective(expr = objective, sense=pyo.minimize)
 
-    def add_upper_level(self, upper_settings: UpperSettings) -> None:
-        
-        # release delta variable
-        model.delta_demand.fixed = False
-        
-        # define constraints
\ No newline at end of file
+        for i in T:
+            model.delta_increase[i].fix(0)
+            model.delta_decrease[i].fix(0)
+        self.release_hours(T if upper_settings.candidate_hours is None else upper_settings.candidate_hours)
+
+    def release_hours(self, hours: list[int]) -> None:
+        """Let the demand change in these hours as well (after add_upper_level)."""
+        model = self.model
+        for i in hours:
+            model.delta_increase[i].unfix()
+            model.delta_decrease[i].unfix()
@@ -0,0 +1,85 @@
+import cProfile
+import functools
+import json
+import logging
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from pydantic import BaseModel
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, the memory of the phases is then not recorded
+    resource = None
+
+logger = logging.getLogger("house")
+
+# Profiling of production runs without code changes:
+# HOUSE_PROFILE=cprofile writes the cProfile stats of every phase to HOUSE_PROFILE_DIR/<phase>.prof,
+# HOUSE_PROFILE=tracemalloc records the peak of the Python allocations of every phase,
+# both can be combined as HOUSE_PROFILE=cprofile,tracemalloc
+PROFILE = "HOUSE_PROFILE"
+PROFILE_DIR = "HOUSE_PROFILE_DIR"
+
+class Timing(BaseModel):
+    # wall time in seconds
+    time: float
+    # increase of the peak resident memory of the process in MB, None without the resource module
+    rss: float | None
+    # peak of the Python allocations in MB while tracemalloc is on, else None
+    traced: float | None = None
+
+
+def _peak_rss() -> float | None:
+    if resource is None:
+        return None
+    # ru_maxrss is in kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+@contextmanager
+def phase(timings: dict[str, Timing], name: str, owner: str = ""):
+    """Record the wall time and memory of the enclosed block as timings[name].
+
+    Every phase also emits one JSON log line on the "house" logger (level INFO).
+    """
+    profile = os.environ.get(PROFILE, "").lower().split(",")
+    profiler = cProfile.Profile() if "cprofile" in profile else None
+    tracing = "tracemalloc" in profile
+    if tracing:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        traced_start = tracemalloc.get_traced_memory()[0]
+    rss_start = _peak_rss()
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        elapsed = time.perf_counter() - start
+        traced = None
+        if tracing:
+            traced = (tracemalloc.get_traced_memory()[1] - traced_start) / 2**20
+        rss = None if rss_start is None else _peak_rss() - rss_start
+        timings[name] = Timing(time=elapsed, rss=rss, traced=traced)
+        if profiler is not None:
+            directory = os.environ.get(PROFILE_DIR, "profiles")
+            os.makedirs(directory, exist_ok=True)
+            profiler.dump_stats(os.path.join(directory, f"{owner or 'model'}.{name}.prof"))
+        logger.info(json.dumps({"event": "phase", "model": owner, "phase": name, **timings[name].model_dump()}))
+
+def timed(name: str):
+    """Decorator that records a method of HouseModel as phase name in self.timings."""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with phase(self.timings, name, type(self).__name__):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,275 @@
+import json
+
+import numpy as np
+import pyomo
+import pyomo.environ as pyo
+import scipy.sparse as sp
+from pydantic import BaseModel, ConfigDict
+from scipy.sparse.linalg import splu
+
+from model import HouseModel
+from profiling import logger
+
+# objective parameter -> (primal variable, coefficient of the variable per unit of the parameter)
+COST_PARAMETERS = {
+    "Cost_PV": ("capacity_PV", 1.0),
+    "Cost_battery": ("capacity_battery", 1.0),
+    "Cost_buy": ("energy_buy", 1.0),
+    "Sell_price": ("energy_sell", -1.0),
+}
+
+# Pyomo versions whose appsi_highs interface was checked by _Highs
+PYOMO_VERSIONS = ((6, 4), (6, 10))
+
+class Range(BaseModel):
+    """Interval of a parameter in which the optimal basis stays optimal (and feasible).
+
+    All fields have the shape of the parameter, () for the scalars and (hours,) for Demand.
+    Within [lower, upper] the objective is objective + marginal * (parameter - value):
+    for the costs the primal solution is unchanged, for Demand the duals are unchanged.
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    value: np.ndarray
+    lower: np.ndarray
+    upper: np.ndarray
+    # derivative of the objective with respect to the parameter
+    marginal: np.ndarray
+
+class Sensitivity(BaseModel):
+    objective: float
+    ranges: dict[str, Range]
+    # parameter -> largest relative error of the predicted objective at the checked interval edges
+    validation: dict[str, float] = {}
+
+
+def _ratio(slack: np.ndarray, rate: np.ndarray, tolerance: float) -> tuple[np.ndarray, np.ndarray]:
+    """Interval of theta in which slack + theta * rate >= 0 holds in every row, per column of rate."""
+    slack = np.maximum(slack, 0)[:, None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        steps = -slack / rate
+    lower = np.where(rate > tolerance, steps, -np.inf).max(axis=0, initial=-np.inf)
+    upper = np.where(rate < -tolerance, steps, np.inf).min(axis=0, initial=np.inf)
+    return lower, upper
+
+
+class _Basis:
+    """Optimal basis of the LP of a persistent appsi_highs solver.
+
+    The LP is min c x subject to A x - r = 0, lb <= x <= ub and
+    row_lb <= r <= row_ub; the basis matrix B holds the columns of [A, -I]
+    of the basic structural and row variables.
+    """
+    def __init__(self, highs, tolerance: float):
+        lp = highs.getLp()
+        if lp.sense_ != type(lp.sense_).kMinimize:
+            raise ValueError("sensitivity ranging needs a minimized objective")
+        self.tolerance = tolerance
+        m, n = lp.num_row_, lp.num_col_
+        matrix = lp.a_matrix_
+        self.A = sp.csc_matrix((matrix.value_, matrix.index_, matrix.start_), shape=(m, n))
+        self.c = np.array(lp.col_cost_)
+        self.lower = np.concatenate([lp.col_lower_, lp.row_lower_])
+        self.upper = np.concatenate([lp.col_upper_, lp.row_upper_])
+        solution = highs.getSolution()
+        self.x = np.concatenate([solution.col_value, solution.row_value])
+        basis = highs.getBasis()
+        status = list(basis.col_status) + list(basis.row_status)
+        self.basic = np.array([str(s).endswith("kBasic") for s in status])
+        # nonbasic variables at their upper bound, free nonbasic variables have kZero
+        self.at_upper = np.array([str(s).endswith("kUpper") for s in status])[~self.basic]
+        self.free = np.array([str(s).endswith("kZero") for s in status])[~self.basic]
+        if self.basic.sum() != m:
+            raise ValueError("the solver has no valid basis, solve the LP with appsi_highs first")
+        augmented = sp.hstack([self.A, -sp.identity(m, format="csc")], format="csc")
+        self.B = splu(augmented[:, np.flatnonzero(self.basic)].tocsc())
+        self.N = augmented[:, np.flatnonzero(~self.basic)].tocsc()
+        self.cost = np.concatenate([self.c, np.zeros(m)])
+        self.reduced = self._reduced(self.cost)
+
+    def _reduced(self, cost: np.ndarray) -> np.ndarray:
+        # reduced costs of the nonbasic variables for the cost vector of all variables
+        y = self.B.solve(cost[self.basic], trans="T")
+        return cost[~self.basic] - self.N.T @ y
+
+    def cost_range(self, direction: np.ndarray) -> tuple[float, float]:
+        """Interval of theta in which the basis stays optimal for the costs c + theta * direction."""
+        rate = self._reduced(np.concatenate([direction, np.zeros(len(self.x) - len(direction))]))
+        # fixed variables (e.g. equality rows) stay optimal for every reduced cost
+        fixed = self.upper[~self.basic] - self.lower[~self.basic] <= self.tolerance
+        rows = ~fixed & ~self.free
+        # reduced costs are >= 0 at the lower and <= 0 at the upper bound
+        sign = np.where(self.at_upper, -1.0, 1.0)
+        low, up = _ratio((sign * self.reduced)[rows], (sign * rate)[rows, None], self.tolerance)
+        # free nonbasic variables need a reduced cost of zero
+        if np.any(np.abs(rate[self.free]) > self.tolerance):
+            return 0.0, 0.0
+        return float(low[0]), float(up[0])
+
+    def rhs_ranges(self, rows: np.ndarray, shifts: np.ndarray, chunk: int = 256) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Intervals of theta in which the basis stays feasible if the bounds of row rows[k] move by theta * shifts[k].
+
+        Every column of the sparse matrix shifts (shape (len(rows), count)) is
+        one direction; also returns the derivative of the objective along every
+        direction. The directions are solved in chunks to bound the memory.
+        """
+        m, n = self.A.shape
+        basic = np.flatnonzero(self.basic)
+        # position of every variable among the basic ones, -1 if nonbasic
+        position = np.full(len(self.x), -1)
+        position[basic] = np.arange(m)
+        moved = position[n + rows]
+        shifts = sp.csr_matrix(shifts)
+        value = self.x[basic]
+        # only basic variables with a finite bound limit the step
+        finite_lower = np.flatnonzero(np.isfinite(self.lower[basic]))
+        finite_upper = np.flatnonzero(np.isfinite(self.upper[basic]))
+        lower_all, upper_all, marginal_all = [], [], []
+        for start in range(0, shifts.shape[1], chunk):
+            part = shifts[:, start:start + chunk].toarray()
+            # a nonbasic row follows its moved bound, B delta_B = e_row * shift for the column -e_row of the row
+            rhs = np.zeros((m, part.shape[1]))
+            rhs[rows[moved < 0]] = part[moved < 0]
+            delta_B = self.B.solve(rhs)
+            # a basic row keeps its value, but its bounds move
+            bound_shift = np.zeros_like(delta_B)
+            bound_shift[moved[moved >= 0]] = part[moved >= 0]
+            rate = delta_B - bound_shift
+            low_lb, up_lb = _ratio(value[finite_lower] - self.lower[basic][finite_lower], rate[finite_lower], self.tolerance)
+            low_ub, up_ub = _ratio(self.upper[basic][finite_upper] - value[finite_upper], -rate[finite_upper], self.tolerance)
+            lower_all.append(np.maximum(low_lb, low_ub))
+            upper_all.append(np.minimum(up_lb, up_ub))
+            marginal_all.append(self.cost[basic] @ delta_B)
+        return np.concatenate(lower_all), np.concatenate(upper_all), np.concatenate(marginal_all)
+
+
+class _Highs:
+    """The HiGHS instance of a persistent appsi_highs solver with the column of every
+    Pyomo variable (by id) and the row of every constraint.
+
+    appsi keeps them in private attributes, this is the only place that reads
+    them: it raises if they are missing and logs a warning for a Pyomo version
+    newer than PYOMO_VERSIONS.
+    """
+    def __init__(self, solver):
+        version = pyomo.version.version_info[:2]
+        names = ["_solver_model", "_pyomo_var_to_solver_var_map", "_pyomo_con_to_solver_con_map"]
+        missing = [name for name in names if not hasattr(solver, name)]
+        low, high = (".".join(map(str, v)) for v in PYOMO_VERSIONS)
+        if missing or version < PYOMO_VERSIONS[0]:
+            raise RuntimeError(f"the appsi_highs interface of Pyomo {pyomo.version.version} does not expose the HiGHS basis, "
+                               f"sensitivity ranging is checked with Pyomo {low} to {high}")
+        if version > PYOMO_VERSIONS[1]:
+            logger.warning(json.dumps({"event": "untested", "module": "sensitivity", "pyomo": pyomo.version.version, "checked": [low, high]}))
+        self.highs = solver._solver_model
+        self.columns = solver._pyomo_var_to_solver_var_map
+        self.rows = solver._pyomo_con_to_solver_con_map
+
+def _columns(highs: _Highs, house: HouseModel, variable: str) -> np.ndarray:
+    return np.array([highs.columns[id(data)] for data in house.variables["primal"][variable].values()])
+
+def _demand_rows(highs: _Highs, house: HouseModel, basis: _Basis) -> tuple[np.ndarray, np.ndarray]:
+    """Rows of con_eq_energy and the move of their bounds per unit of Demand[i] / Demand_total."""
+    rows = np.array([highs.rows[house.model.con_eq_energy[i]] for i in house.T])
+    # the row holds a * (energy_buy[i] + ...) with the constant a * Demand_total * Demand[i] as its bounds
+    buy = _columns(highs, house, "energy_buy")
+    a = np.asarray(basis.A[rows, buy]).ravel()
+    return rows, a
+
+
+def ranging(house: HouseModel, validate: bool = False, validate_hours: int = 10, tolerance: float = 1e-9) -> Sensitivity:
+    """Objective and right-hand side ranging of a solved primal HouseModel in one pass.
+
+    The house should be built with add_primal() only, with primal_obj active
+    and solved by appsi_highs, whose persistent HiGHS instance holds the
+    optimal basis. For Cost_PV, Cost_battery, Cost_buy and Sell_price the
+    costs of all their variables move together; for every hour of Demand the
+    right-hand side of con_eq_energy moves (Demand_total is ranged as well).
+    One LU factorization of the basis serves all parameters.
+
+    The intervals are those of the current basis: at degenerate optima they
+    can be smaller than the interval in which the solution is unchanged.
+    With validate=True the model is re-solved at every finite edge (for
+    validate_hours evenly spaced hours of Demand) and the relative error of
+    the predicted objective is stored in Sensitivity.validation.
+    """
+    if set(house.constraints) != {"primal"} or not house.model.primal_obj.active:
+        raise ValueError("sensitivity ranging needs a primal model with primal_obj active")
+    if house.solver_name != "appsi_highs" or house.status is None or not house.status.optimal:
+        raise ValueError("solve the model with appsi_highs to an optimal basis first")
+    highs = _Highs(house.solver)
+    basis = _Basis(highs.highs, tolerance)
+    objective = float(pyo.value(house.model.primal_obj))
+    settings = house.settings
+
+    ranges = {}
+    for name, (variable, factor) in COST_PARAMETERS.items():
+        direction = np.zeros(len(basis.c))
+        columns = _columns(highs, house, variable)
+        direction[columns] = factor
+        low, up = basis.cost_range(direction)
+        value = getattr(settings, name)
+        ranges[name] = Range(
+            value = np.asarray(value),
+            lower = np.asarray(value + low),
+            upper = np.asarray(value + up),
+            marginal = np.asarray(factor * basis.x[columns].sum()),
+        )
+
+    rows, a = _demand_rows(highs, house, basis)
+    Demand = np.asarray(house.Demand, dtype=float)
+    hours = len(rows)
+    # one direction per hour and one for Demand_total, which moves all rows by Demand[i]
+    shifts = sp.hstack([sp.diags(a * settings.Demand_total), sp.csc_matrix((a * Demand)[:, None])])
+    low, up, marginal = basis.rhs_ranges(rows, shifts)
+    ranges["Demand"] = Range(value = Demand, lower = Demand + low[:hours], upper = Demand + up[:hours], marginal = marginal[:hours])
+    ranges["Demand_total"] = Range(
+        value = np.asarray(settings.Demand_total),
+        lower = np.asarray(settings.Demand_total + low[hours]),
+        upper = np.asarray(settings.Demand_total + up[hours]),
+        marginal = np.asarray(marginal[hours]),
+    )
+
+    sensitivity = Sensitivity(objective = objective, ranges = ranges)
+    if validate:
+        sensitivity.validation = _validate(house, sensitivity, validate_hours)
+    return sensitivity
+
+
+def _validate(house: HouseModel, sensitivity: Sensitivity, validate_hours: int) -> dict[str, float]:
+    """Re-solve a mutable copy of the house at the interval edges and compare the objectives."""
+    check = HouseModel(house.settings, house.PV_availability, house.Demand, mutable=True,
+                       initial_battery=house.initial_battery, final_battery=house.final_battery)
+    check.add_primal()
+    check.model.primal_obj.activate()
+    # keep the fixed variables of the house, e.g. fixed capacities
+    for var in house.model.component_data_objects(pyo.Var):
+        if var.fixed:
+            check.model.find_component(var.name).fix(var.value)
+
+    def error(parameter, value, expected) -> float:
+        original = parameter.value
+        parameter.set_value(value)
+        check.solve("appsi_highs", tee=False)
+        parameter.set_value(original)
+        if not check.status.optimal:
+            return np.inf
+        return abs(check.status.objective - expected) / max(1.0, abs(expected))
+
+    validation = {}
+    for name, bounds in sensitivity.ranges.items():
+        if name == "Demand":
+            hours = np.unique(np.linspace(0, len(check.T) - 1, validate_hours).astype(int))
+            parameters = [(check.parameters["Demand"][check.T[i]], i) for i in hours]
+        else:
+            parameters = [(check.parameters[name], ())]
+        errors = [0.0]
+        for parameter, index in parameters:
+            value = float(bounds.value[index])
+            for edge in (float(bounds.lower[index]), float(bounds.upper[index])):
+                if not np.isfinite(edge):
+                    continue
+                expected = sensitivity.objective + float(bounds.marginal[index]) * (edge - value)
+                errors.append(error(parameter, edge, expected))
+        validation[name] = max(errors)
+    return validation
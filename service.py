@@ -0,0 +1,337 @@
+"""Local asynchronous solve service.
+
+Scenario jobs are posted as JSON, identical jobs in flight are solved once,
+and a bounded number of worker processes solves them in the order of their
+priority (lower first). Progress (the phase events of profiling) and the
+final Output are streamed back as lines of JSON. Only the standard library
+and the local solvers are used, so it runs offline:
+
+    python service.py --port 8765 --workers 2
+
+    curl -X POST localhost:8765/jobs -d '{"settings": {...}, "stop": 168, "model": "big-M"}'
+    curl localhost:8765/jobs/<id>/stream
+    curl localhost:8765/metrics
+"""
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import multiprocessing
+import time
+
+import numpy as np
+from pydantic import BaseModel
+
+from model import Settings
+
+class JobRequest(BaseModel):
+    settings: Settings
+    # explicit time series, otherwise the window [start, stop) of the profiles of the time-series store
+    PV_availability: list[float] | None = None
+    Demand: list[float] | None = None
+    PV_profile: int | str = 0
+    Demand_profile: int | str = 0
+    start: int = 0
+    stop: int | None = None
+    # "primal" or a complementarity formulation of KKT ("big-M", "SOS1", "indicator")
+    model: str = "primal"
+    # big-M value, default bigm.compute_big_M
+    M: float | None = None
+    solver: str = "appsi_highs"
+    # seconds, passed to the solver; the worker is killed after twice the limit plus grace
+    time_limit: float | None = None
+    # lower runs first, not part of the identity of a job
+    priority: int = 0
+
+    def key(self) -> str:
+        return hashlib.sha256(self.model_dump_json(exclude={"priority"}).encode()).hexdigest()
+
+
+class Job:
+    def __init__(self, id: str, request: JobRequest):
+        self.id = id
+        self.request = request
+        self.priority = request.priority
+        # queued, running, done, failed or timeout
+        self.state = "queued"
+        self.events = []
+        self.changed = asyncio.Condition()
+        self.submitted = time.perf_counter()
+        self.started = None
+        self.finished = None
+        self.requests = 1
+
+    async def emit(self, event: dict) -> None:
+        async with self.changed:
+            self.events.append(event)
+            self.changed.notify_all()
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "state": self.state,
+            "priority": self.priority,
+            "requests": self.requests,
+            "wait": (self.started or time.perf_counter()) - self.submitted,
+            "run": None if self.started is None else (self.finished or time.perf_counter()) - self.started,
+        }
+
+
+def _build(request: JobRequest):
+    # imported in the worker process only
+    from bigm import compute_big_M
+    from kkt import KKT
+    from model import HouseModel
+    from timeseries import load_store
+
+    if request.PV_availability is not None and request.Demand is not None:
+        PV_availability, Demand = np.asarray(request.PV_availability), np.asarray(request.Demand)
+    else:
+        PV_availability, Demand = load_store().inputs(request.PV_profile, request.Demand_profile, request.start, request.stop)
+    if request.model == "primal":
+        house = HouseModel(request.settings, PV_availability, Demand)
+        house.add_primal()
+    else:
+        options = {}
+        if request.model in ("big-M", "indicator"):
+            options["M"] = request.M if request.M is not None else compute_big_M(request.settings, PV_availability, Demand)
+        house = KKT(request.settings, PV_availability, Demand, request.model, **options)
+    house.model.primal_obj.activate()
+    return house
+
+class _PipeHandler(logging.Handler):
+    def __init__(self, connection):
+        super().__init__()
+        self.connection = connection
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            event = json.loads(record.getMessage())
+        except ValueError:
+            event = {"event": "log", "message": record.getMessage()}
+        self.connection.send(("progress", event))
+
+def _work(request_json: str, connection) -> None:
+    """Entry point of a worker process, sends ("progress", event) messages and one ("result" | "error", ...)."""
+    from profiling import logger
+    from solvers import SolverSettings
+
+    logger.addHandler(_PipeHandler(connection))
+    logger.setLevel(logging.INFO)
+    try:
+        request = JobRequest.model_validate_json(request_json)
+        house = _build(request)
+        house.solve(SolverSettings(solver=request.solver, time_limit=request.time_limit), tee=False)
+        result = {"status": house.status.model_dump()}
+        if house.status.feasible:
+            result["output"] = json.loads(house.get_output().model_dump_json())
+        connection.send(("result", result))
+    except Exception as error:
+        connection.send(("error", f"{type(error).__name__}: {error}"))
+    finally:
+        connection.close()
+
+
+def _percentiles(values: list[float]) -> dict:
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": float(np.mean(values)),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "max": float(np.max(values)),
+    }
+
+
+class SolveService:
+    """Job queue with deduplication, priorities and a bounded number of worker processes."""
+    def __init__(self, workers: int = 2, grace: float = 30.0):
+        self.workers = workers
+        self.grace = grace
+        self.jobs = {}
+        # key -> job, while queued or running
+        self.in_flight = {}
+        self.queue = asyncio.PriorityQueue()
+        self.counter = itertools.count()
+        self.waits = []
+        self.runs = []
+        self.deduplicated = 0
+        self.context = multiprocessing.get_context("spawn")
+
+    def submit(self, request: JobRequest) -> tuple[Job, bool]:
+        """Queue a job, or return the identical job in flight (with the higher priority of both)."""
+        key = request.key()
+        job = self.in_flight.get(key)
+        if job is not None:
+            job.requests += 1
+            self.deduplicated += 1
+            if request.priority < job.priority and job.state == "queued":
+                job.priority = request.priority
+                self.queue.put_nowait((job.priority, next(self.counter), job))
+            return job, True
+        job = Job(key[:16] + format(next(self.counter), "x"), request)
+        self.jobs[job.id] = job
+        self.in_flight[key] = job
+        self.queue.put_nowait((job.priority, next(self.counter), job))
+        return job, False
+
+    async def run(self) -> None:
+        await asyncio.gather(*(self._slot() for _ in range(self.workers)))
+
+    async def _slot(self) -> None:
+        while True:
+            priority, _, job = await self.queue.get()
+            # stale entries of jobs whose priority was raised
+            if job.state != "queued" or priority != job.priority:
+                continue
+            await self._execute(job)
+
+    async def _execute(self, job: Job) -> None:
+        job.state = "running"
+        job.started = time.perf_counter()
+        self.waits.append(job.started - job.submitted)
+        await job.emit({"event": "started", "wait": job.started - job.submitted})
+
+        loop = asyncio.get_running_loop()
+        receiver, sender = self.context.Pipe(duplex=False)
+        process = self.context.Process(target=_work, args=(job.request.model_dump_json(), sender), daemon=True)
+        process.start()
+        sender.close()
+        messages = asyncio.Queue()
+
+        def pump():
+            # blocking reads in a thread, a large message arrives in several chunks and would block the event loop
+            while True:
+                try:
+                    message = receiver.recv()
+                except (EOFError, OSError):
+                    loop.call_soon_threadsafe(messages.put_nowait, ("error", "the worker exited without a result"))
+                    return
+                loop.call_soon_threadsafe(messages.put_nowait, message)
+                if message[0] != "progress":
+                    return
+
+        reading = loop.run_in_executor(None, pump)
+        limit = None if job.request.time_limit is None else 2 * job.request.time_limit + self.grace
+        final = None
+        try:
+            while True:
+                kind, payload = await asyncio.wait_for(messages.get(), None if limit is None else max(limit - (time.perf_counter() - job.started), 0))
+                if kind == "progress":
+                    await job.emit(payload)
+                    continue
+                state = "done" if kind == "result" else "failed"
+                final = {"event": kind, kind: payload}
+                break
+        except asyncio.TimeoutError:
+            state = "timeout"
+            final = {"event": "timeout", "limit": limit}
+        finally:
+            if final is None or state == "timeout":
+                # the pump returns once the killed worker closed its end of the pipe
+                process.kill()
+            await loop.run_in_executor(None, process.join)
+            await reading
+            receiver.close()
+            job.finished = time.perf_counter()
+            self.runs.append(job.finished - job.started)
+            self.in_flight.pop(job.request.key(), None)
+        # an identical request after the final event starts a new job
+        job.state = state
+        await job.emit(final)
+
+    def metrics(self) -> dict:
+        states = [job.state for job in self.jobs.values()]
+        return {
+            "queue_depth": states.count("queued"),
+            "running": states.count("running"),
+            "done": states.count("done"),
+            "failed": states.count("failed") + states.count("timeout"),
+            "deduplicated": self.deduplicated,
+            "workers": self.workers,
+            "wait": _percentiles(self.waits),
+            "run": _percentiles(self.runs),
+        }
+
+    async def stream(self, job: Job):
+        """Yield the events of a job from the beginning until it is finished."""
+        position = 0
+        while True:
+            async with job.changed:
+                while position == len(job.events) and job.state in ("queued", "running"):
+                    await job.changed.wait()
+                events = job.events[position:]
+            position += len(events)
+            for event in events:
+                yield event
+            if job.state not in ("queued", "running") and position == len(job.events):
+                return
+
+
+async def _respond(writer, status: str, body: dict) -> None:
+    data = json.dumps(body).encode()
+    writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode() + data)
+    await writer.drain()
+
+async def _chunk(writer, event: dict) -> None:
+    data = json.dumps(event).encode() + b"\n"
+    writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+    await writer.drain()
+
+async def handle(service: SolveService, reader, writer) -> None:
+    """One HTTP/1.1 request: POST /jobs, GET /jobs/<id>, GET /jobs/<id>/stream, GET /metrics."""
+    try:
+        method, path, _ = (await reader.readline()).decode().split(" ", 2)
+        length = 0
+        while (line := (await reader.readline()).decode().strip()):
+            name, value = line.split(":", 1)
+            if name.lower() == "content-length":
+                length = int(value)
+        body = await reader.readexactly(length) if length else b""
+        parts = [part for part in path.split("?")[0].split("/") if part]
+
+        if method == "POST" and parts == ["jobs"]:
+            try:
+                request = JobRequest.model_validate_json(body)
+            except ValueError as error:
+                return await _respond(writer, "400 Bad Request", {"error": str(error)})
+            job, deduplicated = service.submit(request)
+            return await _respond(writer, "202 Accepted", {**job.summary(), "deduplicated": deduplicated})
+        if method == "GET" and parts == ["metrics"]:
+            return await _respond(writer, "200 OK", service.metrics())
+        if method == "GET" and len(parts) in (2, 3) and parts[0] == "jobs":
+            job = service.jobs.get(parts[1])
+            if job is None:
+                return await _respond(writer, "404 Not Found", {"error": f"unknown job {parts[1]}"})
+            if len(parts) == 2:
+                result = next((event for event in reversed(job.events) if event["event"] in ("result", "error", "timeout")), None)
+                return await _respond(writer, "200 OK", {**job.summary(), "result": result})
+            if parts[2] == "stream":
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nTransfer-Encoding: chunked\r\nConnection: close\r\n\r\n")
+                async for event in service.stream(job):
+                    await _chunk(writer, event)
+                writer.write(b"0\r\n\r\n")
+                return await writer.drain()
+        await _respond(writer, "404 Not Found", {"error": f"unknown path {method} {path}"})
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host: str = "127.0.0.1", port: int = 8765, workers: int = 2) -> None:
+    service = SolveService(workers)
+    server = await asyncio.start_server(lambda reader, writer: handle(service, reader, writer), host, port)
+    async with server:
+        await asyncio.gather(server.serve_forever(), service.run())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local asynchronous solve service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=2, help="solver worker processes")
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.workers))
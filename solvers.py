@@ -0,0 +1,100 @@
+import os
+
+from pydantic import BaseModel
+from pyomo.opt import SolverFactory
+
+SETTINGS = "solverSettings.txt"
+
+# solvers whose Pyomo interface passes the problem to the solver library in
+# memory (highspy); all other solvers are called through problem files
+IN_MEMORY = {"appsi_highs", "highs"}
+
+# solver -> option names of threads, time_limit and mip_gap
+UNIFORM_OPTIONS = {
+    "cplex": {"threads": "threads", "time_limit": "timelimit", "mip_gap": "mip_tolerances_mipgap"},
+    "gurobi": {"threads": "Threads", "time_limit": "TimeLimit", "mip_gap": "MIPGap"},
+    "appsi_highs": {"threads": "threads", "time_limit": "time_limit", "mip_gap": "mip_rel_gap"},
+    "highs": {"threads": "threads", "time_limit": "time_limit", "mip_gap": "mip_rel_gap"},
+    "cbc": {"threads": "threads", "time_limit": "sec", "mip_gap": "ratio"},
+    "glpk": {"time_limit": "tmlim", "mip_gap": "mipgap"},
+}
+
+class SolverSettings(BaseModel):
+    solver: str = "cplex"
+    threads: int | None = None
+    # seconds
+    time_limit: float | None = None
+    # relative MIP gap
+    mip_gap: float | None = None
+    # solver specific options, passed as they are
+    options: dict[str, str | int | float] = {}
+
+    @property
+    def in_memory(self) -> bool:
+        return self.solver in IN_MEMORY
+
+    def solver_options(self) -> dict[str, str | int | float]:
+        """Options in the names of the solver, the uniform settings translated."""
+        options = {}
+        names = UNIFORM_OPTIONS.get(self.solver, {})
+        for field in ["threads", "time_limit", "mip_gap"]:
+            value = getattr(self, field)
+            if value is None:
+                continue
+            if field not in names:
+                raise ValueError(f"{field} is not supported for the solver {self.solver}")
+            # glpk takes the time limit in whole seconds
+            options[names[field]] = int(value) if self.solver == "glpk" and field == "time_limit" else value
+        options.update(self.options)
+        return options
+
+    def create(self):
+        return SolverFactory(self.solver)
+
+class SolveResult(BaseModel):
+    solver: str
+    # termination condition of Pyomo, e.g. "optimal", "infeasible", "maxTimeLimit"
+    status: str
+    optimal: bool
+    # a solution was loaded into the model (optimal or e.g. at the time limit)
+    feasible: bool
+    objective: float | None = None
+    lower_bound: float | None = None
+    upper_bound: float | None = None
+    # wall time of the solve call in seconds
+    time: float
+    message: str | None = None
+
+
+def _parse(value: str) -> str | int | float:
+    for kind in (int, float):
+        try:
+            return kind(value)
+        except ValueError:
+            pass
+    return value
+
+def read_solver_settings(path: str = SETTINGS) -> SolverSettings:
+    """Read solverSettings.txt: lines "keyword = value", # starts a comment.
+
+    "solver" selects the solver, "threads", "time_limit" and "mip_gap" are
+    translated for every solver and all other keywords are passed as options.
+    Without the file the defaults of SolverSettings are used.
+    """
+    if not os.path.exists(path):
+        return SolverSettings()
+    fields = {}
+    options = {}
+    with open(path) as file:
+        for number, line in enumerate(file, 1):
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            if "=" not in line:
+                raise ValueError(f"{path}:{number}: expected 'keyword = value', got '{line}'")
+            key, value = (part.strip() for part in line.split("=", 1))
+            if key in ("solver", "threads", "time_limit", "mip_gap"):
+                fields[key] = value
+            else:
+                options[key] = _parse(value)
+    return SolverSettings(**fields, options=options)
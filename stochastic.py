@@ -0,0 +1,514 @@
+import json
+import multiprocessing
+import os
+import time
+from typing import Iterator
+
+import numpy as np
+import scipy.sparse as sp
+from pydantic import BaseModel
+from scipy.optimize import Bounds, LinearConstraint, milp
+
+from matrix import MILP_STATUS, MatrixModel
+from model import Settings
+from profiling import logger
+from timeseries import load_store
+
+# first-stage decisions, shared by all scenarios
+FIRST_STAGE = ["capacity_PV", "capacity_battery"]
+
+class ScenarioSettings(BaseModel):
+    """Sampling of the demand and PV scenarios from the bundled profiles, see sample_scenario."""
+    # hours of every scenario, default from start to the end of the store
+    hours: int | None = None
+    # first hour, the position of the scenarios in the calendar
+    start: int = 0
+    # the days of a scenario are drawn from the days within window_days of the same calendar day
+    window_days: int = 14
+    seed: int = 0
+    PV_profile: int | str = 0
+    Demand_profile: int | str = 0
+
+class Iteration(BaseModel):
+    iteration: int
+    # average of the first-stage decisions of the scenarios
+    capacity_PV: float
+    capacity_battery: float
+    # sum over the first-stage decisions of the expected |capacity_s - average|, relative to the average
+    convergence: float
+    # wall time of the iteration, and the sum and maximum of the scenario solve times
+    time: float
+    solve_time: float
+    max_solve_time: float
+
+class StochasticResult(BaseModel):
+    method: str
+    scenarios: int
+    capacity_PV: float
+    capacity_battery: float
+    # expected total cost of the capacities (capacity costs plus the mean operating cost)
+    objective: float | None
+    # lower bound of the optimal expected cost, the objective for the extensive form
+    lower_bound: float | None = None
+    # total cost of every scenario with the capacities
+    scenario_costs: list[float]
+    converged: bool
+    # progressive hedging only
+    iterations: list[Iteration] = []
+    time: float
+
+
+def sample_scenario(scenario_settings: ScenarioSettings, index: int) -> tuple[np.ndarray, np.ndarray]:
+    """(PV_availability, Demand) of one scenario, a day-wise bootstrap of the bundled profiles.
+
+    Every day of the scenario takes the PV availability of a random day
+    within window_days of the same calendar day, and the demand of a random
+    day of the same weekday within that window, so the seasons and the weekly
+    pattern remain. PV and demand days are drawn independently. The random
+    state only depends on seed and index, so a worker process can generate
+    its scenarios on its own.
+    """
+    store = load_store()
+    start = scenario_settings.start
+    hours = scenario_settings.hours or store.hours - start
+    # whole days of the store, and whole weeks for the demand
+    days_PV = store.hours // 24
+    days_Demand = days_PV - days_PV % 7
+
+    rng = np.random.default_rng([scenario_settings.seed, index])
+    hour = start + np.arange(hours)
+    day = hour // 24
+    first, last = day[0], day[-1]
+    window = scenario_settings.window_days
+    shift_PV = rng.integers(-window, window + 1, last - first + 1)
+    shift_Demand = 7 * rng.integers(-(window // 7), window // 7 + 1, last - first + 1)
+    source_PV = (day + shift_PV[day - first]) % days_PV * 24 + hour % 24
+    source_Demand = (day + shift_Demand[day - first]) % days_Demand * 24 + hour % 24
+    PV_availability = store.get("PV_availability", scenario_settings.PV_profile)[source_PV]
+    Demand = store.get("Demand", scenario_settings.Demand_profile)[source_Demand]
+    return PV_availability, Demand
+
+
+def generate_scenarios(scenario_settings: ScenarioSettings, scenarios: int) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    """Yield the scenarios 0, ..., scenarios - 1 one at a time."""
+    for index in range(scenarios):
+        yield sample_scenario(scenario_settings, index)
+
+
+def extensive_form(
+    settings: Settings,
+    scenarios: int,
+    scenario_settings: ScenarioSettings = ScenarioSettings(),
+    **options,
+) -> StochasticResult:
+    """Solve the two-stage problem as one LP with the capacities shared by all scenarios.
+
+    The primal LP of every scenario (MatrixModel.add_primal) is one block of
+    the matrix, the capacity columns of the blocks are merged. The scenarios
+    have equal probability, so the objective is the capacity cost plus the
+    mean operating cost. The blocks are added one scenario at a time.
+    Raises a ValueError with the status if the LP is not solved to
+    optimality, e.g. if the mean sell revenue of PV exceeds its cost, as
+    progressive_hedging does for a scenario.
+
+    :param options: passed to scipy.optimize.milp
+    """
+    start_time = time.perf_counter()
+    blocks, c, lb, ub, row_lb, row_ub = [], [], [], [], [], []
+    # per scenario: columns of the scenario LP in the extensive form, and its cost vector
+    columns, costs = [], []
+    n_cols = len(FIRST_STAGE)
+    c_first = np.zeros(n_cols)
+    for PV_availability, Demand in generate_scenarios(scenario_settings, scenarios):
+        lp = MatrixModel(settings, PV_availability, Demand)
+        lp.add_primal()
+        first = np.array([lp.columns[name] for name in FIRST_STAGE])
+        second = np.setdiff1d(np.arange(lp.n_cols), first)
+        mapping = np.empty(lp.n_cols, dtype=int)
+        mapping[first] = np.arange(len(FIRST_STAGE))
+        mapping[second] = n_cols + np.arange(len(second))
+        n_cols += len(second)
+
+        cost = lp.c("primal_obj")
+        matrix = lp.A.tocoo()
+        blocks.append((matrix.row, mapping[matrix.col], matrix.data))
+        c.append(cost[second] / scenarios)
+        c_first += cost[first] / scenarios
+        lb.append(lp.lb[second])
+        ub.append(lp.ub[second])
+        row_lb.append(lp.row_lb)
+        row_ub.append(lp.row_ub)
+        columns.append(mapping)
+        costs.append(cost)
+
+    offsets = np.cumsum([0] + [len(bounds) for bounds in row_lb])
+    A = sp.csr_matrix((
+        np.concatenate([data for _, _, data in blocks]),
+        (np.concatenate([rows + offset for (rows, _, _), offset in zip(blocks, offsets)]), np.concatenate([cols for _, cols, _ in blocks])),
+    ), shape=(offsets[-1], n_cols))
+    first_lb = np.zeros(len(FIRST_STAGE))
+    first_ub = np.full(len(FIRST_STAGE), np.inf)
+    result = milp(
+        np.concatenate([c_first] + c),
+        constraints=LinearConstraint(A, np.concatenate(row_lb), np.concatenate(row_ub)),
+        bounds=Bounds(np.concatenate([first_lb] + lb), np.concatenate([first_ub] + ub)),
+        options=options,
+    )
+    if result.status != 0:
+        raise ValueError(f"the extensive form could not be solved: {MILP_STATUS.get(result.status, 'error')}")
+    x = result.x
+    return StochasticResult(
+        method = "extensive",
+        scenarios = scenarios,
+        capacity_PV = float(x[0]),
+        capacity_battery = float(x[1]),
+        objective = float(result.fun),
+        lower_bound = float(result.fun),
+        scenario_costs = [float(cost @ x[mapping]) for cost, mapping in zip(costs, columns)],
+        converged = True,
+        time = time.perf_counter() - start_time,
+    )
+
+
+class _Subproblem:
+    """Primal LP of one scenario with the proximal term of progressive hedging, kept between iterations.
+
+    The quadratic term rho/2 (y - center)^2 of every first-stage decision y is
+    replaced by a variable t >= 0 above tangents of the parabola at
+    center +- delta, so the subproblem stays an LP (like the linearized
+    penalty terms of PySP). Only costs, row bounds and, once, the tangent
+    slopes change between iterations, so with highspy one persistent HiGHS
+    instance re-solves from the previous basis. With persistent=False only
+    the basis is kept and HiGHS is loaded again for every solve, which needs
+    far less memory per scenario. Without highspy every solve is a new
+    scipy.optimize.milp call.
+    """
+    def __init__(self, settings: Settings, PV_availability: np.ndarray, Demand: np.ndarray, cuts: int, persistent: bool = True):
+        lp = MatrixModel(settings, PV_availability, Demand)
+        lp.add_primal()
+        self.first = np.array([lp.columns[name] for name in FIRST_STAGE])
+        self.t = lp.n_cols + np.arange(len(FIRST_STAGE))
+        # tangents at center and at center +- delta for cuts + 1 values of delta up to the outer reach
+        self.tangents = 2 * cuts + 3
+        self.cut_rows = lp.n_rows + np.arange(len(FIRST_STAGE) * self.tangents)
+        self.base_cost = lp.c("primal_obj")
+
+        n = lp.n_cols + len(FIRST_STAGE)
+        k = np.repeat(np.arange(len(FIRST_STAGE)), self.tangents)
+        matrix = lp.A.tocoo()
+        self.rows = np.concatenate([matrix.row, self.cut_rows, self.cut_rows])
+        self.cols = np.concatenate([matrix.col, self.t[k], self.first[k]])
+        self.data = np.concatenate([matrix.data, np.ones(len(k)), np.zeros(len(k))])
+        # positions of the slopes of the tangents in data
+        self.slopes = matrix.nnz + len(k) + np.arange(len(k))
+        self.c = np.concatenate([self.base_cost, np.zeros(len(FIRST_STAGE))])
+        self.lb = np.concatenate([lp.lb, np.zeros(len(FIRST_STAGE))])
+        self.ub = np.concatenate([lp.ub, np.full(len(FIRST_STAGE), np.inf)])
+        self.row_lb = np.concatenate([lp.row_lb, np.full(len(k), -np.inf)])
+        self.row_ub = np.concatenate([lp.row_ub, np.full(len(k), np.inf)])
+        self.shape = (lp.n_rows + len(k), n)
+
+        try:
+            import highspy
+        except ImportError:
+            highspy = None
+        self.highspy = highspy
+        self.persistent = persistent
+        self.basis = None
+        self.highs = self._highs() if highspy is not None and persistent else None
+        # of the last solve, "optimal", "infeasible", "unbounded", ...
+        self.status = None
+
+    def _highs(self):
+        highs = self.highspy.Highs()
+        highs.setOptionValue("output_flag", False)
+        highs.setOptionValue("threads", 1)
+        # infinite bounds are passed as they are, highspy.kHighsInf is inf
+        highs.addVars(self.shape[1], self.lb, self.ub)
+        highs.changeColsCost(self.shape[1], np.arange(self.shape[1], dtype=np.int32), self.c)
+        A = sp.csr_matrix((self.data, (self.rows, self.cols)), shape=self.shape)
+        A.sort_indices()
+        highs.addRows(self.shape[0], self.row_lb, self.row_ub, A.nnz, A.indptr[:-1].astype(np.int32), A.indices.astype(np.int32), A.data)
+        if self.basis is not None:
+            highs.setBasis(self.basis)
+        return highs
+
+    def set_costs(self, columns: np.ndarray, values: np.ndarray) -> None:
+        self.c[columns] = values
+        if self.highs is not None:
+            self.highs.changeColsCost(len(columns), columns.astype(np.int32), np.asarray(values, dtype=float))
+
+    def set_bounds(self, columns: np.ndarray, lb: np.ndarray, ub: np.ndarray) -> None:
+        self.lb[columns], self.ub[columns] = lb, ub
+        if self.highs is not None:
+            self.highs.changeColsBounds(len(columns), columns.astype(np.int32), self.lb[columns], self.ub[columns])
+
+    def set_row_bounds(self, rows: np.ndarray, lb: np.ndarray, ub: np.ndarray) -> None:
+        self.row_lb[rows], self.row_ub[rows] = lb, ub
+        if self.highs is not None:
+            self.highs.changeRowsBounds(len(rows), rows.astype(np.int32), self.row_lb[rows], self.row_ub[rows])
+
+    def set_slopes(self, slopes: np.ndarray) -> None:
+        self.data[self.slopes] = slopes
+        if self.highs is not None:
+            for row, col, value in zip(self.rows[self.slopes], self.cols[self.slopes], slopes):
+                self.highs.changeCoeff(int(row), int(col), float(value))
+
+    def solve(self) -> np.ndarray | None:
+        """Solution of the LP, None if it is not optimal (see self.status)."""
+        if self.highspy is not None:
+            highs = self.highs or self._highs()
+            highs.run()
+            if not self.persistent:
+                self.basis = highs.getBasis()
+            status = highs.getModelStatus()
+            self.status = highs.modelStatusToString(status).lower()
+            if status != self.highspy.HighsModelStatus.kOptimal:
+                return None
+            return np.array(highs.getSolution().col_value)
+        A = sp.csr_matrix((self.data, (self.rows, self.cols)), shape=self.shape)
+        result = milp(self.c, constraints=LinearConstraint(A, self.row_lb, self.row_ub), bounds=Bounds(self.lb, self.ub))
+        self.status = MILP_STATUS.get(result.status, "error")
+        return result.x if result.status == 0 else None
+
+
+class _ScenarioGroup:
+    """Subproblems of the scenarios of one worker, generated in the worker."""
+    def __init__(self, settings: Settings, scenario_settings: ScenarioSettings, indices: list[int], cuts: int, persistent: bool):
+        self.subproblems = {index: _Subproblem(settings, *sample_scenario(scenario_settings, index), cuts, persistent) for index in indices}
+
+    def solve(self, weights: dict[int, np.ndarray] | None = None, rho: np.ndarray | None = None, center: np.ndarray | None = None,
+              deltas: np.ndarray | None = None, fixed: np.ndarray | None = None) -> dict[int, tuple]:
+        """Solve every scenario, returns index -> (first-stage values, total cost without the PH terms, solve time, status).
+
+        The values and the cost are None if the scenario is not solved to optimality.
+
+        :param weights: index -> PH weights of the first-stage decisions, None for none
+        :param rho, center, deltas: proximal term rho/2 (y - center)^2 with tangents
+            at center + deltas, a row of deltas per first-stage decision, None for none
+        :param fixed: first-stage values to evaluate
+        """
+        proximal = center is not None
+        if proximal:
+            # t - 2 delta y >= - delta^2 - 2 delta center
+            slopes = (-2 * deltas).ravel()
+            lower = (- deltas ** 2 - 2 * deltas * center[:, None]).ravel()
+        results = {}
+        for index, subproblem in self.subproblems.items():
+            start = time.perf_counter()
+            cost = subproblem.base_cost[subproblem.first] + (weights[index] if weights is not None else 0.0)
+            subproblem.set_costs(subproblem.first, cost)
+            subproblem.set_costs(subproblem.t, rho / 2 if proximal else np.zeros(len(FIRST_STAGE)))
+            if proximal:
+                subproblem.set_slopes(slopes)
+                subproblem.set_row_bounds(subproblem.cut_rows, lower, np.full(len(lower), np.inf))
+            else:
+                subproblem.set_row_bounds(subproblem.cut_rows, np.full(len(subproblem.cut_rows), -np.inf), np.full(len(subproblem.cut_rows), np.inf))
+            if fixed is not None:
+                subproblem.set_bounds(subproblem.first, fixed, fixed)
+            x = subproblem.solve()
+            if x is None:
+                results[index] = (None, None, time.perf_counter() - start, subproblem.status)
+            else:
+                results[index] = (x[subproblem.first], float(subproblem.base_cost @ x[:len(subproblem.base_cost)]), time.perf_counter() - start, subproblem.status)
+        return results
+
+
+def _worker(connection, arguments: tuple) -> None:
+    """Entry point of a worker process, calls the methods of its _ScenarioGroup until it receives None."""
+    try:
+        group = _ScenarioGroup(*arguments)
+        connection.send(("ready", None))
+        while (message := connection.recv()) is not None:
+            method, args = message
+            connection.send(("result", getattr(group, method)(*args)))
+    except Exception as error:
+        connection.send(("error", f"{type(error).__name__}: {error}"))
+    finally:
+        connection.close()
+
+
+class _Workers:
+    """Scenario groups in worker processes (or in this process with processes=1), scenario s belongs to worker s % processes."""
+    def __init__(self, settings: Settings, scenario_settings: ScenarioSettings, scenarios: int, processes: int, cuts: int, persistent: bool):
+        groups = [list(range(worker, scenarios, processes)) for worker in range(processes)]
+        if processes == 1:
+            self.local = _ScenarioGroup(settings, scenario_settings, groups[0], cuts, persistent)
+            return
+        self.local = None
+        context = multiprocessing.get_context("spawn")
+        self.connections, self.processes = [], []
+        for indices in groups:
+            parent, child = context.Pipe()
+            process = context.Process(target=_worker, args=(child, (settings, scenario_settings, indices, cuts, persistent)), daemon=True)
+            process.start()
+            child.close()
+            self.connections.append(parent)
+            self.processes.append(process)
+        self._receive()
+
+    def _receive(self) -> list:
+        results = []
+        for connection in self.connections:
+            kind, payload = connection.recv()
+            if kind == "error":
+                self.close()
+                raise Exception(f"a scenario worker failed: {payload}")
+            results.append(payload)
+        return results
+
+    def call(self, method: str, *args) -> dict:
+        if self.local is not None:
+            return getattr(self.local, method)(*args)
+        for connection in self.connections:
+            connection.send((method, args))
+        merged = {}
+        for result in self._receive():
+            merged.update(result or {})
+        return merged
+
+    def close(self) -> None:
+        if self.local is not None:
+            return
+        for connection, process in zip(self.connections, self.processes):
+            try:
+                connection.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            process.join()
+            connection.close()
+
+
+def progressive_hedging(
+    settings: Settings,
+    scenarios: int,
+    scenario_settings: ScenarioSettings = ScenarioSettings(),
+    rho: float | list[float] | None = None,
+    max_iterations: int = 50,
+    tolerance: float = 1e-3,
+    processes: int | None = None,
+    cuts: int = 8,
+    persistent: bool = False,
+    adaptive: bool = True,
+) -> StochasticResult:
+    """Solve the two-stage problem by progressive hedging over the scenarios.
+
+    Every scenario is solved alone with its own capacities, the weights w_s
+    and the proximal term rho/2 (capacity_s - average)^2 pull them towards
+    their average, until the expected deviation from the average and the
+    move of the average in the last iteration are below tolerance (relative
+    to the average). The capacities are then fixed at
+    the average and every scenario is solved once more, which gives the
+    expected cost of a feasible first-stage decision. The weights sum to zero
+    over the scenarios, so the scenarios solved with the final weights but
+    without the proximal term give a lower bound. The scenario LPs stay in
+    their worker processes and re-solve from their previous basis. Every
+    scenario alone has to be bounded: a scenario that is not solved to
+    optimality raises a ValueError with its status, like extensive_form.
+
+    :param rho: penalty per first-stage decision, default the cost of the
+        decision over the expected deviation of the first iteration (Watson and Woodruff)
+    :param processes: worker processes, default the number of CPUs
+    :param cuts: tangents per side of the piecewise linear proximal term
+    :param persistent: keep one HiGHS instance per scenario (about 70 MB for a
+        full year), otherwise only its basis
+    :param adaptive: double rho of a decision whose deviation is more than ten
+        times the move of its average in the iteration and halve it in the
+        opposite case (residual balancing), otherwise rho stays fixed
+    """
+    start_time = time.perf_counter()
+    processes = max(1, min(processes or os.cpu_count() or 1, scenarios))
+    workers = _Workers(settings, scenario_settings, scenarios, processes, cuts, persistent)
+    indices = range(scenarios)
+    iterations = []
+
+    def run(*args):
+        iteration_start = time.perf_counter()
+        results = workers.call("solve", *args)
+        failed = [index for index in indices if results[index][0] is None]
+        if failed:
+            statuses = ", ".join(sorted({results[index][3] for index in failed}))
+            raise ValueError(f"the scenarios {failed} could not be solved: {statuses}")
+        Y = np.array([results[index][0] for index in indices])
+        times = np.array([results[index][2] for index in indices])
+        return Y, np.array([results[index][1] for index in indices]), times, time.perf_counter() - iteration_start
+
+    def record(iteration, Y, center, times, elapsed):
+        deviation = np.abs(Y - center).mean(axis=0)
+        convergence = float(deviation.sum() / max(np.abs(center).sum(), 1e-9))
+        iterations.append(Iteration(
+            iteration = iteration,
+            capacity_PV = float(center[0]),
+            capacity_battery = float(center[1]),
+            convergence = convergence,
+            time = elapsed,
+            solve_time = float(times.sum()),
+            max_solve_time = float(times.max()),
+        ))
+        logger.info(json.dumps({"event": "progressive_hedging", **iterations[-1].model_dump()}))
+        return deviation, convergence
+
+    try:
+        # iteration 0: every scenario with its own capacities
+        Y, _, times, elapsed = run()
+        center = Y.mean(axis=0)
+        deviation, convergence = record(0, Y, center, times, elapsed)
+        if rho is None:
+            rho = np.array([settings.Cost_PV, settings.Cost_battery]) / np.maximum(deviation, 1.0)
+        rho = np.array(np.broadcast_to(np.asarray(rho, dtype=float), (len(FIRST_STAGE),)))
+        weights = rho * (Y - center)
+
+        converged = convergence <= tolerance
+        iteration = 0
+        previous_scale = None
+        while not converged and iteration < max_iterations:
+            iteration += 1
+            # the finest tangent is at 2^(1-cuts) times twice the largest deviation of the last iteration, so
+            # the tangents get finer as the scenarios agree, but the scale at most halves per iteration.
+            # Beyond the outer tangent the penalty grows by twice the largest weight, which keeps every
+            # subproblem bounded. The tangents in between are spaced geometrically: with a few fine
+            # tangents and a far outer one the penalty in the gap was almost zero, and a scenario that
+            # had converged jumped away from the average.
+            scale = np.maximum(2 * np.abs(Y - center).max(axis=0), 1e-6 * np.maximum(np.abs(center), 1.0))
+            if previous_scale is not None:
+                scale = np.maximum(scale, previous_scale / 2)
+            previous_scale = scale
+            reach = np.maximum(2 * np.abs(weights).max(axis=0) / rho, 2 * scale)
+            side = np.geomspace(reach, scale * 2.0 ** (1 - cuts), cuts + 1, axis=1)
+            deltas = np.hstack([-side, np.zeros((len(FIRST_STAGE), 1)), side[:, ::-1]])
+            Y, _, times, elapsed = run({index: weights[index] for index in indices}, rho, center, deltas)
+            previous_center, center = center, Y.mean(axis=0)
+            weights += rho * (Y - center)
+            deviation, convergence = record(iteration, Y, center, times, elapsed)
+            # the move of the average is the dual residual, without it a quickly grown rho stops at a consensus
+            # that the weights have not settled yet
+            change = np.abs(center - previous_center)
+            converged = convergence <= tolerance and change.sum() / max(np.abs(center).sum(), 1e-9) <= tolerance
+            if adaptive:
+                # residual balancing: a deviation from the average that stays large against the move of the
+                # average needs a stiffer proximal term, and the other way round
+                rho[deviation > 10 * change] *= 2
+                rho[change > 10 * deviation] /= 2
+
+        # Lagrangian lower bound, -inf (None) if a weight makes a scenario unbounded
+        results = workers.call("solve", {index: weights[index] for index in indices})
+        lower_bound = None
+        if all(results[index][0] is not None for index in indices):
+            lower_bound = float(np.mean([results[index][1] + weights[index] @ results[index][0] for index in indices]))
+        # the average capacities in every scenario
+        _, costs, _, _ = run(None, None, None, None, center)
+    finally:
+        workers.close()
+
+    return StochasticResult(
+        method = "progressive_hedging",
+        scenarios = scenarios,
+        capacity_PV = float(center[0]),
+        capacity_battery = float(center[1]),
+        objective = float(costs.mean()),
+        lower_bound = lower_bound,
+        scenario_costs = costs.tolist(),
+        converged = converged,
+        iterations = iterations,
+        time = time.perf_counter() - start_time,
+    )
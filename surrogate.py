@@ -0,0 +1,255 @@
+import time
+
+import numpy as np
+from pydantic import BaseModel
+
+from model import HouseModel, Settings
+from solvers import SolverSettings
+from sweep import KPI, KPI_NAMES, Scenario, get_kpi, scale
+
+# features of the settings, the capacity costs include the lifetime
+SETTINGS_FEATURES = ["Cost_PV", "Cost_battery", "Cost_buy", "Sell_price", "Demand_total"]
+# aggregate features of the time series, see series_features
+SERIES_FEATURES = ["PV_full_load_hours", "Demand_sum", "coincidence"]
+FEATURES = SETTINGS_FEATURES + SERIES_FEATURES
+# fewer samples per varying feature leave the leave-one-out estimates, and so the standard deviation, unreliable
+SAMPLES_PER_FEATURE = 3
+
+class Prediction(BaseModel):
+    # KPI name -> value and standard deviation (0 for an exact solve)
+    kpis: dict[str, float]
+    std: dict[str, float]
+    # "surrogate" or "exact"
+    source: str
+    # why the exact model was solved, e.g. "outside" the trusted region or "uncertain"
+    reason: str | None = None
+    time: float
+
+
+def series_features(PV_availability: np.ndarray, Demand: np.ndarray) -> np.ndarray:
+    """PV full-load hours, the sum of Demand and the coincidence mean(PV * Demand) / (mean(PV) mean(Demand))."""
+    PV_availability = np.asarray(PV_availability, dtype=float)
+    Demand = np.asarray(Demand, dtype=float)
+    coincidence = np.mean(PV_availability * Demand) / max(np.mean(PV_availability) * np.mean(Demand), 1e-12)
+    return np.array([PV_availability.sum(), Demand.sum(), coincidence])
+
+def features(settings: Settings, series: np.ndarray) -> np.ndarray:
+    return np.concatenate([[getattr(settings, name) for name in SETTINGS_FEATURES], series])
+
+
+class Surrogate:
+    """Gaussian process surrogate of the KPIs of the primal model, with an exact solve as fallback.
+
+    The features are the costs of the settings and aggregate features of
+    the time series (series_features). All KPIs share one squared
+    exponential kernel on the standardized features, its length scale and
+    noise are chosen by leave-one-out error, so a prediction is one kernel
+    row times the weights of the KPIs and the predictive standard deviation
+    comes with it. New exact solves are added with a rank-one update of the
+    inverse kernel matrix, the kernel is chosen again every refit points.
+
+    The surrogate is trained from min_samples samples, and at least
+    SAMPLES_PER_FEATURE per feature that varies. Queries outside the trusted
+    region (the box of the training features, widened by margin times
+    their range) or with a standard deviation of a requested KPI above its
+    tolerance are solved exactly and added. The tolerance is
+    tolerance[name] or else rtol times the larger of the magnitude of the
+    prediction and the spread of the KPI in the samples, so that KPIs near
+    0 (e.g. no battery) do not always fall back. The capacities change in
+    steps where the optimal basis changes, so they need more samples than
+    TOTEX for the same rtol.
+    """
+    def __init__(self, PV_availability: list[float], Demand: list[float], solver_name: str | SolverSettings = "appsi_highs",
+                 margin: float = 0.05, rtol: float = 0.02, tolerance: dict[str, float] | None = None, refit: int = 16, min_samples: int = 8):
+        self.PV_availability = np.asarray(PV_availability, dtype=float)
+        self.Demand = np.asarray(Demand, dtype=float)
+        self.series = series_features(self.PV_availability, self.Demand)
+        self.solver_name = solver_name
+        self.margin = margin
+        self.rtol = rtol
+        self.tolerance = tolerance or {}
+        for name in self.tolerance:
+            if name not in KPI_NAMES:
+                raise ValueError(f"{name} is not a KPI, use one of {KPI_NAMES}")
+        self.refit = refit
+        self.min_samples = min_samples
+        self.X = np.empty((0, len(FEATURES)))
+        self.Y = np.empty((0, len(KPI_NAMES)))
+        self.added = 0
+        self.kernel = None
+        # exact solves, with a mutable model of the default time series
+        self.house = None
+        self.solves = 0
+
+    @property
+    def samples(self) -> int:
+        return len(self.X)
+
+    def add(self, settings: Settings, kpis: dict[str, float] | KPI, PV_availability: list[float] | None = None, Demand: list[float] | None = None) -> None:
+        """Add a solved model, the time series default to those of the surrogate."""
+        if isinstance(kpis, KPI):
+            kpis = kpis.model_dump()
+        if any(kpis.get(name) is None for name in KPI_NAMES):
+            return
+        series = self.series if PV_availability is None else series_features(PV_availability, Demand)
+        x = features(settings, series)
+        y = np.array([kpis[name] for name in KPI_NAMES], dtype=float)
+        self.X = np.vstack([self.X, x])
+        self.Y = np.vstack([self.Y, y])
+        self.added += 1
+        if self.kernel is None or self.added >= self.refit:
+            self.fit()
+        else:
+            self._extend(x)
+
+    def add_sweep(self, settings: Settings, kpis: list[KPI]) -> None:
+        """Add the results of sweep.run_sweep for the time series of the surrogate, restricted scenarios are skipped."""
+        for kpi in kpis:
+            if kpi.status == "optimal" and not kpi.scenario.restrictions:
+                self.X = np.vstack([self.X, features(scale(settings, kpi.scenario.scaling), self.series)])
+                self.Y = np.vstack([self.Y, [getattr(kpi, name) for name in KPI_NAMES]])
+        self.fit()
+
+    def fit(self, scales: tuple[float, ...] = (0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0), noises: tuple[float, ...] = (1e-8, 1e-6, 1e-4, 1e-2)) -> None:
+        """Choose the length scale and noise with the best leave-one-out predictions and factorize the kernel.
+
+        The signal variance of every KPI is calibrated on the leave-one-out
+        residuals, and the pair with the smallest negative log predictive
+        density of the left out samples is kept, so the standard deviation
+        matches the errors and not only the mean.
+        """
+        self.added = 0
+        if self.samples < self.min_samples:
+            self.kernel = None
+            return
+        x_mean, x_std = self.X.mean(axis=0), self.X.std(axis=0)
+        # constant features, e.g. the time series of a single house, drop out (up to rounding of the mean)
+        constant = x_std <= 1e-12 * np.maximum(np.abs(x_mean), 1.0)
+        if self.samples < SAMPLES_PER_FEATURE * int(np.sum(~constant)):
+            self.kernel = None
+            return
+        self.x_mean, self.x_std = x_mean, x_std
+        self.x_std[constant] = np.inf
+        self.y_mean, self.y_std = self.Y.mean(axis=0), self.Y.std(axis=0)
+        self.y_std[self.y_std == 0] = 1.0
+        Z = self.Z = (self.X - self.x_mean) / self.x_std
+        self.low, self.high = self.X.min(axis=0), self.X.max(axis=0)
+        distance = np.sum((Z[:, None, :] - Z[None, :, :]) ** 2, axis=2)
+        Y = (self.Y - self.y_mean) / self.y_std
+
+        best = None
+        for length in scales:
+            for noise in noises:
+                K = np.exp(-0.5 * distance / length ** 2) + noise * np.eye(len(Z))
+                try:
+                    inverse = np.linalg.inv(K)
+                except np.linalg.LinAlgError:
+                    continue
+                # leave-one-out residuals of a GP: (K^-1 y)_i / (K^-1)_ii, with variance 1 / (K^-1)_ii
+                # times the signal variance, which is chosen per KPI to make the residuals match it
+                diagonal = np.diag(inverse)
+                if np.any(diagonal <= 0):
+                    continue
+                variance = np.maximum(np.mean((inverse @ Y) ** 2 / diagonal[:, None], axis=0), 1e-12)
+                # negative log predictive density of the left out samples, up to constants
+                error = np.sum(np.log(variance)) - len(variance) * np.mean(np.log(diagonal))
+                if best is None or error < best[0]:
+                    best = (error, length, noise, inverse, variance)
+        _, self.length, self.noise, self.inverse, self.variance = best
+        self.kernel = "squared exponential"
+        self._weights()
+
+    def _weights(self) -> None:
+        self.alpha = self.inverse @ ((self.Y - self.y_mean) / self.y_std)
+
+    def _row(self, x: np.ndarray) -> np.ndarray:
+        z = (x - self.x_mean) / self.x_std
+        return np.exp(-0.5 * np.sum((self.Z - z) ** 2, axis=1) / self.length ** 2)
+
+    def _extend(self, x: np.ndarray) -> None:
+        # block inverse of the kernel matrix with one more row and column (the new sample is already in X)
+        b = self._row(x)
+        c = 1.0 + self.noise
+        u = self.inverse @ b
+        s = max(c - b @ u, 1e-12)
+        n = len(b)
+        inverse = np.empty((n + 1, n + 1))
+        inverse[:n, :n] = self.inverse + np.outer(u, u) / s
+        inverse[:n, n] = inverse[n, :n] = - u / s
+        inverse[n, n] = 1.0 / s
+        self.inverse = inverse
+        self.Z = np.vstack([self.Z, (x - self.x_mean) / self.x_std])
+        self.low, self.high = np.minimum(self.low, x), np.maximum(self.high, x)
+        self._weights()
+
+    def trusted(self, x: np.ndarray) -> bool:
+        width = self.margin * (self.high - self.low)
+        return bool(np.all((x >= self.low - width) & (x <= self.high + width)))
+
+    def estimate(self, settings: Settings, PV_availability: list[float] | None = None, Demand: list[float] | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """Mean and standard deviation of the KPIs (in the order of KPI_NAMES) without any fallback."""
+        if self.kernel is None:
+            raise Exception(f"the surrogate needs at least {self.min_samples} samples and {SAMPLES_PER_FEATURE} per varying feature")
+        series = self.series if PV_availability is None else series_features(PV_availability, Demand)
+        return self._estimate(features(settings, series))
+
+    def _estimate(self, x: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        k = self._row(x)
+        mean = self.y_mean + self.y_std * (k @ self.alpha)
+        variance = max(1.0 + self.noise - k @ self.inverse @ k, 0.0)
+        return mean, self.y_std * np.sqrt(self.variance * variance)
+
+    def predict(self, settings: Settings, PV_availability: list[float] | None = None, Demand: list[float] | None = None,
+                kpis: list[str] | None = None, exact: bool = True) -> Prediction:
+        """KPIs of the settings, from the surrogate or, if it cannot be trusted and exact is True, from a solve that is then added.
+
+        :param kpis: the KPIs whose standard deviation must be within the tolerance, default all
+        """
+        start = time.perf_counter()
+        series = self.series if PV_availability is None else series_features(PV_availability, Demand)
+        x = features(settings, series)
+        reason = None
+        if self.kernel is None:
+            reason = "untrained"
+        elif not self.trusted(x):
+            reason = "outside"
+        else:
+            mean, std = self._estimate(x)
+            names = KPI_NAMES if kpis is None else kpis
+            tolerance = self.rtol * np.maximum(np.abs(mean), self.y_std)
+            if all(std[KPI_NAMES.index(name)] <= self.tolerance.get(name, tolerance[KPI_NAMES.index(name)]) for name in names) or not exact:
+                return Prediction(kpis = dict(zip(KPI_NAMES, mean.tolist())), std = dict(zip(KPI_NAMES, std.tolist())),
+                                  source = "surrogate", time = time.perf_counter() - start)
+            reason = "uncertain"
+        if not exact:
+            raise Exception(f"the surrogate cannot answer the query: {reason}")
+
+        kpi = self.solve(settings, PV_availability, Demand)
+        if kpi.status != "optimal":
+            raise Exception(f"the exact solve is not optimal: {kpi.status}")
+        self.add(settings, kpi, PV_availability, Demand)
+        return Prediction(kpis = {name: getattr(kpi, name) for name in KPI_NAMES}, std = {name: 0.0 for name in KPI_NAMES},
+                          source = "exact", reason = reason, time = time.perf_counter() - start)
+
+    def solve(self, settings: Settings, PV_availability: list[float] | None = None, Demand: list[float] | None = None) -> KPI:
+        """Exact KPIs of the primal model, the default time series re-use one mutable model."""
+        self.solves += 1
+        if PV_availability is None:
+            if self.house is None:
+                self.house = HouseModel(settings, self.PV_availability, self.Demand, mutable=True)
+                self.house.add_primal()
+                self.house.model.primal_obj.activate()
+            house = self.house
+            house.update(settings=settings)
+        else:
+            house = HouseModel(settings, np.asarray(PV_availability, dtype=float), np.asarray(Demand, dtype=float))
+            house.add_primal()
+            house.model.primal_obj.activate()
+        try:
+            house.solve(self.solver_name, tee=False)
+        except (RuntimeError, ValueError) as error:
+            # persistent solvers raise if no solution can be loaded
+            return KPI(index=self.solves, scenario=Scenario(), status=f"error: {error}")
+        if not house.status.optimal:
+            return KPI(index=self.solves, scenario=Scenario(), status=house.status.status)
+        return get_kpi(house, self.solves, Scenario(), house.status.status)
@@ -0,0 +1,160 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterator
+
+import numpy as np
+import pyomo.environ as pyo
+from pydantic import BaseModel
+
+from model import HouseModel, Settings
+
+# restriction name -> capacity variable that is fixed
+RESTRICTIONS = {
+    "PVFixed": "capacity_PV",
+    "BatFixed": "capacity_battery",
+}
+
+class Scenario(BaseModel):
+    # Settings field -> scaling factor, e.g. {"Price_PV": 0.9}
+    scaling: dict[str, float] = {}
+    # restriction name -> fixed value, e.g. {"PVFixed": 5.0}
+    restrictions: dict[str, float] = {}
+
+class KPI(BaseModel):
+    index: int
+    scenario: Scenario
+    status: str
+    Cap_PV: float | None = None
+    Cap_Bat: float | None = None
+    Own_Gen: float | None = None
+    TOTEX: float | None = None
+    CAPEX: float | None = None
+
+KPI_NAMES = ["Cap_PV", "Cap_Bat", "Own_Gen", "TOTEX", "CAPEX"]
+
+
+def grid(restrictions: dict[str, float] | None = None, **scalings: list[float]) -> list[Scenario]:
+    """Cartesian product of scaling factors, e.g. grid(Price_PV=[0.9, 1, 1.1], Cost_buy=[1, 1.2])."""
+    for name in scalings:
+        if name not in Settings.model_fields:
+            raise ValueError(f"{name} is not a field of Settings")
+    names = list(scalings)
+    return [
+        Scenario(scaling=dict(zip(names, values)), restrictions=restrictions or {})
+        for values in itertools.product(*scalings.values())
+    ]
+
+def scale(settings: Settings, scaling: dict[str, float]) -> Settings:
+    update = {}
+    for name, factor in scaling.items():
+        if name not in Settings.model_fields:
+            raise ValueError(f"{name} is not a field of Settings")
+        update[name] = getattr(settings, name) * factor
+    return settings.model_validate(settings.model_dump() | update)
+
+def relative(kpi: KPI, base: KPI) -> dict[str, float]:
+    """Relative change of every KPI against the base, (kpi - base) / base, nan if the base is 0 (e.g. Cap_Bat without a battery)."""
+    changes = {}
+    for name in KPI_NAMES:
+        value, reference = getattr(kpi, name), getattr(base, name)
+        if value is None or reference is None:
+            changes[name] = None
+        elif reference == 0:
+            changes[name] = float("nan")
+        else:
+            changes[name] = (value - reference) / reference
+    return changes
+
+
+def get_kpi(house: HouseModel, index: int, scenario: Scenario, status: str) -> KPI:
+    model = house.model
+    settings = house.settings
+    energy_PV = np.fromiter((v.value for v in model.energy_PV.values()), dtype=float)
+    energy_sell = np.fromiter((v.value for v in model.energy_sell.values()), dtype=float)
+    demand = settings.Demand_total * np.sum(house.Demand)
+    capex = settings.Cost_PV * model.capacity_PV.value + settings.Cost_battery * model.capacity_battery.value
+    return KPI(
+        index = index,
+        scenario = scenario,
+        status = status,
+        Cap_PV = model.capacity_PV.value,
+        Cap_Bat = model.capacity_battery.value,
+        # share of the demand covered by self produced energy
+        Own_Gen = float((energy_PV.sum() - energy_sell.sum()) / demand),
+        TOTEX = pyo.value(model.primal_obj),
+        CAPEX = capex,
+    )
+
+
+# state of a worker process, the model is built once and re-solved for every scenario
+_worker = {}
+
+def _init_worker(settings: Settings, PV_availability: np.ndarray, Demand: np.ndarray, solver_name: str) -> None:
+    _worker.clear()
+    _worker.update(settings=settings, PV_availability=PV_availability, Demand=Demand, solver_name=solver_name)
+
+def _house() -> HouseModel:
+    if "house" not in _worker:
+        house = HouseModel(_worker["settings"], _worker["PV_availability"], _worker["Demand"], mutable=True)
+        house.add_primal()
+        house.model.primal_obj.activate()
+        _worker["house"] = house
+    return _worker["house"]
+
+def _solve(index: int, scenario: Scenario) -> KPI:
+    house = _house()
+    model = house.model
+    house.update(settings=scale(_worker["settings"], scenario.scaling))
+    for name, value in scenario.restrictions.items():
+        if name not in RESTRICTIONS:
+            raise ValueError(f"unknown restriction {name}, use one of {list(RESTRICTIONS)}")
+        getattr(model, RESTRICTIONS[name]).fix(value)
+    try:
+        solver_output = house.solve(_worker["solver_name"], tee=False)
+        status = str(solver_output.solver.termination_condition)
+        if status != "optimal":
+            return KPI(index=index, scenario=scenario, status=status)
+        return get_kpi(house, index, scenario, status)
+    except (RuntimeError, ValueError) as error:
+        # persistent solvers raise if no solution can be loaded
+        return KPI(index=index, scenario=scenario, status=f"error: {error}")
+    finally:
+        for name in scenario.restrictions:
+            getattr(model, RESTRICTIONS[name]).unfix()
+
+
+def run_sweep(
+    settings: Settings,
+    PV_availability: list[float],
+    Demand: list[float],
+    scenarios: list[Scenario],
+    solver_name: str = "appsi_highs",
+    processes: int | None = None,
+) -> Iterator[KPI]:
+    """Solve the primal model for every scenario and yield the KPIs as they finish.
+
+    The scenarios are distributed over a pool of worker processes. Every worker
+    builds one mutable HouseModel and re-solves it with update(), so a persistent
+    solver only receives the changed coefficients. With processes=1 the
+    scenarios are solved in this process.
+    """
+    PV_availability = np.asarray(PV_availability, dtype=float)
+    Demand = np.asarray(Demand, dtype=float)
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    if processes == 1:
+        _init_worker(settings, PV_availability, Demand, solver_name)
+        for index, scenario in enumerate(scenarios):
+            yield _solve(index, scenario)
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=processes,
+        initializer=_init_worker,
+        initargs=(settings, PV_availability, Demand, solver_name),
+    ) as pool:
+        futures = [pool.submit(_solve, index, scenario) for index, scenario in enumerate(scenarios)]
+        for future in as_completed(futures):
+            yield future.result()
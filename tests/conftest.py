@@ -0,0 +1,22 @@
+import os
+
+import numpy as np
+import pytest
+
+from model import Settings
+
+DATA = os.path.join(os.path.dirname(__file__), os.pardir, "data")
+HOURS = 72
+
+
+@pytest.fixture(scope="session")
+def series() -> tuple[np.ndarray, np.ndarray]:
+    """(PV_availability, Demand) of the first HOURS hours of the bundled profiles."""
+    PV_availability = np.loadtxt(os.path.join(DATA, "TS_PVAvail.csv"))[:HOURS]
+    Demand = np.loadtxt(os.path.join(DATA, "TS_Demand.csv"))[:HOURS]
+    return PV_availability, Demand
+
+@pytest.fixture(scope="session")
+def settings() -> Settings:
+    # the capacity costs of a year, scaled to the horizon
+    return Settings(Lifetime=round(10 * 8760 / HOURS), Price_PV=1000, Price_battery=300, Cost_buy=0.25, Sell_price=0.05, Demand_total=3500)
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from aggregation import AggregatedHouseModel, cluster_days, error_report
+from model import HouseModel
+
+
+def solve(house, objective):
+    getattr(house.model, objective).activate()
+    house.solve("appsi_highs", tee=False)
+    assert house.status.optimal
+    getattr(house.model, objective).deactivate()
+    return house.status.objective
+
+def test_one_cluster_per_day(settings, series):
+    """With every day its own representative the aggregated model is the full model."""
+    full = HouseModel(settings, *series)
+    full.add_primal()
+    expected = solve(full, "primal_obj")
+
+    days = len(series[1]) // 24
+    aggregation = cluster_days(*series, days)
+    assert np.all(aggregation.weights == 1)
+    aggregated = AggregatedHouseModel(settings, aggregation)
+    aggregated.add_primal()
+    assert solve(aggregated, "primal_obj") == pytest.approx(expected, rel=1e-7)
+
+@pytest.mark.parametrize("k", [1, 2])
+def test_aggregated_duality(settings, series, k):
+    """The weighted dual of the aggregated model has the objective of its primal."""
+    aggregated = AggregatedHouseModel(settings, cluster_days(*series, k))
+    aggregated.add_primal()
+    aggregated.add_dual()
+    assert solve(aggregated, "dual_obj") == pytest.approx(solve(aggregated, "primal_obj"), rel=1e-6)
+
+def test_error_report(settings, series):
+    report = error_report(settings, *series, 2)
+    assert report.k == 2
+    assert report.aggregated["TOTEX"] == pytest.approx(report.full["TOTEX"], rel=0.1)
+    for name, error in report.relative_error.items():
+        reference = report.full[name]
+        if reference == 0:
+            assert np.isnan(error), name
+        else:
+            assert error == pytest.approx((report.aggregated[name] - reference) / reference), name
@@ -0,0 +1,76 @@
+import itertools
+import math
+
+import numpy as np
+import pytest
+
+from attribution import Player, shapley
+from model import HouseModel
+from sweep import KPI_NAMES
+
+
+@pytest.fixture(scope="module")
+def game(settings, series):
+    """Three players: the battery price, the buying price and the demand profile against a flat one."""
+    baseline = settings.model_copy(update={"Price_battery": 200, "Cost_buy": 0.3})
+    flat = np.full(len(series[1]), np.mean(series[1]))
+    players = [Player(name="battery", field="Price_battery"), Player(name="buy", field="Cost_buy"), Player(name="demand", field="Demand")]
+    return settings, baseline, {"Demand": flat}, players
+
+def direct(settings, series, game, coalition) -> float:
+    """TOTEX of a new model whose players in coalition have their actual inputs."""
+    actual, baseline, baseline_series, players = game
+    update = {player.field: getattr(actual, player.field) for player in players if player.name in coalition and player.field != "Demand"}
+    Demand = series[1] if "demand" in coalition else baseline_series["Demand"]
+    house = HouseModel(baseline.model_copy(update=update), series[0], Demand)
+    house.add_primal()
+    house.model.primal_obj.activate()
+    house.solve("appsi_highs", tee=False)
+    assert house.status.optimal
+    return house.status.objective
+
+def test_exact(settings, series, game):
+    """The values sum to actual - baseline and equal the Shapley formula over direct solves of all coalitions."""
+    actual, baseline, baseline_series, players = game
+    result = shapley(actual, *series, baseline, baseline_series, players, processes=1)
+    assert result.coalitions == 2 ** len(players)
+    for name in KPI_NAMES:
+        assert sum(result.values[name].values()) == pytest.approx(result.actual[name] - result.baseline[name], rel=1e-9, abs=1e-9), name
+
+    names = [player.name for player in players]
+    totex = {coalition: direct(settings, series, game, set(coalition)) for size in range(len(names) + 1) for coalition in itertools.combinations(names, size)}
+    assert result.baseline["TOTEX"] == pytest.approx(totex[()], rel=1e-7)
+    assert result.actual["TOTEX"] == pytest.approx(totex[tuple(names)], rel=1e-7)
+    for player in names:
+        others = [name for name in names if name != player]
+        value = 0.0
+        for size in range(len(names)):
+            weight = math.factorial(size) * math.factorial(len(names) - size - 1) / math.factorial(len(names))
+            for coalition in itertools.combinations(others, size):
+                joined = tuple(name for name in names if name in coalition or name == player)
+                value += weight * (totex[joined] - totex[coalition])
+        assert result.values["TOTEX"][player] == pytest.approx(value, rel=1e-6, abs=1e-9), player
+
+def test_permutation(series, game):
+    """Sampled orders still sum exactly, and lie within their standard errors of the exact values."""
+    actual, baseline, baseline_series, players = game
+    exact = shapley(actual, *series, baseline, baseline_series, players, processes=1)
+    sampled = shapley(actual, *series, baseline, baseline_series, players, method="permutation", permutations=8, processes=1)
+    assert sampled.coalitions <= 2 ** len(players)
+    for name in KPI_NAMES:
+        assert sum(sampled.values[name].values()) == pytest.approx(sampled.actual[name] - sampled.baseline[name], rel=1e-9, abs=1e-9)
+    for player in sampled.players:
+        error = sampled.errors["TOTEX"][player]
+        assert np.isfinite(error)
+        assert abs(sampled.values["TOTEX"][player] - exact.values["TOTEX"][player]) <= 4 * error + 1e-6, player
+
+def test_cache_hits(series, game, tmp_path):
+    """A second call reads every coalition from the result cache, also from worker processes."""
+    actual, baseline, baseline_series, players = game
+    first = shapley(actual, *series, baseline, baseline_series, players, processes=1, cache=str(tmp_path))
+    assert (first.solves, first.cache_hits) == (first.coalitions, 0)
+    second = shapley(actual, *series, baseline, baseline_series, players, processes=2, cache=str(tmp_path))
+    assert (second.solves, second.cache_hits) == (0, second.coalitions)
+    for name in KPI_NAMES:
+        for player in second.players:
+            assert second.values[name][player] == pytest.approx(first.values[name][player], rel=1e-9, abs=1e-12)
@@ -0,0 +1,63 @@
+import os
+
+import numpy as np
+
+from cache import ResultCache, scenario_key
+from model import HouseModel
+
+
+def build(settings, series):
+    house = HouseModel(settings, *series, mutable=True)
+    house.add_primal()
+    house.model.primal_obj.activate()
+    return house
+
+def files(directory):
+    return {os.path.join(root, name): os.path.getsize(os.path.join(root, name))
+            for root, _, names in os.walk(directory) for name in names if name.endswith(".npz")}
+
+def test_hit_and_miss_after_update(settings, series, tmp_path):
+    cache = ResultCache(str(tmp_path))
+    house = build(settings, series)
+    first = cache.solve(house)
+    assert (cache.stats.hits, cache.stats.misses, cache.stats.stores) == (0, 1, 1)
+
+    second = cache.solve(build(settings, series))
+    assert (cache.stats.hits, cache.stats.misses) == (1, 1)
+    assert second.objective == first.objective
+    for name, values in first.variables.items():
+        np.testing.assert_array_equal(second.variables[name], values, err_msg=name)
+
+    key = scenario_key(house, "appsi_highs")
+    house.update(demand=np.asarray(series[1]) * 1.1)
+    assert scenario_key(house, "appsi_highs") != key
+    third = cache.solve(house)
+    assert (cache.stats.hits, cache.stats.misses, cache.stats.stores) == (1, 2, 2)
+    assert third.objective > first.objective
+
+    # .size is the total size of the stored results
+    with open(tmp_path / ".size") as file:
+        assert int(file.read()) == sum(files(str(tmp_path)).values())
+
+def test_lru_eviction(settings, series, tmp_path):
+    house = build(settings, series)
+    output = ResultCache(str(tmp_path / "probe")).solve(house)
+    cache = ResultCache(str(tmp_path / "cache"))
+    keys = ["a" * 64, "b" * 64, "c" * 64]
+    cache.put(keys[0], output)
+    cache.put(keys[1], output)
+    size = os.path.getsize(cache.path(keys[0]))
+    # a is used after b, so b is the least recently used result
+    os.utime(cache.path(keys[0]), (100, 100))
+    os.utime(cache.path(keys[1]), (200, 200))
+    assert cache.get(keys[0]) is not None
+
+    cache.max_bytes = 2 * size + size // 2
+    cache.put(keys[2], output)
+    assert cache.stats.evictions == 1
+    assert os.path.exists(cache.path(keys[0]))
+    assert not os.path.exists(cache.path(keys[1]))
+    assert cache.get(keys[1]) is None
+    assert os.path.exists(cache.path(keys[2]))
+    with open(tmp_path / "cache" / ".size") as file:
+        assert int(file.read()) == sum(files(cache.directory).values()) == 2 * size
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from counterfactual import counterfactual
+from model import HouseModel, UpperSettings
+
+
+def lp(settings, PV_availability, Demand, variable = None, lower = None):
+    house = HouseModel(settings, PV_availability, Demand)
+    house.add_primal()
+    if variable is not None:
+        getattr(house.model, variable).setlb(lower)
+    house.model.primal_obj.activate()
+    house.solve("appsi_highs", tee=False)
+    assert house.status.optimal
+    return house
+
+@pytest.mark.parametrize("variable", ["capacity_PV", "capacity_battery"])
+def test_counterfactual(settings, series, variable):
+    """The changed demand reaches the target in an optimum of the re-solved primal LP."""
+    PV_availability, Demand = series
+    base = lp(settings, *series)
+    lower = 1.2 * getattr(base.model, variable).value + 0.05
+    # one round keeps the LP pattern of all binaries, a single LP solve
+    result = counterfactual(settings, *series, UpperSettings(variable=variable, lower=lower), max_rounds=1)
+    assert result.status == "restricted"
+    assert result.target >= lower - 1e-6
+    assert result.changed_hours
+
+    delta = result.delta_demand
+    assert np.all(Demand + delta >= -1e-9)
+    assert np.all(delta[np.setdiff1d(np.arange(len(Demand)), result.changed_hours)] == pytest.approx(0, abs=1e-9))
+    assert result.objective == pytest.approx(settings.Demand_total * np.abs(delta).sum(), rel=1e-6)
+
+    # the target does not cost anything on top of the optimum for the changed demand
+    changed = lp(settings, PV_availability, Demand + delta)
+    reached = lp(settings, PV_availability, Demand + delta, variable, lower - 1e-6)
+    assert reached.status.objective == pytest.approx(changed.status.objective, rel=1e-6)
+    assert changed.status.objective != pytest.approx(base.status.objective, rel=1e-6)
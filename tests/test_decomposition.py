@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from bigm import compute_big_M
+from decomposition import benders, rolling_horizon
+from kkt import BigM_KKT
+from matrix import MatrixModel
+from model import UpperSettings
+
+
+def test_benders(settings, series):
+    matrix = MatrixModel(settings, *series)
+    matrix.add_primal()
+    matrix.solve("primal_obj")
+    result = benders(settings, *series, block=24, processes=1)
+    assert result.upper_bound == pytest.approx(matrix.status.objective, rel=1e-4)
+    assert result.lower_bound <= matrix.status.objective * (1 + 1e-9)
+
+def test_benders_is_primal_only(settings, series):
+    with pytest.raises(ValueError, match="primal LP only"):
+        benders(settings, *series, upper_settings=UpperSettings(variable="capacity_battery", lower=1.0))
+
+@pytest.mark.parametrize("mode", ["sequential", "parallel"])
+def test_rolling_horizon(settings, series, mode):
+    """The stitched windows against the monolithic big-M KKT model of the whole horizon."""
+    monolithic = BigM_KKT(settings, *series, compute_big_M(settings, *series))
+    monolithic.model.primal_obj.activate()
+    monolithic.solve("appsi_highs", tee=False)
+    assert monolithic.status.optimal
+
+    # compute_big_M only holds for the cyclic model, not for windows with a given state of charge
+    result = rolling_horizon(settings, *series, window=36, overlap=12, mode=mode, solver_name="appsi_highs", processes=2)
+    assert all(window.status == "optimal" for window in result.windows)
+    assert result.lower_bound == pytest.approx(monolithic.status.objective, rel=1e-7)
+    assert result.upper_bound >= result.lower_bound - 1e-9
+    assert result.gap == pytest.approx((result.upper_bound - result.lower_bound) / abs(result.upper_bound))
+    assert result.gap < 1e-3
+    hours = len(series[1])
+    for name, values in result.variables.items():
+        assert len(values) == (1 if name.startswith("capacity") else hours), name
+    np.testing.assert_allclose(result.variables["delta_demand"], 0)
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from dispatch import optimize_capacities, simulate
+from matrix import MatrixModel
+from model import HouseModel
+
+
+def lp(settings, series, capacities = None):
+    house = HouseModel(settings, *series)
+    house.add_primal()
+    if capacities is not None:
+        house.model.capacity_PV.fix(capacities[0])
+        house.model.capacity_battery.fix(capacities[1])
+    house.model.primal_obj.activate()
+    house.solve("appsi_highs", tee=False)
+    assert house.status.optimal
+    return house
+
+@pytest.mark.parametrize("capacities", [(0.0, 0.0), (5.0, 0.0), (5.0, 10.0), (20.0, 40.0)])
+def test_simulate_fixed_capacities(settings, series, capacities):
+    """The greedy dispatch has the operating cost of the LP with fixed capacities."""
+    house = lp(settings, series, capacities)
+    dispatch = simulate(settings, *series, *capacities)
+    assert float(dispatch.TOTEX) == pytest.approx(house.status.objective, rel=1e-9, abs=1e-9)
+    model = house.model
+    assert float(dispatch.energy_buy) == pytest.approx(sum(model.energy_buy[t].value for t in house.T), abs=1e-6)
+    assert float(dispatch.energy_sell) == pytest.approx(sum(model.energy_sell[t].value for t in house.T), abs=1e-6)
+
+def test_simulate_slow_cycle(settings, series):
+    """A large battery that gains little energy per horizon: the cyclic state is exact, not iterated."""
+    PV_availability, Demand = series
+    capacities = (1.001 * settings.Demand_total * Demand.sum() / PV_availability.sum(), 1e3)
+    house = lp(settings, series, capacities)
+    dispatch = simulate(settings, *series, *capacities)
+    assert float(dispatch.TOTEX) == pytest.approx(house.status.objective, rel=1e-9)
+    assert 0 < float(dispatch.initial_battery) < capacities[1]
+
+def test_simulate_broadcasts(settings, series):
+    PV = np.array([0.0, 5.0, 20.0])
+    battery = np.array([0.0, 10.0])
+    grid = simulate(settings, *series, PV[:, None], battery[None, :])
+    assert grid.TOTEX.shape == (3, 2)
+    for i, j in np.ndindex(grid.TOTEX.shape):
+        single = simulate(settings, *series, PV[i], battery[j])
+        assert grid.TOTEX[i, j] == pytest.approx(float(single.TOTEX), rel=1e-12)
+
+def test_optimize_capacities(settings, series):
+    """The capacity search reaches the optimum of the primal LP."""
+    matrix = MatrixModel(settings, *series)
+    matrix.add_primal()
+    matrix.solve("primal_obj")
+    assert matrix.status.optimal
+    result = optimize_capacities(settings, *series)
+    assert float(result.TOTEX) == pytest.approx(matrix.status.objective, rel=1e-6)
+    assert float(result.TOTEX) >= matrix.status.objective - 1e-9
+
+def test_simulate_rejects_arbitrage(settings, series):
+    with pytest.raises(ValueError):
+        simulate(settings.model_copy(update={"Sell_price": 0.5}), *series, 1.0, 1.0)
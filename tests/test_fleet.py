@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from fleet import FleetTemplate, run_fleet
+from model import HouseModel
+
+
+@pytest.fixture(scope="module")
+def fleet(settings, series):
+    """Four houses with shifted profiles and different demands, prices and PV."""
+    PV_availability, Demand = series
+    PV = np.array([np.roll(PV_availability, 24 * house) * scale for house, scale in enumerate([1.0, 0.8, 1.2, 1.0])])
+    D = np.array([np.roll(Demand, -24 * house) for house in range(4)])
+    houses = [
+        settings,
+        settings.model_copy(update={"Demand_total": 2000}),
+        settings.model_copy(update={"Cost_buy": 0.35, "Price_battery": 200}),
+        settings.model_copy(update={"Price_PV": 600, "Sell_price": 0.0}),
+    ]
+    return houses, PV, D
+
+def test_template_parity(fleet):
+    """The template with overwritten coefficients solves the LP of HouseModel.add_primal of every house."""
+    houses, PV, D = fleet
+    template = FleetTemplate(PV.shape[1])
+    for settings, PV_availability, Demand in zip(houses, PV, D):
+        house = HouseModel(settings, PV_availability, Demand)
+        house.add_primal()
+        house.model.primal_obj.activate()
+        house.solve("appsi_highs", tee=False)
+        assert house.status.optimal
+        status, kpis = template.solve(settings, PV_availability, Demand)
+        assert status == 0
+        assert kpis["TOTEX"] == pytest.approx(house.status.objective, rel=1e-7)
+        assert kpis["Cap_PV"] == pytest.approx(house.model.capacity_PV.value, rel=1e-5, abs=1e-7)
+        assert kpis["Cap_Bat"] == pytest.approx(house.model.capacity_battery.value, rel=1e-5, abs=1e-7)
+
+def test_run_fleet_processes(fleet):
+    """Worker processes and batches return the columns of the serial run, in the order of the houses."""
+    houses, PV, D = fleet
+    serial = run_fleet(houses, PV, D, processes=1)
+    parallel = run_fleet(houses, PV, D, processes=2, batch_size=1)
+    np.testing.assert_array_equal(parallel.status, serial.status)
+    assert np.all(serial.status == 0)
+    for name, values in serial.columns.items():
+        np.testing.assert_allclose(parallel.columns[name], values, rtol=1e-9, err_msg=name)
+    assert len(set(np.round(serial.columns["TOTEX"], 6))) == len(houses)
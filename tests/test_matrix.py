@@ -0,0 +1,108 @@
+import numpy as np
+import pyomo.environ as pyo
+import pytest
+from pyomo.repn import generate_standard_repn
+
+from model import HouseModel
+from matrix import MatrixModel
+
+
+def build(cls, settings, series, layers, M = 100):
+    model = cls(settings, *series)
+    model.add_primal()
+    if "dual" in layers:
+        model.add_dual()
+    if "big-M" in layers:
+        model.add_big_M(M)
+    return model
+
+def column(matrix: MatrixModel, var) -> int:
+    """Column of a Pyomo variable, the components have the same names in both builders."""
+    index = matrix.columns[var.parent_component().name]
+    return int(index) if isinstance(index, (int, np.integer)) else int(index[var.index()])
+
+def pyomo_row(matrix: MatrixModel, constraint) -> tuple[np.ndarray, float, float]:
+    """Dense row and bounds of a Pyomo constraint, fixed variables are moved into the bounds."""
+    repn = generate_standard_repn(constraint.body)
+    row = np.zeros(matrix.n_cols)
+    for var, coefficient in zip(repn.linear_vars, repn.linear_coefs):
+        row[column(matrix, var)] += coefficient
+    lower = -np.inf if constraint.lower is None else pyo.value(constraint.lower) - repn.constant
+    upper = np.inf if constraint.upper is None else pyo.value(constraint.upper) - repn.constant
+    return row, lower, upper
+
+def assert_same_row(expected: tuple, actual: tuple, name: str) -> None:
+    # a row may be written with the opposite sign, -upper <= -a x <= -lower
+    row, lower, upper = expected
+    if not np.allclose(row, actual[0]):
+        row, lower, upper = -row, -upper, -lower
+    np.testing.assert_allclose(actual[0], row, err_msg=name)
+    np.testing.assert_allclose([actual[1], actual[2]], [lower, upper], err_msg=name)
+
+
+@pytest.mark.parametrize("layers, objective", [(["primal"], "primal_obj"), (["primal", "dual"], "dual_obj")])
+def test_objective(settings, series, layers, objective):
+    house = build(HouseModel, settings, series, layers)
+    getattr(house.model, objective).activate()
+    house.solve("appsi_highs", tee=False)
+    assert house.status.optimal
+
+    matrix = build(MatrixModel, settings, series, layers)
+    matrix.solve(objective)
+    assert matrix.status.optimal
+    assert list(house.get_output().variables) == list(matrix.get_output().variables)
+    assert matrix.status.objective == pytest.approx(house.status.objective, rel=1e-6)
+
+def test_primal_and_dual_objective_agree(settings, series):
+    matrix = build(MatrixModel, settings, series, ["primal", "dual"])
+    matrix.solve("primal_obj")
+    primal = matrix.status.objective
+    matrix.solve("dual_obj")
+    assert matrix.status.objective == pytest.approx(primal, rel=1e-6)
+
+@pytest.mark.parametrize("M", [100, "data"])
+def test_big_M_matrix(settings, series, M):
+    """A, row bounds, variable bounds, integrality and costs of the big-M KKT model, element by element."""
+    if M == "data":
+        from bigm import compute_big_M
+        M = compute_big_M(settings, *series)
+    house = build(HouseModel, settings, series, ["primal", "dual", "big-M"], M)
+    matrix = build(MatrixModel, settings, series, ["primal", "dual", "big-M"], M)
+    A = matrix.A.toarray()
+    row_lb, row_ub = matrix.row_lb, matrix.row_ub
+
+    model = house.model
+    for layer, prefix in [("primal", "con_"), ("dual", "con_dual_"), ("big-M", "con_cs_")]:
+        assert list(house.constraints[layer]) == list(matrix.constraints[layer])
+        for name, rows in matrix.constraints[layer].items():
+            constraints = [constraint for constraint in house.constraints[layer][name].values()]
+            assert len(constraints) == len(rows), f"{prefix}{name}"
+            for constraint, r in zip(constraints, rows):
+                # delta_demand is fixed at 0 in both models, Pyomo moves it into the bounds
+                actual = A[r].copy()
+                actual[matrix.columns["delta_demand"]] = 0.0
+                assert_same_row(pyomo_row(matrix, constraint), (actual, row_lb[r], row_ub[r]), f"{prefix}{name}[{r - rows[0]}]")
+
+    lb, ub, integrality = matrix.lb, matrix.ub, matrix.integrality
+    for var in model.component_data_objects(pyo.Var):
+        j = column(matrix, var)
+        if var.fixed:
+            assert lb[j] == ub[j] == var.value, var.name
+            continue
+        assert lb[j] == (-np.inf if var.lb is None else var.lb), var.name
+        assert ub[j] == (np.inf if var.ub is None else var.ub), var.name
+        assert integrality[j] == int(var.is_integer()), var.name
+
+    for objective in ["primal_obj", "dual_obj"]:
+        repn = generate_standard_repn(getattr(model, objective).expr)
+        costs = np.zeros(matrix.n_cols)
+        for var, coefficient in zip(repn.linear_vars, repn.linear_coefs):
+            costs[column(matrix, var)] += coefficient
+        if getattr(model, objective).sense == pyo.maximize:
+            costs = -costs
+        np.testing.assert_allclose(matrix.c(objective), costs, err_msg=objective)
+
+def test_big_M_needs_both_layers(settings, series):
+    matrix = build(MatrixModel, settings, series, ["primal"])
+    with pytest.raises(Exception, match="primal and dual"):
+        matrix.add_big_M(100)
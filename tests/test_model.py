@@ -0,0 +1,123 @@
+import numpy as np
+import pyomo.environ as pyo
+import pytest
+from pyomo.gdp import Disjunction
+
+from bigm import compute_big_M
+from kkt import KKT, BigM_KKT
+from model import ArrayOutput, HouseModel
+
+
+def test_mip_solves_with_dual_suffix(settings, series):
+    """add_primal declares model.dual, a MIP solve must not ask the solver for duals."""
+    house = BigM_KKT(settings, *series, compute_big_M(settings, *series))
+    house.model.primal_obj.activate()
+    assert house.is_mip()
+    house.solve("appsi_highs", tee=False)
+    assert house.status.optimal
+    assert house.model.dual.import_enabled()
+
+    lp = HouseModel(settings, *series)
+    lp.add_primal()
+    lp.model.primal_obj.activate()
+    assert not lp.is_mip()
+    lp.solve("appsi_highs", tee=False)
+    assert len(lp.model.dual) > 0
+
+@pytest.mark.parametrize("transformation", ["gdp.bigm", None])
+def test_indicator(settings, series, transformation):
+    """The indicator KKT model has the optimum of the LP, None keeps the disjunctions for a later transformation."""
+    series = tuple(values[:24] for values in series)
+    lp = HouseModel(settings, *series)
+    lp.add_primal()
+    lp.model.primal_obj.activate()
+    lp.solve("appsi_highs", tee=False)
+
+    house = KKT(settings, *series, formulation="indicator", transformation=transformation)
+    disjunctions = list(house.model.component_data_objects(Disjunction, active=True))
+    if transformation is None:
+        assert len(disjunctions) > 0
+        pyo.TransformationFactory("gdp.bigm").apply_to(house.model, bigM=100)
+    else:
+        assert not disjunctions
+    house.model.primal_obj.activate()
+    assert house.is_mip()
+    house.solve("appsi_highs", tee=False)
+    assert house.status.optimal
+    assert house.status.objective == pytest.approx(lp.status.objective, rel=1e-6)
+
+def test_indicator_rejects_hull(settings, series):
+    house = HouseModel(settings, *series)
+    house.add_primal()
+    house.add_dual()
+    with pytest.raises(ValueError, match="gdp.bigm"):
+        house.add_indicator(transformation="gdp.hull")
+
+def violation(model) -> float:
+    """Largest violation of the active constraints and variable bounds at the current values."""
+    worst = 0.0
+    for con in model.component_data_objects(pyo.Constraint, active=True):
+        body = pyo.value(con.body)
+        if con.has_lb():
+            worst = max(worst, pyo.value(con.lower) - body)
+        if con.has_ub():
+            worst = max(worst, body - pyo.value(con.upper))
+    for var in model.component_data_objects(pyo.Var):
+        if var.value is None:
+            continue
+        if var.has_lb():
+            worst = max(worst, var.lb - var.value)
+        if var.has_ub():
+            worst = max(worst, var.value - var.ub)
+    return worst
+
+@pytest.mark.parametrize("formulation", ["big-M", "indicator"])
+def test_lp_start_is_feasible(settings, series, formulation):
+    """The start point of lp_start satisfies all constraints of the KKT model, binaries included.
+
+    M is large enough for the duals returned by the LP solver; compute_big_M
+    only bounds some optimal dual, which need not be the returned one.
+    """
+    series = tuple(values[:24] for values in series)
+    house = KKT(settings, *series, formulation=formulation, M=100)
+    objective = house.lp_start("appsi_highs")
+    assert violation(house.model) <= 1e-6
+    assert pyo.value(house.model.primal_obj) == pytest.approx(objective, rel=1e-9)
+
+def test_arrays_from_solver(settings, series):
+    """The arrays read from the HiGHS solution vectors equal the element-wise values of the components."""
+    house = HouseModel(settings, *series, presolve=True)
+    house.add_primal()
+    house.add_dual()
+    house.model.dual_obj.activate()
+    house.solve("appsi_highs", tee=False)
+    assert house.solution is not None
+    fast = house.get_arrays()
+    house.solution = None
+    slow = house.get_arrays()
+    for group in ["variables", "duals", "slacks"]:
+        expected, actual = getattr(slow, group), getattr(fast, group)
+        assert list(actual) == list(expected) and len(actual) > 0, group
+        for name, values in expected.items():
+            np.testing.assert_allclose(actual[name], values, atol=1e-9, err_msg=f"{group}.{name}")
+
+@pytest.mark.parametrize("path", ["arrays.npz", "arrays"])
+def test_array_output_round_trip(settings, series, tmp_path, path):
+    """save and load keep every array and the metadata, as .npz and as memory-mapped .npy files."""
+    house = HouseModel(settings, *series)
+    house.add_primal()
+    house.model.primal_obj.activate()
+    house.solve("appsi_highs", tee=False)
+    arrays = house.get_arrays()
+    path = str(tmp_path / path)
+    arrays.save(path)
+    loaded = ArrayOutput.load(path, mmap_mode=None if path.endswith(".npz") else "r")
+    assert loaded.objective == arrays.objective
+    assert set(loaded.timings) == set(arrays.timings)
+    for group in ["variables", "duals", "slacks"]:
+        expected, actual = getattr(arrays, group), getattr(loaded, group)
+        assert set(actual) == set(expected), group
+        for name, values in expected.items():
+            if not path.endswith(".npz") and np.ndim(values) > 0:
+                assert isinstance(actual[name], np.memmap), name
+            np.testing.assert_array_equal(actual[name], values, err_msg=f"{group}.{name}")
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from kkt import BigM_KKT
+from model import HouseModel
+
+
+def build(settings, series, layers, presolve):
+    if layers == "big-M":
+        house = BigM_KKT(settings, *series, 100, presolve=presolve)
+        objective = "primal_obj"
+    else:
+        house = HouseModel(settings, *series, presolve=presolve)
+        house.add_primal()
+        if layers == "dual":
+            house.add_dual()
+        objective = "dual_obj" if layers == "dual" else "primal_obj"
+    getattr(house.model, objective).activate()
+    house.solve("appsi_highs", tee=False)
+    assert house.status.optimal
+    return house
+
+@pytest.mark.parametrize("layers", ["primal", "dual", "big-M"])
+def test_presolve_parity(settings, series, layers):
+    """The presolved model has the optimum of the full model and the full output."""
+    full = build(settings, series, layers, presolve=False)
+    reduced = build(settings, series, layers, presolve=True)
+    assert reduced.status.objective == pytest.approx(full.status.objective, rel=1e-7, abs=1e-9)
+
+    hours_no_PV = reduced.hours_no_PV
+    assert 0 < len(hours_no_PV) < len(reduced.T)
+    assert reduced.reductions["primal"].rows == len(hours_no_PV)
+    assert sum(reduction.rows for reduction in reduced.reductions.values()) > 0
+
+    expected, actual = full.get_output().variables, reduced.get_output().variables
+    assert list(actual) == list(expected)
+    for name, values in expected.items():
+        assert np.shape(actual[name]) == np.shape(values), name
+    for name in ["capacity_PV", "capacity_battery"]:
+        assert actual[name] == pytest.approx(expected[name], rel=1e-6, abs=1e-7), name
+    assert np.all(np.asarray(actual["energy_PV"])[hours_no_PV] == 0)
+
+    if layers != "primal":
+        # the reconstructed duals are feasible and complementary to energy_PV = 0
+        price = np.asarray(actual["dual_eq_demand"])[hours_no_PV]
+        limit = np.asarray(actual["dual_limit_PV"])[hours_no_PV]
+        assert np.all(price + limit <= 1e-9)
+        assert np.all(limit <= 1e-12)
+
+def test_presolve_arrays(settings, series):
+    reduced = build(settings, series, "dual", presolve=True)
+    arrays = reduced.get_arrays()
+    output = reduced.get_output().variables
+    for name, values in output.items():
+        np.testing.assert_allclose(arrays.variables[name], values, err_msg=name)
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from model import HouseModel
+from sensitivity import COST_PARAMETERS, _Highs, ranging
+
+
+def solved(settings, series):
+    house = HouseModel(settings, *series)
+    house.add_primal()
+    house.model.primal_obj.activate()
+    house.solve("appsi_highs", tee=False)
+    assert house.status.optimal
+    return house
+
+def test_ranging_validation(settings, series):
+    """The predicted objective holds at every checked edge of the intervals."""
+    sensitivity = ranging(solved(settings, series), validate=True, validate_hours=6)
+    assert set(sensitivity.ranges) == set(COST_PARAMETERS) | {"Demand", "Demand_total"}
+    for name, error in sensitivity.validation.items():
+        assert error < 1e-6, name
+
+@pytest.mark.parametrize("name", list(COST_PARAMETERS) + ["Demand_total"])
+def test_ranging_inside(settings, series, name):
+    """Inside the interval the objective moves with the marginal, a rebuilt model agrees."""
+    house = solved(settings, series)
+    sensitivity = ranging(house)
+    bounds = sensitivity.ranges[name]
+    value, lower, upper = float(bounds.value), float(bounds.lower), float(bounds.upper)
+    assert lower <= value <= upper
+    # a point strictly inside the interval, or a small step if it is unbounded
+    upper = min(upper, value + max(abs(value), 1.0))
+    target = value + 0.5 * (upper - value)
+    # the capacity costs are Price / Lifetime
+    field = {"Cost_PV": "Price_PV", "Cost_battery": "Price_battery"}.get(name, name)
+    scale = settings.Lifetime if field != name else 1.0
+    settings_moved = settings.model_copy(update={field: target * scale})
+    if settings_moved.Sell_price > settings_moved.Cost_buy:
+        pytest.skip("the moved settings allow arbitrage")
+    moved = solved(settings_moved, series)
+    expected = sensitivity.objective + float(bounds.marginal) * (target - value)
+    assert moved.status.objective == pytest.approx(expected, rel=1e-7)
+
+def test_ranging_demand_hour(settings, series):
+    house = solved(settings, series)
+    bounds = ranging(house).ranges["Demand"]
+    hour = int(np.argmax(bounds.upper - bounds.value > 0))
+    step = 0.5 * min(bounds.upper[hour] - bounds.value[hour], 0.01)
+    Demand = np.array(series[1], dtype=float)
+    Demand[hour] += step
+    moved = solved(settings, (series[0], Demand))
+    expected = house.status.objective + bounds.marginal[hour] * step
+    assert moved.status.objective == pytest.approx(expected, rel=1e-7)
+
+def test_private_interface_missing():
+    with pytest.raises(RuntimeError, match="Pyomo"):
+        _Highs(object())
@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from service import JobRequest, SolveService
+
+
+def request(settings, series, **fields) -> JobRequest:
+    PV_availability, Demand = series
+    return JobRequest(settings=settings, PV_availability=list(PV_availability[:24]), Demand=list(Demand[:24]), **fields)
+
+async def finish(service: SolveService, jobs) -> None:
+    runner = asyncio.create_task(service.run())
+    try:
+        while any(job.state in ("queued", "running") for job in jobs):
+            await asyncio.sleep(0.05)
+    finally:
+        runner.cancel()
+
+def test_deduplication_and_priority(settings, series):
+    """Identical jobs are solved once, one worker runs the queue in the order of the priorities."""
+    async def main():
+        service = SolveService(workers=1)
+        low, _ = service.submit(request(settings, series, priority=5))
+        middle, _ = service.submit(request(settings.model_copy(update={"Cost_buy": 0.3}), series, priority=1))
+        high, _ = service.submit(request(settings.model_copy(update={"Cost_buy": 0.35}), series, priority=3))
+        # the same scenario with a higher priority moves the queued job forward
+        again, deduplicated = service.submit(request(settings, series, priority=0))
+        assert deduplicated and again is low
+        assert (low.requests, low.priority, service.deduplicated) == (2, 0, 1)
+
+        await finish(service, [low, middle, high])
+        assert [job.state for job in (low, middle, high)] == ["done"] * 3
+        assert low.started < middle.started < high.started
+        assert not service.in_flight
+        # the final event of every job is its result, after the progress events
+        for job in (low, middle, high):
+            assert job.events[0]["event"] == "started"
+            assert job.events[-1]["event"] == "result"
+            assert job.events[-1]["result"]["status"]["optimal"]
+        assert [event async for event in service.stream(low)] == low.events
+        metrics = service.metrics()
+        assert (metrics["done"], metrics["deduplicated"], metrics["run"]["count"]) == (3, 1, 3)
+
+        # a finished scenario is solved again
+        _, deduplicated = service.submit(request(settings, series))
+        assert not deduplicated
+    asyncio.run(main())
+
+def test_error_and_timeout(settings, series):
+    async def main():
+        service = SolveService(workers=2, grace=0.0)
+        PV_availability, Demand = series
+        broken, _ = service.submit(JobRequest(settings=settings, PV_availability=list(PV_availability[:24]), Demand=list(Demand[:12])))
+        # the limit of 2 * time_limit + grace ends before the worker process has started
+        slow, _ = service.submit(request(settings, series, time_limit=1e-3))
+        await finish(service, [broken, slow])
+
+        assert broken.state == "failed"
+        assert "ValueError" in broken.events[-1]["error"]
+        assert slow.state == "timeout"
+        assert slow.events[-1] == {"event": "timeout", "limit": pytest.approx(2e-3)}
+        assert not service.in_flight
+        assert service.metrics()["failed"] == 2
+    asyncio.run(main())
@@ -0,0 +1,27 @@
+import pytest
+
+from model import Settings
+from stochastic import ScenarioSettings, extensive_form, progressive_hedging
+
+HOURS = 336
+
+@pytest.fixture
+def two_weeks():
+    return Settings(Lifetime=round(10 * 8760 / HOURS), Price_PV=1000, Price_battery=300, Cost_buy=0.25, Sell_price=0.05, Demand_total=3500)
+
+def test_progressive_hedging_converges(two_weeks):
+    """Progressive hedging reaches the optimum of the extensive form."""
+    scenario_settings = ScenarioSettings(hours=HOURS)
+    extensive = extensive_form(two_weeks, 6, scenario_settings)
+    result = progressive_hedging(two_weeks, 6, scenario_settings, processes=1)
+    assert result.converged
+    assert result.objective == pytest.approx(extensive.objective, rel=1e-5)
+    assert result.lower_bound <= extensive.objective + 1e-9
+
+def test_unbounded_scenarios(two_weeks):
+    """Both methods raise for scenarios in which selling PV pays for its capacity."""
+    scenario_settings = ScenarioSettings(hours=HOURS, start=2880)
+    with pytest.raises(ValueError, match="unbounded"):
+        extensive_form(two_weeks, 6, scenario_settings)
+    with pytest.raises(ValueError, match="unbounded"):
+        progressive_hedging(two_weeks, 6, scenario_settings, processes=1)
@@ -0,0 +1,87 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from surrogate import Surrogate
+from sweep import KPI_NAMES
+
+
+def grid(settings):
+    """Settings on a 3 x 3 grid of the battery price and the buying price."""
+    return [settings.model_copy(update={"Price_battery": battery, "Cost_buy": buy})
+            for battery, buy in itertools.product([150, 300, 450], [0.2, 0.25, 0.3])]
+
+@pytest.fixture
+def surrogate(settings, series):
+    surrogate = Surrogate(*series)
+    for point in grid(settings):
+        surrogate.add(point, surrogate.solve(point))
+    assert surrogate.kernel is not None
+    return surrogate
+
+def test_untrained(settings, series):
+    surrogate = Surrogate(*series)
+    prediction = surrogate.predict(settings)
+    assert (prediction.source, prediction.reason) == ("exact", "untrained")
+    assert surrogate.samples == 1
+    with pytest.raises(Exception, match="cannot answer"):
+        surrogate.predict(settings, exact=False)
+
+def test_calibration(settings, surrogate):
+    """Between the samples the errors of the KPIs lie within a few standard deviations."""
+    for battery, buy in itertools.product([225, 375], [0.225, 0.275]):
+        query = settings.model_copy(update={"Price_battery": battery, "Cost_buy": buy})
+        mean, std = surrogate.estimate(query)
+        exact = surrogate.solve(query)
+        for i, name in enumerate(KPI_NAMES):
+            assert abs(getattr(exact, name) - mean[i]) <= 4 * std[i] + 1e-9, (battery, buy, name)
+
+def test_fallback_reasons(settings, surrogate):
+    inside = settings.model_copy(update={"Price_battery": 225, "Cost_buy": 0.225})
+    prediction = surrogate.predict(inside, kpis=["TOTEX"])
+    assert prediction.source == "surrogate"
+    exact = surrogate.solve(inside)
+
+    outside = settings.model_copy(update={"Cost_buy": 0.6})
+    with pytest.raises(Exception, match="outside"):
+        surrogate.predict(outside, exact=False)
+    prediction = surrogate.predict(outside)
+    assert (prediction.source, prediction.reason) == ("exact", "outside")
+    assert all(std == 0 for std in prediction.std.values())
+
+    surrogate.tolerance = {"TOTEX": 0.0}
+    samples = surrogate.samples
+    prediction = surrogate.predict(inside, kpis=["TOTEX"])
+    assert (prediction.source, prediction.reason) == ("exact", "uncertain")
+    assert prediction.kpis["TOTEX"] == pytest.approx(exact.TOTEX, rel=1e-9)
+    assert surrogate.samples == samples + 1
+
+def test_tolerance_near_zero(settings, series):
+    """A KPI that is 0 in all samples is judged against an absolute floor, not against 0."""
+    surrogate = Surrogate(*series)
+    for battery, buy in itertools.product([150, 300, 450], [0.18, 0.19, 0.2]):
+        point = settings.model_copy(update={"Price_battery": battery, "Cost_buy": buy})
+        surrogate.add(point, surrogate.solve(point))
+    battery = KPI_NAMES.index("Cap_Bat")
+    assert np.all(np.abs(surrogate.Y[:, battery]) < 1e-9)
+    query = settings.model_copy(update={"Price_battery": 225, "Cost_buy": 0.195})
+    mean, std = surrogate.estimate(query)
+    assert std[battery] > surrogate.rtol * abs(mean[battery])
+    prediction = surrogate.predict(query, kpis=["Cap_Bat"])
+    assert prediction.source == "surrogate"
+    assert prediction.kpis["Cap_Bat"] == pytest.approx(0, abs=1e-6)
+
+def test_extend(settings, surrogate):
+    """The rank-one update equals the inverse kernel matrix and weights of all samples at the same kernel."""
+    point = settings.model_copy(update={"Price_battery": 375, "Cost_buy": 0.275})
+    added = surrogate.added
+    surrogate.add(point, surrogate.solve(point))
+    assert surrogate.added == added + 1 < surrogate.refit
+    Z = surrogate.Z
+    assert len(Z) == surrogate.samples
+    K = np.exp(-0.5 * np.sum((Z[:, None, :] - Z[None, :, :]) ** 2, axis=2) / surrogate.length ** 2) + surrogate.noise * np.eye(len(Z))
+    inverse = np.linalg.inv(K)
+    np.testing.assert_allclose(surrogate.inverse, inverse, rtol=1e-6, atol=1e-6 * np.abs(inverse).max())
+    alpha = inverse @ ((surrogate.Y - surrogate.y_mean) / surrogate.y_std)
+    np.testing.assert_allclose(surrogate.alpha, alpha, rtol=1e-6, atol=1e-6 * np.abs(alpha).max())
@@ -0,0 +1,54 @@
+import os
+
+import numpy as np
+import pytest
+
+from conftest import DATA
+from timeseries import convert, load_store
+
+
+def test_store_round_trip(tmp_path):
+    """load_store converts the bundled CSV profiles and maps them back unchanged."""
+    sources = {
+        "PV_availability": [os.path.join(DATA, "TS_PVAvail.csv")],
+        "Demand": [os.path.join(DATA, "TS_Demand.csv")],
+    }
+    store = load_store(sources, str(tmp_path))
+    for quantity, (path,) in sources.items():
+        expected = np.loadtxt(path)
+        assert store.info.profiles[quantity] == [os.path.splitext(os.path.basename(path))[0]]
+        assert isinstance(store.matrix(quantity), np.memmap)
+        np.testing.assert_array_equal(store.get(quantity), expected)
+        np.testing.assert_array_equal(store.get(quantity, start=24, stop=48), expected[24:48])
+    assert store.hours == len(np.loadtxt(sources["Demand"][0]))
+
+def test_store_columns_and_refresh(tmp_path):
+    """Every CSV column is a profile, a newer CSV file is converted again."""
+    rng = np.random.default_rng(0)
+    PV, Demand = rng.random((48, 2)), rng.random((48, 1))
+    PV_path, Demand_path = str(tmp_path / "pv.csv"), str(tmp_path / "demand.csv")
+    np.savetxt(PV_path, PV, delimiter=",")
+    np.savetxt(Demand_path, Demand, delimiter=",")
+    sources = {"PV_availability": [PV_path], "Demand": [Demand_path]}
+    directory = str(tmp_path / "store")
+
+    store = load_store(sources, directory)
+    assert store.info.profiles == {"PV_availability": ["pv:0", "pv:1"], "Demand": ["demand"]}
+    np.testing.assert_array_equal(store.subset("PV_availability", ["pv:0", "pv:1"]), PV.T)
+    np.testing.assert_array_equal(store.subset("PV_availability", [1, 0], 0, 24), PV[:24, ::-1].T)
+    PV_window, Demand_window = store.inputs("pv:1", "demand", 12, 36)
+    np.testing.assert_array_equal(PV_window, PV[12:36, 1])
+    np.testing.assert_array_equal(Demand_window, Demand[12:36, 0])
+    with pytest.raises(ValueError, match="window"):
+        store.get("Demand", stop=49)
+
+    np.savetxt(Demand_path, 2 * Demand, delimiter=",")
+    info = os.path.join(directory, "store.json")
+    os.utime(info, (0, 0))
+    np.testing.assert_array_equal(load_store(sources, directory).get("Demand"), 2 * Demand[:, 0])
+
+def test_store_lengths(tmp_path):
+    np.savetxt(tmp_path / "pv.csv", np.ones(48))
+    np.savetxt(tmp_path / "demand.csv", np.ones(24))
+    with pytest.raises(ValueError, match="Length"):
+        convert({"PV_availability": [str(tmp_path / "pv.csv")], "Demand": [str(tmp_path / "demand.csv")]}, str(tmp_path / "store"))
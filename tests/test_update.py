@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from model import HouseModel
+from sweep import scale
+
+
+def solve(settings, PV_availability, Demand, house = None):
+    """Objective and capacities of the primal model, re-solving house if given."""
+    if house is None:
+        house = HouseModel(settings, PV_availability, Demand)
+        house.add_primal()
+        house.model.primal_obj.activate()
+    house.solve("appsi_highs", tee=False)
+    assert house.status.optimal
+    return house.status.objective, house.model.capacity_PV.value, house.model.capacity_battery.value
+
+@pytest.mark.parametrize("scaling", [
+    {"Price_PV": 1.2},
+    {"Price_battery": 0.5},
+    {"Cost_buy": 1.3, "Sell_price": 0.8},
+    {"Demand_total": 2.0, "Price_PV": 0.9},
+])
+def test_update_settings(settings, series, scaling):
+    house = HouseModel(settings, *series, mutable=True)
+    house.add_primal()
+    house.model.primal_obj.activate()
+    solve(settings, *series, house)
+
+    changed = scale(settings, scaling)
+    house.update(settings=changed)
+    np.testing.assert_allclose(solve(changed, *series, house), solve(changed, *series), rtol=1e-6, atol=1e-9)
+
+def test_update_demand(settings, series):
+    PV_availability, Demand = series
+    house = HouseModel(settings, PV_availability, Demand, mutable=True)
+    house.add_primal()
+    house.model.primal_obj.activate()
+    solve(settings, PV_availability, Demand, house)
+
+    shifted = np.roll(Demand, 12)
+    house.update(demand=shifted)
+    np.testing.assert_allclose(solve(settings, PV_availability, shifted, house), solve(settings, PV_availability, shifted), rtol=1e-6, atol=1e-9)
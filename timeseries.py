@@ -0,0 +1,118 @@
+import json
+import os
+
+import numpy as np
+from pydantic import BaseModel
+
+# quantity -> CSV files with one column per profile, the names match the HouseModel arguments
+SOURCES = {
+    "PV_availability": ["data/TS_PVAvail.csv"],
+    "Demand": ["data/TS_Demand.csv"],
+}
+STORE = "data/store"
+
+class StoreInfo(BaseModel):
+    hours: int
+    # quantity -> profile names, the row order of <quantity>.npy
+    profiles: dict[str, list[str]]
+    # profile name -> free metadata, e.g. the source file and column
+    metadata: dict[str, dict[str, str | int | float]] = {}
+
+
+def convert(sources: dict[str, list[str]] = SOURCES, directory: str = STORE) -> StoreInfo:
+    """Parse the CSV files once and store every quantity as a (profiles, hours) float64 matrix.
+
+    Every column of a CSV file is one profile, named after the file (and the
+    column if there are several). All profiles of all quantities need the
+    same number of hours, as HouseModel requires equal lengths.
+    """
+    os.makedirs(directory, exist_ok=True)
+    hours = None
+    profiles = {}
+    metadata = {}
+    for quantity, files in sources.items():
+        rows = []
+        profiles[quantity] = []
+        for path in files:
+            values = np.loadtxt(path, delimiter=",", ndmin=2)
+            stem = os.path.splitext(os.path.basename(path))[0]
+            for column in range(values.shape[1]):
+                name = stem if values.shape[1] == 1 else f"{stem}:{column}"
+                profiles[quantity].append(name)
+                metadata[name] = {"quantity": quantity, "source": path, "column": column}
+                rows.append(values[:, column])
+        matrix = np.vstack(rows)
+        if hours is None:
+            hours = matrix.shape[1]
+        if matrix.shape[1] != hours:
+            raise ValueError(f"Length of the {quantity} profiles ({matrix.shape[1]}) should be equal to the other profiles ({hours})")
+        # write under a temporary name, so that readers never map a partial file
+        temporary = os.path.join(directory, quantity + ".tmp.npy")
+        np.save(temporary, np.ascontiguousarray(matrix, dtype=np.float64))
+        os.replace(temporary, os.path.join(directory, quantity + ".npy"))
+
+    info = StoreInfo(hours=hours, profiles=profiles, metadata=metadata)
+    with open(os.path.join(directory, "store.json"), "w") as file:
+        file.write(info.model_dump_json(indent=1))
+    return info
+
+
+class TimeSeriesStore:
+    """Memory-mapped time series of a store written by convert().
+
+    Windows of a single profile are views into the mapped file, so nothing is
+    copied or parsed until the values are used.
+    """
+    def __init__(self, directory: str = STORE):
+        self.directory = directory
+        with open(os.path.join(directory, "store.json")) as file:
+            self.info = StoreInfo(**json.load(file))
+        self._matrices = {}
+
+    @property
+    def hours(self) -> int:
+        return self.info.hours
+
+    def matrix(self, quantity: str) -> np.ndarray:
+        """All profiles of a quantity as a read-only (profiles, hours) memmap."""
+        if quantity not in self.info.profiles:
+            raise ValueError(f"unknown quantity {quantity}, use one of {list(self.info.profiles)}")
+        if quantity not in self._matrices:
+            self._matrices[quantity] = np.load(os.path.join(self.directory, quantity + ".npy"), mmap_mode="r")
+        return self._matrices[quantity]
+
+    def _row(self, quantity: str, profile: int | str) -> int:
+        if isinstance(profile, str):
+            return self.info.profiles[quantity].index(profile)
+        return profile
+
+    def _window(self, start: int, stop: int | None) -> slice:
+        stop = self.hours if stop is None else stop
+        if not 0 <= start < stop <= self.hours:
+            raise ValueError(f"the window [{start}, {stop}) should lie within the {self.hours} hours of the store")
+        return slice(start, stop)
+
+    def get(self, quantity: str, profile: int | str = 0, start: int = 0, stop: int | None = None) -> np.ndarray:
+        """One profile over the hours [start, stop), a zero-copy view."""
+        return self.matrix(quantity)[self._row(quantity, profile), self._window(start, stop)]
+
+    def subset(self, quantity: str, profiles: list[int | str], start: int = 0, stop: int | None = None) -> np.ndarray:
+        """Several profiles as a (len(profiles), hours) array, a view if the rows are consecutive."""
+        rows = [self._row(quantity, profile) for profile in profiles]
+        window = self._window(start, stop)
+        if rows == list(range(rows[0], rows[0] + len(rows))):
+            return self.matrix(quantity)[rows[0]:rows[0] + len(rows), window]
+        return self.matrix(quantity)[rows, window]
+
+    def inputs(self, PV_profile: int | str = 0, Demand_profile: int | str = 0, start: int = 0, stop: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """(PV_availability, Demand) of equal length for HouseModel and its subclasses."""
+        return self.get("PV_availability", PV_profile, start, stop), self.get("Demand", Demand_profile, start, stop)
+
+
+def load_store(sources: dict[str, list[str]] = SOURCES, directory: str = STORE) -> TimeSeriesStore:
+    """Open the store, converting the CSV files first if the store is missing or older than them."""
+    info = os.path.join(directory, "store.json")
+    files = [path for paths in sources.values() for path in paths]
+    if not os.path.exists(info) or os.path.getmtime(info) < max(os.path.getmtime(path) for path in files):
+        convert(sources, directory)
+    return TimeSeriesStore(directory)